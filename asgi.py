@@ -0,0 +1,11 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+
+from caprice.asgi import loadapp
+
+_app = loadapp(
+    'config:config.ini', 
+    name=os.environ.get('ENVIRONMENT_TYPE', 'develop'), 
+    relative_to='.')
@@ -6,30 +6,86 @@ from logging import DEBUG
 
 from flask import Flask
 from flask_debugtoolbar import DebugToolbarExtension
+from paste.deploy.converters import asbool
 
+from . import codec, compression
 from .config import settings
 from .db import init as init_db
+from .metrics import init as init_metrics, instrument_engine
+from .validators import validator_cache
+
+# Optional keys of PasteDeploy config -> (config key, converter)
+POOL_CONF = {
+    'pool_size': ('DATABASE_POOL_SIZE', int),
+    'max_overflow': ('DATABASE_MAX_OVERFLOW', int),
+    'pool_timeout': ('DATABASE_POOL_TIMEOUT', float),
+    'pool_recycle': ('DATABASE_POOL_RECYCLE', int),
+    'pool_pre_ping': ('DATABASE_POOL_PRE_PING', asbool),
+}
 
 def create_app(global_config, **local_conf):
     # TODO: Use PasteDeploy config directly.
     conf = settings[local_conf['config_key']]
     conf.DATABASE_URL = local_conf['database_url']
-    return _create_app(conf)
+    for name, (key, converter) in POOL_CONF.items():
+        if name in local_conf:
+            setattr(conf, key, converter(local_conf[name]))
+    # Standalone runners(e.g. python -m caprice.sweeper) disable the threads in the application.
+    return _create_app(conf, asbool(global_config.get('background_threads', True)))
     #return _create_app(settings[local_conf['config_key']])
 
-def _create_app(setting):
+def _create_app(setting, background_threads=True):
     app = Flask(__name__)
 
     app.logger.setLevel(DEBUG)
     app.logger.debug('Init root logger.')
 
     app.config.from_object(setting)
+    codec.use(app.config.get('JSON_CODEC', 'auto'))
+    app.json = codec.CodecJSONProvider(app)
+    compression.configure(
+        app.config.get('BODY_COMPRESSION'),
+        app.config.get('BODY_COMPRESSION_THRESHOLD', 16384),
+        app.config.get('BODY_COMPRESSION_LEVEL'))
     if app.debug:
         DebugToolbarExtension(app)
 
     from .views import api
     app.register_blueprint(api, url_prefix='/api')
 
-    init_db(app)
+    init_metrics(app)
+    instrument_engine(init_db(app))
+    validator_cache.maxsize = app.config.get('VALIDATOR_CACHE_SIZE', validator_cache.maxsize)
+
+    if background_threads:
+        _start_background_threads(app)
 
     return app
+
+def _start_background_threads(app):
+    starters = []
+    if app.config.get('LOCK_SWEEP_INTERVAL'):
+        from . import sweeper
+        starters.append(sweeper.start)
+    if app.config.get('JOB_POLL_INTERVAL'):
+        from . import jobs
+        starters.append(jobs.start)
+    if not starters:
+        return
+
+    def start():
+        for starter in starters:
+            starter(app)
+
+    try:
+        import uwsgi
+        from uwsgidecorators import postfork
+    except ImportError:
+        start()
+        return
+    # Threads don't survive fork. Without lazy-apps, the application is loaded
+    # in uWSGI master, and the threads are started in each worker after fork.
+    if uwsgi.worker_id() == 0:
+        postfork(start)
+    else:
+        start()
@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""ASGI application of the API.
+
+Routes where clients may wait long(list exports, document reads polled by
+clients, blocking lock acquisition) are served on asyncio with SQLAlchemy's
+asyncio engine(asyncpg/aiosqlite), so idle clients don't occupy a thread.
+Other routes are delegated to the Flask application(views.py) on a thread pool.
+Both are created from the same PasteDeploy config.
+
+It needs optional packages: pip install Caprice[asgi]
+
+    $ uvicorn asgi:_app
+"""
+
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import datetime
+from logging import getLogger
+
+from a2wsgi import WSGIMiddleware
+from paste.deploy import loadapp as load_wsgi_app
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header, parse_etags, quote_etag
+
+from . import codec, notify
+from .db import POOL_OPTIONS
+from .fields import parse_fields, Projection
+from .filters import parse_where, Filter
+from .listing import page_limit, key_value, page, dump_item, dump_list
+from .models import Schema, Resource, Lock, ResourceNotFoundError, LockConflictError
+from .params import lock_resources, lock_ttl, lock_wait
+
+# Handlers of this logger depends on Flask application
+logger = getLogger(__name__)
+
+__all__ = ['loadapp', 'create_asgi_app']
+
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+}
+
+class AsyncNotifier(object):
+    """Waiters of released locks on the event loop. It's woken via notify.py."""
+
+    def __init__(self):
+        self.generation = 0
+        self._event = asyncio.Event()
+
+    def wake(self):
+        # Called in the event loop.
+        self.generation += 1
+        self._event.set()
+        self._event = asyncio.Event()
+
+    async def wait(self, generation, timeout):
+        if self.generation == generation:
+            try:
+                await asyncio.wait_for(self._event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.generation != generation
+
+def _async_url(url):
+    url = make_url(url)
+    return url.set(drivername=ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername))
+
+def _engine_options(config):
+    url = make_url(config['DATABASE_URL'])
+    # In-memory SQLite doesn't use QueuePool.
+    if url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+        return {}
+    return dict(
+        (arg, config[key]) for key, arg in POOL_OPTIONS.items()
+        if config.get(key) is not None)
+
+def _error(message, status_code):
+    return JSONResponse({'error': {'message': message}}, status_code=status_code)
+
+async def _get_json(request):
+    # Same as request.get_json(silent=True) of Flask
+    mimetype = request.headers.get('content-type', '').split(';')[0].strip()
+    if not (mimetype == 'application/json'
+            or (mimetype.startswith('application/') and mimetype.endswith('+json'))):
+        return None
+    try:
+        return codec.loads(await request.body())
+    except ValueError:
+        return None
+
+def _best_accept(request):
+    return parse_accept_header(request.headers.get('accept'), MIMEAccept).best
+
+def _projection(request, model):
+    """Projection of ``fields`` parameters, or None if they aren't given."""
+    if 'fields' not in request.query_params:
+        return None
+    return Projection(
+        model, request.app.state.engine.dialect.name,
+        parse_fields(request.query_params.getlist('fields')))
+
+async def _list(request, name, model, query, projection=None, where=None):
+    state = request.app.state
+    try:
+        after = request.query_params.get('after')
+        if after is not None:
+            query = query.where(model.id > key_value(after, model.id))
+        stream = (request.query_params.get('stream') in ('1', 'true')
+                  or _best_accept(request) == 'application/x-ndjson')
+        limit = None if stream else page_limit(request.query_params.get('limit'), state.config)
+    except ValueError as e:
+        return _error(str(e), 400)
+    query = query.order_by(model.id)
+    if stream:
+        return _stream(request, name, query, projection, where)
+
+    async with state.sessionmaker() as s:
+        # One extra row tells whether the next page exists.
+        if projection is None:
+            rows = (await s.scalars(query.limit(limit + 1))).all()
+        else:
+            rows = (await s.execute(query.limit(limit + 1))).all()
+    # Compressed bodies are filtered here. The page may be short.
+    rows, _next = page(rows, limit, model.id, where)
+    return Response(dump_list(name, rows, _next, projection), media_type='application/json')
+
+def _stream(request, name, query, projection=None, where=None):
+    state = request.app.state
+    query = query.execution_options(yield_per=state.config.get('STREAM_CHUNK_SIZE', 500))
+    ndjson = _best_accept(request) == 'application/x-ndjson'
+
+    async def generate():
+        async with state.sessionmaker() as s:
+            if projection is None:
+                rows = await s.stream_scalars(query)
+            else:
+                rows = await s.stream(query)
+            if ndjson:
+                async for row in rows:
+                    if where is None or where.match(row):
+                        yield dump_item(row, projection) + '\n'
+                return
+            yield '{{"{0}": ['.format(name)
+            sep = ''
+            async for row in rows:
+                if where is not None and not where.match(row):
+                    continue
+                yield sep + dump_item(row, projection)
+                sep = ', '
+            yield ']}'
+    return StreamingResponse(
+        generate(), media_type='application/x-ndjson' if ndjson else 'application/json')
+
+async def _document(request, s, model, _id, not_found, projection=None):
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match:
+        # Only the hash column is read, so the body isn't loaded.
+        body_hash = await s.scalar(select(model.body_hash).where(model.id==_id))
+        if body_hash and projection is not None:
+            body_hash = projection.etag(body_hash)
+        if body_hash and body_hash in parse_etags(if_none_match):
+            return Response(status_code=304, headers={'ETag': quote_etag(body_hash)})
+    if projection is not None:
+        row = (await s.execute(
+            select(model.body_hash, *projection.columns).where(model.id==_id))).first()
+        if not row:
+            return _error(not_found, 404)
+        headers = {'ETag': quote_etag(projection.etag(row.body_hash))} if row.body_hash else {}
+        return Response(projection.dump(row), media_type='application/json', headers=headers)
+    obj = await s.scalar(select(model).where(model.id==_id))
+    if not obj:
+        return _error(not_found, 404)
+    return Response(
+        obj.raw_json, media_type='application/json', headers={'ETag': quote_etag(obj.etag)})
+
+async def schemas(request):
+    return await _list(request, 'schemas', Schema, select(Schema))
+
+async def schema_id(request):
+    async with request.app.state.sessionmaker() as s:
+        return await _document(
+            request, s, Schema, request.path_params['_id'], "Schema isn't found.")
+
+async def _schema_exists(s, _id):
+    return await s.scalar(select(Schema.id).where(Schema.id==_id)) is not None
+
+async def resources(request):
+    state = request.app.state
+    schema_id = request.path_params['schema_id']
+    async with state.sessionmaker() as s:
+        if not await _schema_exists(s, schema_id):
+            return _error("Schema isn't found.", 404)
+    try:
+        projection = _projection(request, Resource)
+        # Only the requested fields are read.
+        query = select(Resource) if projection is None else select(*projection.columns)
+        query = query.where(Resource.schema_id==schema_id)
+        where = None
+        exprs = request.query_params.getlist('where')
+        if exprs:
+            where = Filter(Resource, state.engine.dialect.name, [parse_where(expr) for expr in exprs])
+            query = query.where(where.clause)
+    except ValueError as e:
+        return _error(str(e), 400)
+    return await _list(request, 'resources', Resource, query, projection, where)
+
+async def resource_id(request):
+    try:
+        projection = _projection(request, Resource)
+    except ValueError as e:
+        return _error(str(e), 400)
+    async with request.app.state.sessionmaker() as s:
+        if not await _schema_exists(s, request.path_params['schema_id']):
+            return _error("Schema isn't found.", 404)
+        return await _document(
+            request, s, Resource, request.path_params['resource_id'], "Resource isn't found.",
+            projection)
+
+async def _acquire(state, resource_ids, ttl, wait):
+    """Same as Lock.acquire, but it waits on the event loop."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + wait
+    while True:
+        # Taken before the attempt, not to miss the release during it.
+        generation = state.notifier.generation
+        async with state.sessionmaker() as s:
+            try:
+                lock = await s.run_sync(Lock.acquire_in, resource_ids, ttl)
+                await s.commit()
+                return lock.id
+            except IntegrityError:
+                await s.rollback()
+                error = LockConflictError('Resources are already locked.')
+            except LockConflictError as e:
+                await s.rollback()
+                error = e
+        timeout = deadline - loop.time()
+        if timeout <= 0:
+            raise error
+        if error.retry_at:
+            timeout = min(timeout, max(
+                (error.retry_at - datetime.utcnow()).total_seconds(), 0.01))
+        await state.notifier.wait(generation, timeout)
+
+async def locks(request):
+    config = request.app.state.config
+    body = await _get_json(request)
+    try:
+        resources = lock_resources(body)
+        ttl = lock_ttl(body, config)
+        wait = lock_wait(request.query_params.get('wait'), config)
+    except ValueError as e:
+        return _error(str(e), 400)
+    try:
+        lock_id = await _acquire(request.app.state, resources, ttl, wait)
+    except ResourceNotFoundError as e:
+        return _error(str(e), 404)
+    except LockConflictError as e:
+        return _error(str(e), 409)
+    return JSONResponse({'id': lock_id}, status_code=201)
+
+def create_asgi_app(wsgi_app):
+    """ASGI application serving the routes of ``wsgi_app``(Flask application of create_app)."""
+    config = wsgi_app.config
+    engine = create_async_engine(_async_url(config['DATABASE_URL']), **_engine_options(config))
+
+    @asynccontextmanager
+    async def lifespan(app):
+        loop = asyncio.get_running_loop()
+        app.state.notifier = AsyncNotifier()
+
+        def wake():
+            loop.call_soon_threadsafe(app.state.notifier.wake)
+        # Releases in Flask threads and in other processes(PostgreSQL) wake the waiters.
+        notify.subscribe(wake)
+        notify.listen()
+        try:
+            yield
+        finally:
+            notify.unsubscribe(wake)
+            await engine.dispose()
+
+    app = Starlette(
+        routes=[
+            Route('/api/schemas', schemas, methods=['GET']),
+            Route('/api/schemas/{_id}', schema_id, methods=['GET']),
+            Route('/api/schemas/{schema_id}/resources', resources, methods=['GET']),
+            Route('/api/schemas/{schema_id}/resources/{resource_id}', resource_id, methods=['GET']),
+            Route('/api/locks', locks, methods=['POST']),
+            # Other methods and routes
+            Mount('/', WSGIMiddleware(wsgi_app, workers=config.get('ASGI_WSGI_THREADS', 10))),
+        ],
+        lifespan=lifespan)
+    app.state.config = config
+    app.state.engine = engine
+    app.state.sessionmaker = async_sessionmaker(engine, expire_on_commit=False, autoflush=False)
+    return app
+
+def loadapp(uri, name=None, relative_to=None):
+    """Load the ASGI application from PasteDeploy config, same as paste.deploy.loadapp."""
+    return create_asgi_app(load_wsgi_app(uri, name=name, relative_to=relative_to))
@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Benchmark of the API.
+
+Each endpoint is driven through the test client of ``_create_app`` (no
+HTTP server), on a database seeded with the given number of resources.
+Latency(p50/p99) and throughput of each operation are written as JSON,
+to compare the results between commits:
+
+    $ python -m caprice.benchmark --size 1K --size 100K --output before.json
+    $ python -m caprice.benchmark --database-url postgresql://localhost/caprice_bench --size 1M
+
+ATTENTION: All schemas, resources, locks, validation jobs and changes in
+the database are deleted before seeding(unless --reuse).
+"""
+
+import argparse
+import json
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime
+from logging import WARNING
+
+import sqlalchemy
+
+from . import _create_app, codec
+from .db import Session
+from .models import Schema, Resource, Lock, ValidationJob, Change, resource_lock_association
+from .models import validation_job_invalid_resources
+
+__all__ = ['Benchmark', 'parse_size', 'percentile', 'run', 'main']
+
+OPERATIONS = ['schema_create', 'resource_create', 'resource_get', 'resource_list', 'resource_list_fields',
+              'lock_create']
+
+SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'name': {'type': 'string'},
+        'n': {'type': 'integer'},
+        'tags': {'type': 'array', 'items': {'type': 'string'}},
+    },
+    'required': ['name', 'n'],
+}
+
+JSON_HEADERS = {'content-type': 'application/json'}
+
+def parse_size(size):
+    """'1K', '100K', '1M' or a number to int."""
+    size = str(size).strip().upper()
+    for suffix, unit in (('K', 1000), ('M', 1000000)):
+        if size.endswith(suffix):
+            return int(float(size[:-1]) * unit)
+    return int(size)
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of sorted values."""
+    if not sorted_values:
+        return None
+    rank = max(int(-(-p * len(sorted_values) // 100)), 1)
+    return sorted_values[rank - 1]
+
+def _resource(n):
+    return {'name': 'resource-{0}'.format(n), 'n': n, 'tags': ['bench', str(n % 10)]}
+
+class Benchmark(object):
+
+    def __init__(self, app, seed=0):
+        self.app = app
+        self.client = app.test_client()
+        self.random = random.Random(seed)
+        self.schema_id = None
+        self.resource_ids = []
+
+    def clear(self):
+        s = Session()
+        s.execute(resource_lock_association.delete())
+        s.query(Lock).delete()
+        s.execute(validation_job_invalid_resources.delete())
+        s.query(ValidationJob).delete()
+        s.query(Change).delete()
+        s.query(Resource).delete()
+        s.query(Schema).delete()
+        s.commit()
+        Session.remove()
+
+    def reuse(self):
+        """Use the resources of the last run. Returns whether they exist."""
+        s = Session()
+        row = s.query(Resource.schema_id, sqlalchemy.func.count(Resource.id)).group_by(
+            Resource.schema_id).order_by(sqlalchemy.func.count(Resource.id).desc()).first()
+        if row:
+            self.schema_id = row[0]
+            self.resource_ids = [
+                r[0] for r in s.query(Resource.id).filter(Resource.schema_id==self.schema_id)]
+        Session.remove()
+        return bool(row)
+
+    def seed(self, size, chunk_size=10000):
+        """Insert resources up to ``size``. Returns elapsed seconds."""
+        start = time.perf_counter()
+        if self.schema_id is None:
+            res, _status = self.schema_create()
+            self.schema_id = json.loads(res.data.decode('utf-8'))['id']
+        while len(self.resource_ids) < size:
+            schema = Session().get(Schema, self.schema_id)
+            base = len(self.resource_ids)
+            values = [_resource(n) for n in range(base, min(base + chunk_size, size))]
+            self.resource_ids.extend(Resource.bulk_save(schema, values))
+            Session.remove()
+        return time.perf_counter() - start
+
+    # Operations. They return the response and the expected status code.
+
+    def schema_create(self):
+        # Same schemas are registered once. (See Schema.register)
+        schema = dict(SCHEMA, title='bench-{0}'.format(self.random.getrandbits(64)))
+        return self.client.post('/api/schemas', data=json.dumps(schema), headers=JSON_HEADERS), 201
+
+    def resource_create(self):
+        return self.client.post(
+            '/api/schemas/{0}/resources'.format(self.schema_id),
+            data=json.dumps(_resource(self.random.randint(0, 1 << 30))),
+            headers=JSON_HEADERS), 201
+
+    def resource_get(self):
+        return self.client.get('/api/schemas/{0}/resources/{1}'.format(
+            self.schema_id, self.random.choice(self.resource_ids))), 200
+
+    def resource_list(self):
+        return self.client.get('/api/schemas/{0}/resources?after={1}'.format(
+            self.schema_id, self.random.choice(self.resource_ids))), 200
+
+    def resource_list_fields(self):
+        return self.client.get('/api/schemas/{0}/resources?fields=/name,/n&after={1}'.format(
+            self.schema_id, self.random.choice(self.resource_ids))), 200
+
+    def lock_create(self):
+        return self.client.post(
+            '/api/locks',
+            data=json.dumps({'resources': [self.random.choice(self.resource_ids)]}),
+            headers=JSON_HEADERS), 201
+
+    def _cleanup(self, operation, res):
+        # Not measured. Following locks must not conflict.
+        if operation == 'lock_create' and res.status_code == 201:
+            self.client.delete('/api/locks/{0}'.format(json.loads(res.data.decode('utf-8'))['id']))
+
+    def measure(self, operation, requests, warmup=0):
+        """Run ``operation`` sequentially. Returns its stats."""
+        func = getattr(self, operation)
+        for _ in range(warmup):
+            res, _status = func()
+            self._cleanup(operation, res)
+        latencies = []
+        errors = 0
+        elapsed = 0.0
+        for _ in range(requests):
+            start = time.perf_counter()
+            res, status = func()
+            latency = time.perf_counter() - start
+            elapsed += latency
+            latencies.append(latency)
+            if res.status_code != status:
+                errors += 1
+            self._cleanup(operation, res)
+        latencies.sort()
+        return {
+            'requests': requests,
+            'errors': errors,
+            'p50_ms': percentile(latencies, 50) * 1000,
+            'p99_ms': percentile(latencies, 99) * 1000,
+            'mean_ms': elapsed / requests * 1000,
+            'max_ms': latencies[-1] * 1000,
+            'throughput_rps': requests / elapsed if elapsed else None,
+        }
+
+def _commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(database_url, sizes, requests=1000, warmup=10, operations=OPERATIONS, seed=0, reuse=False):
+    """Run the benchmark for each size(ascending, seeded incrementally). Returns the report."""
+    class BenchmarkConfig(object):
+        DATABASE_URL = database_url
+        LOCK_TTL = 60
+
+    app = _create_app(BenchmarkConfig)
+    # Debug logs of every request would be measured.
+    app.logger.setLevel(WARNING)
+    bench = Benchmark(app, seed)
+    if not (reuse and bench.reuse()):
+        bench.clear()
+
+    report = {
+        'meta': {
+            'commit': _commit(),
+            'dialect': sqlalchemy.engine.make_url(database_url).get_backend_name(),
+            'python': platform.python_version(),
+            'sqlalchemy': sqlalchemy.__version__,
+            'json_codec': codec.current().name,
+            'requests': requests,
+            'warmup': warmup,
+            'seed': seed,
+            'started_at': datetime.utcnow().isoformat() + 'Z',
+        },
+        'runs': [],
+    }
+    for size in sorted(sizes):
+        seed_seconds = bench.seed(size)
+        report['runs'].append({
+            'size': size,
+            'resources': len(bench.resource_ids),
+            'seed_seconds': seed_seconds,
+            'operations': dict(
+                (operation, bench.measure(operation, requests, warmup)) for operation in operations),
+        })
+    return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m caprice.benchmark', description=__doc__.split('\n\n')[0])
+    parser.add_argument('--database-url', default='sqlite:///caprice_bench.db')
+    parser.add_argument('--size', action='append', type=parse_size,
+                        help='Number of seeded resources, e.g. 1K, 100K, 1M(repeatable, default: 1K)')
+    parser.add_argument('--requests', type=int, default=1000, help='Measured requests per operation')
+    parser.add_argument('--warmup', type=int, default=10, help='Unmeasured requests per operation')
+    parser.add_argument('--operation', action='append', choices=OPERATIONS,
+                        help='Operation to measure(repeatable, default: all)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of random choices')
+    parser.add_argument('--reuse', action='store_true', help='Reuse resources seeded by the last run')
+    parser.add_argument('--output', help='File of the JSON report(default: stdout)')
+    args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+
+    report = run(
+        args.database_url, args.size or [1000], args.requests, args.warmup,
+        args.operation or OPERATIONS, args.seed, args.reuse)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
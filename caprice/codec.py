@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""JSON codec of requests, responses and stored bodies.
+
+JSON_CODEC selects the backend:
+
+- ``auto``(default): orjson if it's installed, otherwise stdlib.
+- ``orjson``: orjson. It must be installed.
+- ``stdlib``: json module.
+
+Stored bodies are always encoded as ``json.dumps`` of stdlib does(C encoder),
+whatever the backend is. orjson writes compact JSON without escaping
+non-ASCII, so bodies and their hashes(ETag) would depend on the backend.
+The backend is used for decoding(requests and stored bodies) and for the
+responses of the Flask JSON provider.
+"""
+
+import json
+import re
+from logging import getLogger
+
+from flask.json.provider import DefaultJSONProvider
+
+# Handlers of this logger depends on Flask application
+logger = getLogger(__name__)
+
+__all__ = ['StdlibCodec', 'OrjsonCodec', 'CodecJSONProvider', 'use', 'current', 'loads', 'dumps', 'dump_body']
+
+class StdlibCodec(object):
+
+    name = 'stdlib'
+
+    def loads(self, s):
+        if isinstance(s, (bytes, bytearray)):
+            s = s.decode('utf-8')
+        return json.loads(s)
+
+    def dumps(self, value, default=None, sort_keys=False):
+        return json.dumps(value, default=default, sort_keys=sort_keys)
+
+    def dump_body(self, value):
+        # Same as the bodies stored before codecs.
+        return json.dumps(value)
+
+class OrjsonCodec(StdlibCodec):
+
+    name = 'orjson'
+
+    def __init__(self):
+        import orjson
+        self._orjson = orjson
+
+    # orjson reads integers out of 64 bits(e.g. below -2**63, 19 digits) as float.
+    # stdlib keeps them. Long digits in strings fall back too, which is harmless.
+    _LONG_DIGITS = re.compile(r'\d{19}')
+    _LONG_DIGITS_BYTES = re.compile(br'\d{19}')
+
+    def loads(self, s):
+        long_digits = self._LONG_DIGITS if isinstance(s, str) else self._LONG_DIGITS_BYTES
+        if long_digits.search(s):
+            return super(OrjsonCodec, self).loads(s)
+        try:
+            return self._orjson.loads(s)
+        except ValueError:
+            # orjson rejects what stdlib accepts, e.g. NaN and Infinity.
+            return super(OrjsonCodec, self).loads(s)
+
+    def dumps(self, value, default=None, sort_keys=False):
+        try:
+            return self._orjson.dumps(
+                value, default=default,
+                option=self._orjson.OPT_SORT_KEYS if sort_keys else None).decode('utf-8')
+        except TypeError:
+            # e.g. integers over 64 bits, non-string keys
+            return super(OrjsonCodec, self).dumps(value, default=default, sort_keys=sort_keys)
+
+CODECS = {
+    'stdlib': StdlibCodec,
+    'orjson': OrjsonCodec,
+}
+
+_codec = StdlibCodec()
+
+def use(name='auto'):
+    """Select the backend for this process. Returns the codec."""
+    global _codec
+    if name == 'auto':
+        try:
+            _codec = OrjsonCodec()
+        except ImportError:
+            _codec = StdlibCodec()
+    elif name in CODECS:
+        _codec = CODECS[name]()
+    else:
+        raise ValueError('JSON codec is unknown: {0}'.format(name))
+    logger.debug('JSON codec: {0}'.format(_codec.name))
+    return _codec
+
+def current():
+    return _codec
+
+def loads(s):
+    return _codec.loads(s)
+
+def dumps(value, default=None, sort_keys=False):
+    return _codec.dumps(value, default=default, sort_keys=sort_keys)
+
+def dump_body(value):
+    """JSON string of ``value`` to store. It doesn't depend on the backend."""
+    return _codec.dump_body(value)
+
+class CodecJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider(request.get_json, jsonify) on the selected codec."""
+
+    def dumps(self, obj, **kwargs):
+        # Compact output(jsonify of non-debug app) is written by the codec.
+        # Pretty-printed or customized output is left to stdlib.
+        if _codec.name == 'stdlib' or kwargs not in ({}, {'separators': (',', ':')}):
+            return super(CodecJSONProvider, self).dumps(obj, **kwargs)
+        return _codec.dumps(obj, default=self.default, sort_keys=self.sort_keys)
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super(CodecJSONProvider, self).loads(s, **kwargs)
+        return _codec.loads(s)
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Compressed storage of JSON bodies.
+
+With BODY_COMPRESSION(``zlib`` or ``zstd``), bodies longer than
+BODY_COMPRESSION_THRESHOLD(bytes) are stored compressed in ``body_z``, and
+``body`` is NULL. The first byte of ``body_z`` is the format marker, so
+rows written with different settings are read alike. ``json``/``raw_json``
+of the models decode them transparently. ``body_hash`` is the hash of the
+JSON string, so ETags don't change by compression.
+
+``where`` filters are evaluated on ``body`` in database, so compressed
+bodies are filtered in Python after they are read(See filters.Filter).
+Existing rows are re-encoded with the current settings by
+``python -m caprice.reencode``.
+
+zstd needs ``zstandard`` package.
+"""
+
+import zlib
+
+__all__ = ['configure', 'encode', 'decode', 'FORMATS']
+
+class Zlib(object):
+
+    marker = b'z'
+
+    def compress(self, data, level=None):
+        return zlib.compress(data, -1 if level is None else level)
+
+    def decompress(self, data):
+        return zlib.decompress(data)
+
+class Zstd(object):
+
+    marker = b's'
+
+    def __init__(self):
+        import zstandard
+        self._zstd = zstandard
+
+    def compress(self, data, level=None):
+        return self._zstd.ZstdCompressor(level=3 if level is None else level).compress(data)
+
+    def decompress(self, data):
+        return self._zstd.ZstdDecompressor().decompress(data)
+
+FORMATS = {
+    'zlib': Zlib,
+    'zstd': Zstd,
+}
+
+_MARKERS = dict((f.marker, name) for name, f in FORMATS.items())
+
+_compressor = None
+_threshold = 16384
+_level = None
+# Loaded lazily, to read rows of the other format.
+_decompressors = {}
+
+def configure(algorithm=None, threshold=16384, level=None):
+    """Compress bodies longer than ``threshold`` with ``algorithm``. None disables compression."""
+    global _compressor, _threshold, _level
+    if algorithm is not None and algorithm not in FORMATS:
+        raise ValueError('Body compression is unknown: {0}'.format(algorithm))
+    _compressor = FORMATS[algorithm]() if algorithm else None
+    _threshold = threshold
+    _level = level
+
+def encode(text):
+    """(body, body_z) to store JSON string ``text``."""
+    data = text.encode('utf-8')
+    if _compressor is None or len(data) < _threshold:
+        return text, None
+    return None, _compressor.marker + _compressor.compress(data, _level)
+
+def decode(body_z):
+    """JSON string of ``body_z``."""
+    body_z = bytes(body_z)
+    name = _MARKERS.get(body_z[:1])
+    if name is None:
+        raise ValueError('Format of compressed body is unknown.')
+    if name not in _decompressors:
+        _decompressors[name] = FORMATS[name]()
+    return _decompressors[name].decompress(body_z[1:]).decode('utf-8')
@@ -4,10 +4,74 @@
 class DevelopConfig(object):
     DEBUG = True
     SECRET_KEY = 'debug_secretkey'
+    # auto(orjson if installed), orjson or stdlib. See codec.py.
+    JSON_CODEC = 'auto'
+    # zlib, zstd or None. Bodies longer than the threshold(bytes) are stored compressed.
+    # See compression.py.
+    BODY_COMPRESSION = None
+    BODY_COMPRESSION_THRESHOLD = 16384
+    VALIDATOR_CACHE_SIZE = 128
+    PAGINATION_LIMIT = 100
+    PAGINATION_MAX_LIMIT = 1000
+    STREAM_CHUNK_SIZE = 500
+    BATCH_MAX_ITEMS = 10000
+    # Lease of locks(seconds)
+    LOCK_TTL = 60
+    LOCK_MAX_TTL = 3600
+    # Max wait of blocking lock(seconds). It must be shorter than harakiri of uWSGI.
+    LOCK_MAX_WAIT = 15
+    # Threads serving Flask routes in the ASGI application
+    ASGI_WSGI_THREADS = 10
+    LOCK_SWEEP_INTERVAL = 30
+    LOCK_SWEEP_BATCH_SIZE = 1000
+    # Validation jobs(See jobs.py). None of JOB_PROCESSES is the number of CPUs.
+    JOB_POLL_INTERVAL = 5
+    JOB_PROCESSES = 2
+    JOB_CHUNK_SIZE = 1000
+    # Lease of a running job(seconds). It's extended every chunk.
+    JOB_LEASE = 60
+    METRICS_DIR = None
 
 class ProductionConfig(object):
     import os
     SECRET_KEY = os.environ.get('FLASK_SECRET_KEY')
+    # Connection pool per worker process.
+    # (pool size + max overflow) * processes of uWSGI must be less than max_connections of PostgreSQL.
+    DATABASE_POOL_SIZE = 5
+    DATABASE_MAX_OVERFLOW = 5
+    DATABASE_POOL_TIMEOUT = 10
+    DATABASE_POOL_RECYCLE = 1800
+    DATABASE_POOL_PRE_PING = True
+    # auto(orjson if installed), orjson or stdlib. See codec.py.
+    JSON_CODEC = 'auto'
+    # zlib, zstd or None. Bodies longer than the threshold(bytes) are stored compressed.
+    # See compression.py.
+    BODY_COMPRESSION = None
+    BODY_COMPRESSION_THRESHOLD = 16384
+    VALIDATOR_CACHE_SIZE = 1024
+    PAGINATION_LIMIT = 100
+    PAGINATION_MAX_LIMIT = 1000
+    STREAM_CHUNK_SIZE = 500
+    BATCH_MAX_ITEMS = 10000
+    # Lease of locks(seconds)
+    LOCK_TTL = 60
+    LOCK_MAX_TTL = 3600
+    # Max wait of blocking lock(seconds). It must be shorter than harakiri of uWSGI.
+    LOCK_MAX_WAIT = 15
+    # Threads serving Flask routes in the ASGI application
+    ASGI_WSGI_THREADS = 10
+    LOCK_SWEEP_INTERVAL = 30
+    LOCK_SWEEP_BATCH_SIZE = 1000
+    # Validation jobs(See jobs.py). None of JOB_PROCESSES is the number of CPUs.
+    # Jobs are run by the standalone runner, not by uWSGI workers.
+    JOB_POLL_INTERVAL = None
+    JOB_PROCESSES = None
+    JOB_CHUNK_SIZE = 1000
+    # Lease of a running job(seconds). It's extended every chunk.
+    JOB_LEASE = 60
+    # Metrics of uWSGI workers are aggregated through this directory.
+    METRICS_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR', '/tmp/caprice-metrics')
+    METRICS_FLUSH_INTERVAL = 1
 
 settings = {
     'develop': DevelopConfig,
@@ -1,24 +1,200 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import os
+import threading
+import time
+from contextlib import contextmanager
 from logging import getLogger
 
-from sqlalchemy import create_engine
+from flask import jsonify
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import scoped_session, sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.pool import QueuePool
 
-__all__ = ['init', 'Session', 'Base']
+__all__ = ['init', 'Session', 'Base', 'transaction', 'after_commit', 'commit', 'rollback', 'pool_stats']
 
 # Handlers of this logger depends on Flask application
 logger = getLogger(__name__)
 
 # TODO: Access privilege(user/password) for database
-# TODO: DB URL should be set from config
 Session = scoped_session(sessionmaker(autoflush=False, autocommit=False))
 Base = declarative_base()
 
+# Key of Session.info. It's set while the unit of work is open.
+UNIT_OF_WORK = 'caprice.unit_of_work'
+AFTER_COMMIT = 'caprice.after_commit'
+
+@contextmanager
+def transaction():
+    """Unit of work. Changes in the block are committed at once at the end,
+    or rolled back if the block raises.
+
+    In a request(or in an outer block), it joins the unit of work of the request,
+    which is committed once after the view returns.
+
+        with transaction() as s:
+            s.add(schema)
+            s.add(resource)
+    """
+    s = Session()
+    if s.info.get(UNIT_OF_WORK):
+        yield s
+        return
+    s.info[UNIT_OF_WORK] = True
+    try:
+        yield s
+        commit(s)
+    except Exception:
+        rollback(s)
+        raise
+    finally:
+        s.info.pop(UNIT_OF_WORK, None)
+
+def after_commit(s, callback):
+    """Call ``callback`` after the unit of work is committed. It's discarded by rollback."""
+    s.info.setdefault(AFTER_COMMIT, []).append(callback)
+
+def commit(s):
+    s.commit()
+    for callback in s.info.pop(AFTER_COMMIT, []):
+        callback()
+
+def rollback(s):
+    s.rollback()
+    s.info.pop(AFTER_COMMIT, None)
+
+# Config key -> keyword argument of create_engine
+POOL_OPTIONS = {
+    'DATABASE_POOL_SIZE': 'pool_size',
+    'DATABASE_MAX_OVERFLOW': 'max_overflow',
+    'DATABASE_POOL_TIMEOUT': 'pool_timeout',
+    'DATABASE_POOL_RECYCLE': 'pool_recycle',
+    'DATABASE_POOL_PRE_PING': 'pool_pre_ping',
+}
+
+engine = None
+
+class PoolStats(object):
+    """Counters of the connection pool in this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.connects = 0
+            self.checkouts = 0
+            self.checkins = 0
+            self.invalidations = 0
+            self.timeouts = 0
+            self.wait_seconds = 0.0
+            self.max_wait_seconds = 0.0
+
+    def waited(self, seconds, timeout=False):
+        with self._lock:
+            self.wait_seconds += seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+            if timeout:
+                self.timeouts += 1
+
+    def incr(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def as_dict(self):
+        stats = {
+            'pid': os.getpid(),
+            'connects': self.connects,
+            'checkouts': self.checkouts,
+            'checkins': self.checkins,
+            'invalidations': self.invalidations,
+            'timeouts': self.timeouts,
+            'wait_seconds': self.wait_seconds,
+            'max_wait_seconds': self.max_wait_seconds,
+        }
+        if engine is not None and isinstance(engine.pool, QueuePool):
+            stats.update({
+                'size': engine.pool.size(),
+                'checked_out': engine.pool.checkedout(),
+                'overflow': engine.pool.overflow(),
+            })
+        return stats
+
+pool_stats = PoolStats()
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool recording how long checkouts wait for a connection."""
+
+    def _do_get(self):
+        start = time.time()
+        try:
+            conn = super(InstrumentedQueuePool, self)._do_get()
+        except Exception:
+            pool_stats.waited(time.time() - start, timeout=True)
+            raise
+        pool_stats.waited(time.time() - start)
+        return conn
+
+def _engine_options(config):
+    options = dict(
+        (arg, config[key]) for key, arg in POOL_OPTIONS.items()
+        if config.get(key) is not None)
+    url = make_url(config['DATABASE_URL'])
+    # In-memory SQLite uses a connection per thread, not QueuePool.
+    if not (url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')):
+        options['poolclass'] = InstrumentedQueuePool
+    return options
+
+def _listen_pool(engine):
+    @event.listens_for(engine, 'connect')
+    def connect(dbapi_conn, record):
+        pool_stats.incr('connects')
+
+    @event.listens_for(engine, 'checkout')
+    def checkout(dbapi_conn, record, proxy):
+        pool_stats.incr('checkouts')
+
+    @event.listens_for(engine, 'checkin')
+    def checkin(dbapi_conn, record):
+        pool_stats.incr('checkins')
+
+    @event.listens_for(engine, 'invalidate')
+    def invalidate(dbapi_conn, record, exception):
+        pool_stats.incr('invalidations')
+
+# Sessions inherited from the parent. Their connections are used by the parent.
+_inherited_sessions = []
+
+def _after_fork():
+    # Connections inherited from the parent(e.g. uWSGI master) must not be
+    # used by workers. close=False leaves them to the parent.
+    if engine is None:
+        return
+    # The session is dropped without Session.remove(), which would check its connection
+    # in, and the pool would roll it back over the socket of the parent. It's kept
+    # referenced, because garbage collection of the connection resets it too.
+    engine.dispose(close=False)
+    if Session.registry.has():
+        _inherited_sessions.append(Session.registry())
+        Session.registry.clear()
+    pool_stats.reset()
+    logger.debug('Recreate connection pool after fork: {0}'.format(os.getpid()))
+
+try:
+    from uwsgidecorators import postfork
+    postfork(_after_fork)
+except ImportError:
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=_after_fork)
+
 def init(app):
-    engine = create_engine(app.config['DATABASE_URL'])
+    global engine
+    engine = create_engine(app.config['DATABASE_URL'], **_engine_options(app.config))
+    _listen_pool(engine)
     Session.configure(bind=engine)
     Base.query = Session.query_property()
 
@@ -26,7 +202,35 @@ def init(app):
     from . import models
     Base.metadata.create_all(bind=engine)
 
+    from . import notify
+    notify.init(engine)
+
+    @app.before_request
+    def begin():
+        Session().info[UNIT_OF_WORK] = True
+
+    @app.after_request
+    def end(response):
+        s = Session()
+        if not s.info.pop(UNIT_OF_WORK, False):
+            return response
+        # Errors don't leave changes.
+        if response.status_code >= 400:
+            rollback(s)
+            return response
+        try:
+            logger.debug('Commit: request')
+            commit(s)
+        except Exception as e:
+            logger.error('Rollback: request. Error details: {0}'.format(e))
+            rollback(s)
+            response = jsonify({'error': {'message': 'Committing changes is failed.'}})
+            response.status_code = 500
+        return response
+
     @app.teardown_appcontext
     def shutdown(exception):
         logger.debug('Clear session.')
         Session.remove()
+
+    return engine
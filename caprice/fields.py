@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Sparse fieldsets of JSON body, extracted in SQL.
+
+``fields`` is a comma separated list of JSON pointers(``/name,/user/email``).
+The projection has the requested paths only, nested as in the body. Missing
+paths are omitted. Paths address object members. Array elements can't be
+picked, but a path may end at an array.
+
+Each path is extracted as JSON text in database, and the texts are spliced
+into the response without parsing:
+
+- PostgreSQL: JSONB ``->`` operators.
+- SQLite: ``->`` operator(SQLite 3.38 or later).
+
+Other databases, and compressed bodies(See compression.py), are projected
+in Python.
+"""
+
+import json
+import sqlite3
+from collections import OrderedDict
+
+from sqlalchemy import Text, cast, literal
+from sqlalchemy.dialects.postgresql import JSONB
+
+from . import codec, compression
+from .utils import digest
+
+__all__ = ['parse_fields', 'Projection']
+
+# ``->`` returns JSON text since SQLite 3.38. json_extract returns SQL values(true -> 1).
+SQLITE_JSON_ARROW = sqlite3.sqlite_version_info >= (3, 38)
+
+def _parse_pointer(pointer):
+    if not pointer.startswith('/'):
+        raise ValueError('Fields are invalid.')
+    path = [t.replace('~1', '/').replace('~0', '~') for t in pointer.split('/')[1:]]
+    # Quotes can't be escaped in SQLite JSON path.
+    if not all(path) or any('"' in t for t in path):
+        raise ValueError('Fields are invalid.')
+    return path
+
+def parse_fields(values):
+    """Parse ``fields`` parameters to paths(lists of member names).
+
+    Duplicated paths, and paths under another requested path, are dropped.
+    """
+    paths = []
+    for value in values:
+        for pointer in value.split(','):
+            paths.append(_parse_pointer(pointer.strip()))
+    if not paths:
+        raise ValueError('Fields are invalid.')
+    result = []
+    for path in paths:
+        if any(path[:len(p)] == p for p in paths if len(p) < len(path)) or path in result:
+            continue
+        result.append(path)
+    return result
+
+def _compile(column, dialect, path):
+    if dialect == 'postgresql':
+        field = cast(column, JSONB)
+        # Text keys don't pick array elements, same as SQLite and Python.
+        for p in path:
+            field = field.op('->', return_type=JSONB)(literal(p, Text))
+        return cast(field, Text)
+    return column.op('->')('$' + ''.join('."{0}"'.format(p) for p in path))
+
+def _extract(value, path):
+    for p in path:
+        if not isinstance(value, dict) or p not in value:
+            return None
+        value = value[p]
+    # Same format as stored bodies
+    return codec.dump_body(value)
+
+def _tree(paths):
+    tree = OrderedDict()
+    for i, path in enumerate(paths):
+        node = tree
+        for p in path[:-1]:
+            node = node.setdefault(p, OrderedDict())
+        node[path[-1]] = i
+    return tree
+
+def _dump(tree, texts):
+    items = []
+    for key, node in tree.items():
+        text = texts[node] if isinstance(node, int) else _dump(node, texts)
+        if text is not None:
+            items.append('{0}: {1}'.format(json.dumps(key), text))
+    return '{{{0}}}'.format(', '.join(items)) if items else None
+
+class Projection(object):
+    """``fields`` on the JSON body of ``model``(Schema or Resource) in ``dialect``."""
+
+    def __init__(self, model, dialect, paths):
+        self.model = model
+        self.paths = paths
+        self.in_database = dialect == 'postgresql' or (dialect == 'sqlite' and SQLITE_JSON_ARROW)
+        self._tree = _tree(paths)
+        self._labels = ['field_{0}'.format(i) for i in range(len(paths))]
+        if self.in_database:
+            # Compressed bodies are projected in Python.
+            self.columns = [model.id, model.body_z] + [
+                _compile(model.body, dialect, path).label(label)
+                for path, label in zip(paths, self._labels)]
+        else:
+            self.columns = [model.id, model.body, model.body_z]
+
+    def dump(self, row):
+        """JSON string of the projection of ``row``(a row of ``columns``)."""
+        if self.in_database and row.body_z is None:
+            texts = [getattr(row, label) for label in self._labels]
+        else:
+            body = getattr(row, 'body', None)
+            value = codec.loads(body if body is not None else compression.decode(row.body_z))
+            texts = [_extract(value, path) for path in self.paths]
+        return _dump(self._tree, texts) or '{}'
+
+    def etag(self, body_hash):
+        """ETag of the projection of the body, which changes with the body and the fields."""
+        return digest('{0} {1}'.format(body_hash, json.dumps(self.paths)))
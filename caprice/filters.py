@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Filters on JSON body, compiled to SQL JSON functions.
+
+A filter is written as ``path.to.field<op>value``. ``op`` is one of
+``=``, ``!=``, ``<``, ``<=``, ``>``, ``>=``. ``value`` is parsed as JSON
+if possible(``1``, ``true``, ``null``, ``"1"``), otherwise it's a string.
+
+Values are compared as JSON, in the same way on all databases:
+
+- Missing fields are null. ``=null`` matches null(or missing) fields, and
+  ``!=null`` matches the others. Null fields match no other filters.
+- Values of different types(e.g. ``1`` and ``"1"``, ``true`` and ``1``,
+  objects and strings) are not equal, and they aren't ordered. Only ``!=``
+  matches them.
+- Numbers are compared numerically, and strings by code points.
+
+Filters are evaluated in database:
+
+- PostgreSQL: JSONB operators. ``=`` on object fields uses containment(``@>``),
+  so it's served by GIN index on the body.
+- SQLite: JSON1 ``json_extract``, with the types of ``json_type``.
+
+Compressed bodies(See compression.py) can't be read in SQL. They are
+filtered in Python after they are read(See Filter).
+"""
+
+import json
+import re
+
+from sqlalchemy import and_, cast, func, literal, or_
+from sqlalchemy.dialects.postgresql import JSONB
+
+from . import codec, compression
+
+__all__ = ['parse_where', 'compile_where', 'Filter']
+
+_WHERE = re.compile(r'^([^=!<>]+)(>=|<=|!=|=|>|<)(.*)$')
+
+def parse_where(expr):
+    """Parse filter expression to (path, op, value)."""
+    m = _WHERE.match(expr)
+    if not m:
+        raise ValueError('Filter is invalid.')
+    path = m.group(1).split('.')
+    if not all(path) or any('"' in p for p in path):
+        raise ValueError('Filter is invalid.')
+    try:
+        value = json.loads(m.group(3))
+    except ValueError:
+        value = m.group(3)
+    if isinstance(value, (dict, list)):
+        raise ValueError('Filter is invalid.')
+    if value is None and m.group(2) not in ('=', '!='):
+        raise ValueError('Filter is invalid.')
+    return path, m.group(2), value
+
+def compile_where(column, dialect, path, op, value):
+    """SQL expression of the filter on JSON string ``column``."""
+    if dialect == 'postgresql':
+        return _compile_postgresql(column, path, op, value)
+    if dialect == 'sqlite':
+        return _compile_sqlite(column, path, op, value)
+    raise ValueError('Filter is not supported.')
+
+def _compare(left, op, right):
+    if op == '=':
+        return left == right
+    if op == '!=':
+        return left != right
+    if op == '<':
+        return left < right
+    if op == '<=':
+        return left <= right
+    if op == '>':
+        return left > right
+    return left >= right
+
+# Types of filter values in PostgreSQL(jsonb_typeof) and SQLite(json_type)
+_PG_TYPES = {bool: 'boolean', int: 'number', float: 'number', str: 'string'}
+_SQLITE_TYPES = {bool: ('true', 'false'), int: ('integer', 'real'), float: ('integer', 'real'),
+                 str: ('text',)}
+
+def _compile_postgresql(column, path, op, value):
+    # Same expression as the GIN index on the body
+    body = cast(column, JSONB)
+    if op == '=' and value is not None and not any(p.isdigit() for p in path):
+        # Containment compares types too.
+        contained = value
+        for p in reversed(path):
+            contained = {p: contained}
+        return body.contains(contained)
+    # Path elements are text. PostgreSQL resolves them as array index on arrays.
+    field = body[tuple(path)]
+    # NULL if the field is missing
+    typeof = func.jsonb_typeof(field)
+    if value is None:
+        return func.coalesce(typeof, 'null') == 'null' if op == '=' else typeof != 'null'
+    if op == '=':
+        return field == cast(literal(json.dumps(value)), JSONB)
+    if op == '!=':
+        return and_(typeof != 'null', field != cast(literal(json.dumps(value)), JSONB))
+    if isinstance(value, str):
+        # JSONB orders strings by the collation of the database.
+        return and_(typeof == 'string', _compare(field.astext.collate('C'), op, value))
+    return and_(typeof == _PG_TYPES[type(value)],
+                _compare(field, op, cast(literal(json.dumps(value)), JSONB)))
+
+def _compile_sqlite(column, path, op, value):
+    path = '$' + ''.join('[{0}]'.format(p) if p.isdigit() else '."{0}"'.format(p) for p in path)
+    # json_extract returns NULL for null and missing fields, and 1/0 for true/false.
+    field = func.json_extract(column, path)
+    if value is None:
+        return field.is_(None) if op == '=' else field.isnot(None)
+    # NULL if the field is missing
+    typeof = func.json_type(column, path)
+    types = _SQLITE_TYPES[type(value)]
+    if isinstance(value, bool):
+        value = int(value)
+    if op == '!=':
+        return or_(typeof.notin_(types + ('null',)), and_(typeof.in_(types), field != value))
+    return and_(typeof.in_(types), _compare(field, op, value))
+
+_MISSING = object()
+
+def _field(value, path):
+    for p in path:
+        if isinstance(value, dict) and p in value:
+            value = value[p]
+        elif isinstance(value, list) and p.isdigit() and int(p) < len(value):
+            value = value[int(p)]
+        else:
+            return _MISSING
+    return value
+
+def _type(value):
+    if isinstance(value, bool):
+        return 'boolean'
+    if isinstance(value, (int, float)):
+        return 'number'
+    return type(value)
+
+def _match(body, path, op, value):
+    # Missing fields are null, and null fields match null filters only.
+    field = _field(body, path)
+    if field is _MISSING:
+        field = None
+    if value is None:
+        return (field is None) == (op == '=')
+    if field is None:
+        return False
+    # Values of different types are just different.
+    if _type(field) != _type(value):
+        return op == '!='
+    return _compare(field, op, value)
+
+class Filter(object):
+    """``where`` filters((path, op, value)) on the JSON body of ``model`` in ``dialect``.
+
+    ``clause`` filters plain bodies in database, and passes compressed ones.
+    Rows read with it are filtered by ``match``.
+    """
+
+    def __init__(self, model, dialect, filters):
+        self.filters = filters
+        self.clause = or_(
+            model.body_z.isnot(None),
+            and_(*[compile_where(model.body, dialect, *f) for f in filters]))
+
+    def match(self, row):
+        """Whether ``row``(a model or a row with ``body_z``) passes the filters."""
+        if row.body_z is None:
+            return True
+        body = codec.loads(compression.decode(row.body_z))
+        return all(_match(body, *f) for f in self.filters)
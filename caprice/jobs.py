@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Background revalidation jobs(See models.ValidationJob).
+
+Resources of the schema are read in chunks of JOB_CHUNK_SIZE in ID order,
+and validated in parallel on a process pool of JOB_PROCESSES. The next
+chunks are read while the pool validates, and the results are recorded in
+order, so the cursor of the job never skips a chunk. Jobs are kept in the
+database, and no external queue is needed.
+
+The runner runs as a daemon thread in the application process(see
+JOB_POLL_INTERVAL), or as a standalone process:
+
+    $ python -m caprice.jobs [config.ini] [develop|production]
+"""
+
+import multiprocessing
+import os
+import sys
+import threading
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from logging import getLogger, basicConfig, INFO
+
+from jsonschema import Draft4Validator
+
+from . import codec, compression
+from .db import Session
+from .models import ValidationJob, JobLeaseLostError
+
+# Handlers of this logger depends on Flask application
+logger = getLogger(__name__)
+
+__all__ = ['JobRunner', 'validate_chunk', 'start', 'main']
+
+# Validator of the last schema in this(pool) process: (schema JSON, validator)
+_validator = (None, None)
+
+def validate_chunk(schema_body, rows):
+    """IDs of the invalid resources in ``rows``((id, body, body_z)).
+
+    It runs in the pool processes, so the arguments are plain values.
+    """
+    global _validator
+    if _validator[0] != schema_body:
+        _validator = (schema_body, Draft4Validator(codec.loads(schema_body)))
+    validator = _validator[1]
+    invalid = []
+    for _id, body, body_z in rows:
+        value = codec.loads(body if body is not None else compression.decode(body_z))
+        # Draft4Validator accepts empty JSON, but we don't want to accept it.
+        if not value or not validator.is_valid(value):
+            invalid.append(_id)
+    return invalid
+
+class JobRunner(threading.Thread):
+
+    def __init__(self, interval, processes=None, chunk_size=1000, lease=60):
+        super(JobRunner, self).__init__(name='caprice-job-runner')
+        self.daemon = True
+        self.interval = interval
+        # 0 validates in this thread.
+        self.processes = os.cpu_count() if processes is None else processes
+        self.chunk_size = chunk_size
+        self.lease = lease
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            while not self._stopped.is_set() and self.run_once():
+                pass
+
+    def run_once(self):
+        """Run one job to the end. Returns whether a job was run."""
+        try:
+            job = ValidationJob.claim(self.lease)
+            if job is None:
+                return False
+            self.run_job(job)
+            return True
+        except Exception as e:
+            # Next round retries.
+            logger.error('Running validation job is failed. Error details: {0}'.format(e))
+            return False
+        finally:
+            Session.remove()
+
+    def run_job(self, job):
+        executor = None
+        if self.processes:
+            # Fork of this multi-threaded process would copy locks held by the other
+            # threads(e.g. logging, connection pool), and the children may deadlock.
+            executor = ProcessPoolExecutor(self.processes, mp_context=_mp_context())
+        try:
+            self._validate(job, executor)
+            job.finish(ValidationJob.DONE)
+        except JobLeaseLostError as e:
+            # The other runner continues from the cursor.
+            logger.error('{0}: {1}'.format(job, e))
+        except Exception as e:
+            logger.error('Validation job is failed: {0}. Error details: {1}'.format(job, e))
+            job.finish(ValidationJob.FAILED, str(e))
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+
+    def _validate(self, job, executor):
+        # Read once. The job is expired by every commit.
+        name, schema_id, schema_body, total = repr(job), job.schema_id, job.schema_body, job.total
+        after = job.last_id
+        # (last ID, number of rows, future) of the chunks in order
+        pending = deque()
+        depth = max(self.processes, 1) * 2
+        done = False
+        while True:
+            rows = [] if done else job.next_chunk(schema_id, after, self.chunk_size)
+            if rows:
+                after = rows[-1][0]
+                rows = [(_id, body, bytes(body_z) if body_z is not None else None)
+                        for _id, body, body_z in rows]
+                pending.append((after, len(rows), self._submit(executor, schema_body, rows)))
+            else:
+                done = True
+            if not pending:
+                return
+            if done or len(pending) >= depth:
+                last_id, count, future = pending.popleft()
+                job.record(last_id, count, future.result(), self.lease)
+                logger.debug('Validate: {0} {1}/{2}'.format(name, count, total))
+
+    def _submit(self, executor, schema_body, rows):
+        if executor is not None:
+            return executor.submit(validate_chunk, schema_body, rows)
+        future = Future()
+        future.set_result(validate_chunk(schema_body, rows))
+        return future
+
+    def stop(self):
+        self._stopped.set()
+
+def _mp_context():
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+def _runner(config):
+    return JobRunner(
+        config.get('JOB_POLL_INTERVAL') or 5,
+        config.get('JOB_PROCESSES'),
+        config.get('JOB_CHUNK_SIZE', 1000),
+        config.get('JOB_LEASE', 60))
+
+def start(app):
+    runner = _runner(app.config)
+    runner.start()
+    logger.debug('Start validation job runner: every {0} seconds'.format(runner.interval))
+    return runner
+
+def main(argv=None):
+    from paste.deploy import loadapp
+
+    argv = sys.argv[1:] if argv is None else argv
+    config = argv[0] if len(argv) > 0 else 'config.ini'
+    name = argv[1] if len(argv) > 1 else os.environ.get('ENVIRONMENT_TYPE', 'develop')
+    basicConfig(level=INFO)
+    # Only the runner below runs in this process.
+    app = loadapp('config:{0}'.format(config), name=name, relative_to='.',
+                  global_conf={'background_threads': 'false'})
+    _runner(app.config).run()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
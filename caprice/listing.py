@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Lists of JSON bodies, shared by the Flask(views.py) and ASGI(asgi.py) applications.
+
+Parameters of pages(``limit``, ``after``) are parsed, pages are cut, and
+rows are written in the same way by both. Invalid parameters raise
+ValueError('Request is invalid.').
+"""
+
+import json
+
+from sqlalchemy import BigInteger, Integer
+
+__all__ = ['page_limit', 'key_value', 'page', 'dump_item', 'dump_list']
+
+def page_limit(value, config):
+    """Rows per page of ``limit`` query parameter."""
+    try:
+        limit = int(value if value is not None else config.get('PAGINATION_LIMIT', 100))
+    except ValueError:
+        raise ValueError('Request is invalid.')
+    if limit < 1:
+        raise ValueError('Request is invalid.')
+    return min(limit, config.get('PAGINATION_MAX_LIMIT', 1000))
+
+def key_value(value, key):
+    """``value``(query parameter) in the type of ``key`` column."""
+    if not isinstance(key.type, Integer):
+        return value
+    # PostgreSQL rejects text and out of range numbers for integer columns.
+    bits = 64 if isinstance(key.type, BigInteger) else 32
+    try:
+        value = int(value)
+    except ValueError:
+        raise ValueError('Request is invalid.')
+    if not -2 ** (bits - 1) <= value < 2 ** (bits - 1):
+        raise ValueError('Request is invalid.')
+    return value
+
+def page(rows, limit, key, where=None):
+    """Rows of the page and the cursor of the next page(or None).
+
+    ``rows`` are fetched with ``limit + 1``. The extra row tells whether the
+    next page exists. Rows dropped by ``where``(Filter) leave the page short.
+    """
+    _next = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        _next = getattr(rows[-1], key.key)
+    if where is not None:
+        rows = [row for row in rows if where.match(row)]
+    return rows, _next
+
+def dump_item(row, projection=None):
+    """JSON of ``row``(a model, or a row of ``projection.columns``)."""
+    # Stored JSON is embedded as is, to skip the loads/dumps round trip.
+    body = row.raw_json if projection is None else projection.dump(row)
+    return '{{"id": {0}, "body": {1}}}'.format(json.dumps(row.id), body)
+
+def dump_list(name, rows, _next, projection=None):
+    """JSON of a page."""
+    return '{{"{0}": [{1}], "next": {2}}}'.format(
+        name, ', '.join(dump_item(row, projection) for row in rows), json.dumps(_next))
@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Metrics of requests and SQL statements, in Prometheus text format.
+
+Each worker process counts in its memory:
+
+- Requests by route, method and status, and their latency histogram.
+- Requests in flight.
+- SQL statements and their latency histogram(SQLAlchemy engine events).
+
+With METRICS_DIR(or PROMETHEUS_MULTIPROC_DIR), each worker writes its
+metrics to ``<dir>/metrics_<pid>.json`` every METRICS_FLUSH_INTERVAL
+seconds, and GET /metrics aggregates all of them. So any uWSGI worker
+returns the metrics of all workers. Counters of exited workers are kept,
+and the metrics of the previous run are cleared when uWSGI master loads
+the application. With lazy-apps, the application is loaded by workers,
+and the directory should be cleared before uWSGI starts.
+"""
+
+import json
+import os
+import threading
+import time
+from logging import getLogger
+
+from flask import g, request, request_finished, request_started, request_tearing_down
+from sqlalchemy import event
+
+# Handlers of this logger depends on Flask application
+logger = getLogger(__name__)
+
+__all__ = ['Metrics', 'metrics', 'init', 'instrument_engine', 'collect', 'render']
+
+# Upper bounds of histogram buckets(seconds)
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+HELP = {
+    'caprice_http_requests_total': ('counter', 'Requests by route, method and status.'),
+    'caprice_http_request_duration_seconds': ('histogram', 'Latency of requests by route and method.'),
+    'caprice_http_requests_in_flight': ('gauge', 'Requests being served.'),
+    'caprice_db_statements_total': ('counter', 'SQL statements executed.'),
+    'caprice_db_statement_duration_seconds': ('histogram', 'Latency of SQL statements.'),
+}
+
+class Metrics(object):
+    """Metrics of this worker process. Labels are tuples of (name, value)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counters = {}
+            self.gauges = {}
+            # (name, labels) -> [count of each bucket..., sum, count]
+            self.histograms = {}
+            self.dirty = False
+
+    def inc(self, name, labels=(), value=1):
+        with self._lock:
+            key = (name, labels)
+            self.counters[key] = self.counters.get(key, 0) + value
+            self.dirty = True
+
+    def add(self, name, labels=(), value=1):
+        with self._lock:
+            key = (name, labels)
+            self.gauges[key] = self.gauges.get(key, 0) + value
+            self.dirty = True
+
+    def observe(self, name, labels, seconds):
+        with self._lock:
+            key = (name, labels)
+            values = self.histograms.get(key)
+            if values is None:
+                values = self.histograms[key] = [0] * len(BUCKETS) + [0.0, 0]
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    values[i] += 1
+                    break
+            values[-2] += seconds
+            values[-1] += 1
+            self.dirty = True
+
+    def snapshot(self):
+        with self._lock:
+            self.dirty = False
+            return {
+                'pid': os.getpid(),
+                'counters': [[n, l, v] for (n, l), v in self.counters.items()],
+                'gauges': [[n, l, v] for (n, l), v in self.gauges.items()],
+                'histograms': [[n, l, list(v)] for (n, l), v in self.histograms.items()],
+            }
+
+    def flush(self, directory):
+        """Write the snapshot to ``directory`` atomically."""
+        path = os.path.join(directory, 'metrics_{0}.json'.format(os.getpid()))
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp, path)
+
+metrics = Metrics()
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def collect(directory=None):
+    """Aggregate the snapshots of workers. Without ``directory``, only this process."""
+    if directory is None:
+        snapshots = [metrics.snapshot()]
+    else:
+        metrics.flush(directory)
+        snapshots = []
+        for name in os.listdir(directory):
+            if not (name.startswith('metrics_') and name.endswith('.json')):
+                continue
+            try:
+                with open(os.path.join(directory, name)) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError) as e:
+                logger.error('Reading metrics {0} is failed. Error details: {1}'.format(name, e))
+
+    counters, gauges, histograms = {}, {}, {}
+    for snapshot in snapshots:
+        for n, l, v in snapshot['counters']:
+            key = (n, tuple(tuple(p) for p in l))
+            counters[key] = counters.get(key, 0) + v
+        # Gauges of exited workers are obsolete.
+        if snapshot['pid'] == os.getpid() or _alive(snapshot['pid']):
+            for n, l, v in snapshot['gauges']:
+                key = (n, tuple(tuple(p) for p in l))
+                gauges[key] = gauges.get(key, 0) + v
+        for n, l, v in snapshot['histograms']:
+            key = (n, tuple(tuple(p) for p in l))
+            merged = histograms.setdefault(key, [0] * len(v))
+            for i, x in enumerate(v):
+                merged[i] += x
+    return {'counters': counters, 'gauges': gauges, 'histograms': histograms}
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{0}="{1}"'.format(k, _escape(v)) for k, v in labels) + '}'
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def render(collected):
+    """Prometheus text format(version 0.0.4) of ``collect()``."""
+    series = {}
+    for kind in ('counters', 'gauges'):
+        for (name, labels), value in collected[kind].items():
+            series.setdefault(name, []).append('{0}{1} {2}'.format(name, _labels(labels), _number(value)))
+    for (name, labels), values in collected['histograms'].items():
+        lines = series.setdefault(name, [])
+        cumulative = 0
+        for bound, count in zip(BUCKETS, values):
+            cumulative += count
+            lines.append('{0}_bucket{1} {2}'.format(
+                name, _labels(labels + (('le', repr(bound)),)), cumulative))
+        lines.append('{0}_bucket{1} {2}'.format(name, _labels(labels + (('le', '+Inf'),)), values[-1]))
+        lines.append('{0}_sum{1} {2}'.format(name, _labels(labels), _number(values[-2])))
+        lines.append('{0}_count{1} {2}'.format(name, _labels(labels), values[-1]))
+
+    out = []
+    for name in sorted(HELP):
+        kind, text = HELP[name]
+        out.append('# HELP {0} {1}'.format(name, text))
+        out.append('# TYPE {0} {1}'.format(name, kind))
+        out.extend(sorted(series.get(name, [])))
+    return '\n'.join(out) + '\n'
+
+def instrument_engine(engine):
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('caprice.query_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['caprice.query_start'].pop()
+        metrics.inc('caprice_db_statements_total')
+        metrics.observe('caprice_db_statement_duration_seconds', (), elapsed)
+
+    @event.listens_for(engine, 'handle_error')
+    def handle_error(context):
+        # after_cursor_execute isn't called for failed statements.
+        if context.connection is not None and context.connection.info.get('caprice.query_start'):
+            context.connection.info['caprice.query_start'].pop()
+            metrics.inc('caprice_db_statements_total')
+
+class _Flusher(object):
+    """Writes the metrics of the worker periodically. Started lazily after fork."""
+
+    def __init__(self, directory, interval):
+        self.directory = directory
+        self.interval = interval
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        # Snapshot inherited from the parent isn't of this worker.
+        metrics.reset()
+        thread = threading.Thread(target=self._run, name='caprice-metrics-flusher')
+        thread.daemon = True
+        thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            if not metrics.dirty:
+                continue
+            try:
+                metrics.flush(self.directory)
+            except OSError as e:
+                logger.error('Writing metrics is failed. Error details: {0}'.format(e))
+
+def _in_uwsgi_master():
+    try:
+        import uwsgi
+    except ImportError:
+        return False
+    return uwsgi.worker_id() == 0
+
+def _clear(directory):
+    for name in os.listdir(directory):
+        if name.startswith('metrics_'):
+            os.remove(os.path.join(directory, name))
+
+def init(app):
+    directory = app.config.get('METRICS_DIR') or os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        # Before workers are forked. Standalone runners(e.g. sweeper) don't clear them.
+        if _in_uwsgi_master():
+            logger.debug('Clear metrics of the previous run: {0}'.format(directory))
+            _clear(directory)
+    app.extensions['caprice.metrics_dir'] = directory
+    flusher = _Flusher(directory, app.config.get('METRICS_FLUSH_INTERVAL', 1)) if directory else None
+
+    def started(sender, **extra):
+        if flusher is not None:
+            flusher.start()
+        g.metrics_start = time.perf_counter()
+        metrics.add('caprice_http_requests_in_flight')
+
+    def finished(sender, response, **extra):
+        # After the unit of work is committed(See db.py).
+        rule = request.url_rule.rule if request.url_rule else 'unmatched'
+        labels = (('route', rule), ('method', request.method))
+        metrics.inc('caprice_http_requests_total', labels + (('status', str(response.status_code)),))
+        metrics.observe(
+            'caprice_http_request_duration_seconds', labels, time.perf_counter() - g.metrics_start)
+
+    def tearing_down(sender, **extra):
+        if g.pop('metrics_start', None) is not None:
+            metrics.add('caprice_http_requests_in_flight', value=-1)
+
+    request_started.connect(started, app, weak=False)
+    request_finished.connect(finished, app, weak=False)
+    request_tearing_down.connect(tearing_down, app, weak=False)
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Upgrade an existing database to the current models.
+
+Missing tables, columns and indexes are added in place. Existing rows
+are kept, except rows which conflict with new unique indexes(logged), and
+indexes superseded by the models are dropped.
+
+    $ python -m caprice.migrate [config.ini] [develop|production]
+"""
+
+import json
+import os
+import sys
+from logging import getLogger, basicConfig, INFO
+
+from paste.deploy import appconfig
+from sqlalchemy import create_engine, func, inspect, select, text
+
+from .db import Base
+from .utils import canonical_digest
+
+logger = getLogger(__name__)
+
+__all__ = ['upgrade', 'main']
+
+def _dedupe_lock_association(conn, table):
+    # Resources held by more than one lock, before a resource was held by one lock at most.
+    # The newest lock keeps the resource.
+    duplicated = select(table.c.resource_id).group_by(
+        table.c.resource_id).having(func.count() > 1)
+    rows = conn.execute(
+        select(table.c.resource_id, table.c.lock_id).where(
+            table.c.resource_id.in_(duplicated)).order_by(
+            table.c.resource_id, table.c.lock_id)).fetchall()
+    locks = {}
+    for resource_id, lock_id in rows:
+        locks.setdefault(resource_id, []).append(lock_id)
+    for resource_id, lock_ids in sorted(locks.items()):
+        keep = lock_ids[-1]
+        logger.warning('Resource {0} is held by locks {1}. Release it from all but lock {2}.'.format(
+            resource_id, lock_ids, keep))
+        # Same pairs may be duplicated too.
+        conn.execute(table.delete().where(table.c.resource_id==resource_id))
+        conn.execute(table.insert().values(resource_id=resource_id, lock_id=keep))
+
+# Indexes replaced by the current models: {table name: [index name]}
+SUPERSEDED_INDEXES = {
+    # Replaced by ux_resource_lock_association_resource_id
+    'resource_lock_association': ['ux_resource_lock_association_resource_id_lock_id'],
+}
+
+# Called before new indexes are created: {index name: function(conn, table)}
+PRE_CREATE_HOOKS = {
+    # Unique index fails if the table already has duplicated rows.
+    'ux_resource_lock_association_resource_id': _dedupe_lock_association,
+}
+
+def _created_on(index, dialect):
+    # Indexes for other dialects(ddl_if) are skipped by Index.create() too.
+    ddl_if = getattr(index, '_ddl_if', None)
+    if ddl_if is None or ddl_if.dialect is None:
+        return True
+    dialects = (ddl_if.dialect,) if isinstance(ddl_if.dialect, str) else ddl_if.dialect
+    return dialect.name in dialects
+
+def upgrade(engine):
+    from . import models
+    # New tables are created with their indexes.
+    Base.metadata.create_all(bind=engine)
+
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            columns = set(c['name'] for c in inspector.get_columns(table.name))
+            for column in table.columns:
+                if column.name in columns:
+                    continue
+                # TODO: Columns with NOT NULL/server default aren't supported yet.
+                logger.info('Add column: {0}.{1}'.format(table.name, column.name))
+                conn.execute(text('ALTER TABLE {0} ADD COLUMN {1} {2}'.format(
+                    table.name, column.name, column.type.compile(dialect=engine.dialect))))
+            indexes = set(i['name'] for i in inspector.get_indexes(table.name))
+            for name in SUPERSEDED_INDEXES.get(table.name, []):
+                if name in indexes:
+                    logger.info('Drop index: {0}'.format(name))
+                    conn.execute(text('DROP INDEX {0}'.format(name)))
+            for index in table.indexes:
+                if index.name in indexes or not _created_on(index, engine.dialect):
+                    continue
+                if index.name in PRE_CREATE_HOOKS:
+                    PRE_CREATE_HOOKS[index.name](conn, table)
+                logger.info('Create index: {0}'.format(index.name))
+                index.create(bind=conn)
+        _backfill_canonical_hash(conn)
+
+def _backfill_canonical_hash(conn):
+    # Schemas stored before canonical_hash was added. Duplicated ones are left NULL,
+    # and they aren't returned by POST /schemas.
+    from . import compression
+    from .models import Schema
+    table = Schema.__table__
+    hashes = set(h for (h,) in conn.execute(
+        select(table.c.canonical_hash).where(table.c.canonical_hash.isnot(None))))
+    rows = conn.execute(
+        select(table.c.id, table.c.body, table.c.body_z).where(
+            table.c.canonical_hash.is_(None)).order_by(table.c.id)).fetchall()
+    for row in rows:
+        if row.body is None and row.body_z is None:
+            continue
+        h = canonical_digest(json.loads(
+            row.body if row.body is not None else compression.decode(row.body_z)))
+        if h in hashes:
+            logger.info('Same schema is already registered: {0}'.format(row.id))
+            continue
+        hashes.add(h)
+        conn.execute(table.update().where(table.c.id==row.id).values(canonical_hash=h))
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    config = argv[0] if len(argv) > 0 else 'config.ini'
+    name = argv[1] if len(argv) > 1 else os.environ.get('ENVIRONMENT_TYPE', 'develop')
+    basicConfig(level=INFO)
+    conf = appconfig('config:{0}'.format(config), name=name, relative_to='.')
+    upgrade(create_engine(conf['database_url']))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
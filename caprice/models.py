@@ -1,78 +1,212 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import json
+import time
+import uuid
+from datetime import datetime, timedelta
 from logging import getLogger
 
-from jsonschema import Draft4Validator, SchemaError, ValidationError, validate
-from sqlalchemy import Column, Integer, String, Sequence, ForeignKey, Table
+from jsonschema import Draft4Validator, SchemaError, ValidationError
+from sqlalchemy import Column, DateTime, Integer, LargeBinary, String, Sequence, ForeignKey, Table, Index
+from sqlalchemy import and_, bindparam, cast, event, func, or_, select, text
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import relationship, backref
 
-from .db import Base, Session
+from . import codec, compression, notify
+from .db import Base, Session, after_commit, rollback, transaction
+from .utils import digest, canonical_digest
+from .validators import validator_cache, is_valid_change
 
 # Handlers of this logger depends on Flask application
 logger = getLogger(__name__)
 
-__all__ = ['Schema', 'Resource', 'Lock']
+__all__ = ['Schema', 'Resource', 'Lock', 'ValidationJob', 'Change',
+           'ResourceNotFoundError', 'LockConflictError', 'LockNotFoundError', 'JobLeaseLostError']
 
-class Schema(Base):
+class ResourceNotFoundError(ValueError):
+    pass
+
+class LockConflictError(ValueError):
+
+    def __init__(self, message, retry_at=None):
+        super(LockConflictError, self).__init__(message)
+        # The earliest expiry of the locks holding the resources, if any.
+        self.retry_at = retry_at
+
+class LockNotFoundError(ValueError):
+    pass
+
+class JobLeaseLostError(ValueError):
+    pass
+
+def _flush(s, obj, message):
+    # Flushed(not committed) to report errors to the caller. See db.transaction.
+    try:
+        logger.debug('Flush: {0}'.format(obj))
+        s.flush()
+    except Exception as e:
+        logger.error('Rollback: {0}. Error details: {1}'.format(obj, e))
+        rollback(s)
+        # TODO: Sophisticated error handling
+        raise ValueError(message)
+
+class JSONBodyMixin(object):
+    """JSON accessors of ``body`` column.
+
+    Parsed JSON is cached on the instance together with the body it was
+    parsed from, so it's parsed again only after ``body`` is changed
+    (assigned, or reloaded from database).
+    Don't modify the returned object in place. Assign ``json`` instead.
+
+    Large bodies may be stored compressed in ``body_z``(See compression.py).
+    """
+
+    _json_cache = (None, None)
+    _text_cache = (None, None)
+
+    @property
+    def _stored_body(self):
+        return self.body if self.body is not None else self.body_z
+
+    @property
+    def json(self):
+        body, value = self._json_cache
+        if body is None or body is not self._stored_body:
+            value = codec.loads(self.raw_json)
+            self._json_cache = (self._stored_body, value)
+        return value
+
+    @json.setter
+    def json(self, value):
+        text = codec.dump_body(value)
+        self.body, self.body_z = compression.encode(text)
+        if self.body is None:
+            # Plain bodies are hashed when they're set. Both are hashes of JSON string.
+            self.body_hash = digest(text)
+        self._text_cache = (self.body_z, text)
+        self._json_cache = (self._stored_body, value)
+
+    @property
+    def raw_json(self):
+        """JSON string as stored. Use this if the JSON object isn't needed."""
+        if self.body is not None or self.body_z is None:
+            return self.body
+        body_z, text = self._text_cache
+        if body_z is None or body_z is not self.body_z:
+            text = compression.decode(self.body_z)
+            self._text_cache = (self.body_z, text)
+        return text
+
+    @property
+    def etag(self):
+        # Rows stored before body_hash column was added don't have the hash.
+        return self.body_hash or digest(self.raw_json)
+
+    @classmethod
+    def reencode(cls, batch_size=1000):
+        """Store all bodies again with the current compression settings, one
+        transaction per batch. Returns the number of changed rows."""
+        table = cls.__table__
+        changed = 0
+        last = None
+        while True:
+            with transaction() as s:
+                query = select(table.c.id, table.c.body, table.c.body_z).order_by(table.c.id).limit(batch_size)
+                if last is not None:
+                    query = query.where(table.c.id > last)
+                rows = s.execute(query).fetchall()
+                if not rows:
+                    return changed
+                last = rows[-1].id
+                updates = []
+                for row in rows:
+                    text = row.body if row.body is not None or row.body_z is None else compression.decode(row.body_z)
+                    if text is None:
+                        continue
+                    body, body_z = compression.encode(text)
+                    # Compared by the format marker, not to compress again with the same settings.
+                    if body != row.body or (body_z or b'')[:1] != bytes(row.body_z or b'')[:1]:
+                        updates.append({'_id': row.id, 'body': body, 'body_z': body_z})
+                if updates:
+                    logger.debug('Reencode: {0} {1}'.format(len(updates), cls.__name__))
+                    s.execute(
+                        table.update().where(table.c.id==bindparam('_id')).values(
+                            body=bindparam('body'), body_z=bindparam('body_z')),
+                        updates)
+                    changed += len(updates)
+
+class Schema(JSONBodyMixin, Base):
 
     __tablename__ = 'schemas'
 
     # TODO: allow Only UUID? or user defined ID too?
     id = Column(String, primary_key=True)
-    # TODO: JSON uniqueness is needed
     # This value represents raw JSON string. 
     # If you want to get JSON object(=dictionary), please use json property.
     body = Column(String)
+    # Compressed body. It's set instead of body. (See compression.py)
+    body_z = Column(LargeBinary)
+    # Content hash of body. It's updated when body is set, and used as ETag.
+    body_hash = Column(String(40))
+    # Hash of canonical JSON(sorted keys, no whitespace). Same schemas are registered once.
+    # Rows stored before this column was added may be NULL(See migrate.py).
+    canonical_hash = Column(String(40))
+
+    # Declared as unique index(not constraint), so that migrate can add it to existing table.
+    __table_args__ = (
+        Index('ux_schemas_canonical_hash', 'canonical_hash', unique=True),
+    )
 
     # ID is generated in Python context(=in application)
     def __init__(self, id, json):
         self.id = id
         self.json = json
+        self.canonical_hash = canonical_digest(json)
         self._validate()
 
-    @property
-    def json(self):
-        return json.loads(self.body)
-
-    @json.setter
-    def json(self, value):
-        self.body = json.dumps(value)
-
     def __repr__(self):
         return "<{0}: '{1}'>".format(self.__class__.__name__, self.body)
 
-    # TODO: Use contextmanager. Ref. http://docs.sqlalchemy.org/en/rel_1_0/orm/session_basics.html
     def save(self):
-        s = Session()
-        s.add(self)
-        try:
-            logger.debug('Commit: {0}'.format(self))
-            s.commit()
-        except Exception as e:
-            logger.error('Rollback: {0}. Error details: {1}'.format(self, e))
-            s.rollback()
-            # TODO: Sophisticated error handling
-            raise ValueError('This schema ID is already used.')
-        finally:
-            logger.debug('Close: {0}'.format(self.__class__.__name__))
-            s.close()
+        with transaction() as s:
+            s.add(self)
+            _flush(s, self, 'This schema ID is already used.')
+            Change.record(s, Change.CREATE, 'schema', [(self.id, self.id, self.body_hash)])
 
     def delete(self):
-        s = Session()
-        s.delete(self)
+        _id = self.id
+        # Resources of the schema are left without schema. They leave the feed of the schema.
+        orphans = [r.id for r in self.resources]
+        with transaction() as s:
+            s.delete(self)
+            _flush(s, self, 'Deleting schema is failed.')
+            Change.record(s, Change.DELETE, 'resource', [(r_id, _id, None) for r_id in orphans])
+            Change.record(s, Change.DELETE, 'schema', [(_id, _id, None)])
+
+    @classmethod
+    def find_same(cls, value):
+        """ID of the schema whose JSON is same as ``value``, or None. It's an indexed lookup."""
+        return cls.query.with_entities(cls.id).filter(
+            cls.canonical_hash==canonical_digest(value)).scalar()
+
+    @classmethod
+    def register(cls, value):
+        """Save ``value`` as a new schema unless the same schema exists.
+        Returns (ID, whether it's created)."""
+        _id = cls.find_same(value)
+        if _id:
+            return _id, False
+        schema = cls(str(uuid.uuid4()), value)
         try:
-            logger.debug('Commit: {0}'.format(self))
-            s.commit()
-        except Exception as e:
-            logger.error('Rollback: {0}. Error details: {1}'.format(self, e))
-            s.rollback()
-            # TODO: Sophisticated error handling
-            raise ValueError('Deleting schema is failed.')
-        finally:
-            logger.debug('Close: {0}'.format(self.__class__.__name__))
-            s.close()
+            schema.save()
+        except ValueError:
+            # Registered by another request after the lookup
+            _id = cls.find_same(value)
+            if _id:
+                return _id, False
+            raise ValueError('Registering schema is failed.')
+        return schema.id, True
 
     def _validate(self):
         # Draft4Validator accepts empty JSON, but we don't want to accept it.
@@ -84,7 +218,7 @@ class Schema(Base):
             raise ValueError('Schema is invalid.')
 
 # TODO: Schema hierarchy (Ref. http://docs.sqlalchemy.org/en/rel_1_0/orm/inheritance.html)
-class Resource(Base):
+class Resource(JSONBodyMixin, Base):
 
     __tablename__ = 'resources'
 
@@ -94,8 +228,12 @@ class Resource(Base):
     # This value represents raw JSON string. 
     # If you want to get JSON object(=dictionary), please use json property.
     body = Column(String)
+    # Compressed body. It's set instead of body. (See compression.py)
+    body_z = Column(LargeBinary)
+    # Content hash of body. It's updated when body is set, and used as ETag.
+    body_hash = Column(String(40))
 
-    schema_id = Column(String, ForeignKey('schemas.id'))
+    schema_id = Column(String, ForeignKey('schemas.id'), index=True)
     schema = relationship('Schema', backref=backref('resources', order_by='Resource.id'))
 
     # ID is generated in Python context(=in application)
@@ -106,89 +244,501 @@ class Resource(Base):
         self.schema = schema
         self._validate()
 
-    @property
-    def json(self):
-        return json.loads(self.body)
-
-    @json.setter
-    def json(self, value):
-        self.body = json.dumps(value)
-
     def __repr__(self):
         return "<{0}: '{1}'>".format(self.__class__.__name__, self.body)
 
-     # TODO: Use contextmanager. Ref. http://docs.sqlalchemy.org/en/rel_1_0/orm/session_basics.html
     def save(self):
-        s = Session()
-        s.add(self)
-        try:
-            logger.debug('Commit: {0}'.format(self))
-            s.commit()
-        except Exception as e:
-            logger.error('Rollback: {0}. Error details: {1}'.format(self, e))
-            s.rollback()
-            # TODO: Sophisticated error handling
-            raise ValueError('This resource ID is already used.')
-        finally:
-            logger.debug('Close: {0}'.format(self.__class__.__name__))
-            s.close()
+        with transaction() as s:
+            s.add(self)
+            _flush(s, self, 'This resource ID is already used.')
+            Change.record(s, Change.CREATE, 'resource', [(self.id, self.schema_id, self.body_hash)])
 
     def delete(self):
-        s = Session()
-        s.delete(self)
-        try:
-            logger.debug('Commit: {0}'.format(self))
-            s.commit()
-        except Exception as e:
-            logger.error('Rollback: {0}. Error details: {1}'.format(self, e))
-            s.rollback()
-            # TODO: Sophisticated error handling
-            raise ValueError('Deleting resource is failed.')
-        finally:
-            logger.debug('Close: {0}'.format(self.__class__.__name__))
-            s.close()
+        _id, schema_id = self.id, self.schema_id
+        with transaction() as s:
+            s.delete(self)
+            _flush(s, self, 'Deleting resource is failed.')
+            Change.record(s, Change.DELETE, 'resource', [(_id, schema_id, None)])
+
+    @classmethod
+    def bulk_save(cls, schema, values):
+        """Validate and insert resources of ``schema`` in one transaction.
+
+        Invalid items are skipped. Returns the result of each item in order:
+        ID of the inserted resource, or ValueError of the invalid item.
+        """
+        validator = validator_cache.get(schema)
+        rows = []
+        results = []
+        for value in values:
+            # Draft4Validator accepts empty JSON, but we don't want to accept it.
+            if not value or not validator.is_valid(value):
+                results.append(ValueError('Resource is invalid.'))
+                continue
+            _id = str(uuid.uuid4())
+            text = codec.dump_body(value)
+            body, body_z = compression.encode(text)
+            rows.append({
+                'id': _id, 'body': body, 'body_z': body_z, 'body_hash': digest(text),
+                'schema_id': schema.id})
+            results.append(_id)
+        if not rows:
+            return results
+        with transaction() as s:
+            try:
+                logger.debug('Insert: {0} {1}'.format(len(rows), cls.__name__))
+                s.execute(cls.__table__.insert(), rows)
+                Change.record(s, Change.CREATE, 'resource', [
+                    (row['id'], row['schema_id'], row['body_hash']) for row in rows])
+            except Exception as e:
+                logger.error('Rollback: {0} {1}. Error details: {2}'.format(len(rows), cls.__name__, e))
+                rollback(s)
+                raise ValueError('Inserting resources is failed.')
+        return results
+
+    @classmethod
+    def patch(cls, schema, _id, apply):
+        """Change the resource by ``apply``(a function of patch.py) in one transaction.
+
+        The row is locked until the end of the transaction, so concurrent patches
+        aren't lost. Only the changed properties are validated if possible.
+        """
+        with transaction() as s:
+            resource = s.query(cls).filter(
+                cls.id==_id, cls.schema_id==schema.id).with_for_update().first()
+            if not resource:
+                raise ResourceNotFoundError("Resource isn't found.")
+            value, keys = apply(resource.json)
+            # Draft4Validator accepts empty JSON, but we don't want to accept it.
+            if not value or not is_valid_change(schema, value, keys):
+                raise ValueError('Resource is invalid.')
+            resource.json = value
+            _flush(s, resource, 'Updating resource is failed.')
+            Change.record(s, Change.UPDATE, 'resource', [
+                (resource.id, resource.schema_id, resource.body_hash)])
+        return resource
 
     def _validate(self):
         # Draft4Validator accepts empty JSON, but we don't want to accept it.
         if not self.json:
             raise ValueError('Resource is invalid.')
         try:
-            validate(self.json, self.schema.json)
+            validator_cache.get(self.schema).validate(self.json)
         except (SchemaError, ValidationError):
             raise ValueError('Resource is invalid.')
 
+# GIN index for JSON filters(See filters.py). PostgreSQL only.
+Index('ix_resources_body_jsonb', cast(Resource.body, JSONB),
+      postgresql_using='gin').ddl_if(dialect='postgresql')
+# Compressed resources, which pass JSON filters in SQL(See filters.Filter).
+Index('ix_resources_compressed_schema_id', Resource.schema_id,
+      postgresql_where=Resource.body_z.isnot(None), sqlite_where=Resource.body_z.isnot(None))
+
+@event.listens_for(Schema.body, 'set')
+@event.listens_for(Resource.body, 'set')
+def _update_body_hash(target, value, oldvalue, initiator):
+    # Compressed bodies are hashed by the json setter.
+    if value is not None:
+        target.body_hash = digest(value)
+
 class Lock(Base):
 
     __tablename__ = 'locks'
 
     id = Column(Integer, Sequence('lock_id_seq'), primary_key=True)
-    # TODO: whether spec allows that some locks acquire same resource at the same time.
+    # A resource is held by one lock at most. (See resource_lock_association)
     resources = relationship('Resource', secondary='resource_lock_association', backref='locks')
+    # Lease of the lock(UTC). The lock never expires if this is NULL.
+    # Expired locks don't hold resources, and are deleted by sweep().
+    expires_at = Column(DateTime, index=True)
+
+    def __init__(self, resources=None, ttl=None):
+        self.resources = resources or []
+        self.expires_at = datetime.utcnow() + timedelta(seconds=ttl) if ttl else None
 
-    def __init__(self, resources):
-        self.resources = resources
+    def __repr__(self):
+        return "<{0}: {1}>".format(self.__class__.__name__, self.id)
+
+    @classmethod
+    def _live(cls, now):
+        return or_(cls.expires_at == None, cls.expires_at > now)
+
+    @classmethod
+    def get(cls, _id):
+        return cls.query.filter(cls.id==_id, cls._live(datetime.utcnow())).first()
+
+    @classmethod
+    def acquire(cls, resource_ids, ttl=None, wait=None):
+        """Lock all resources, or none of them.
+
+        If ``wait``(seconds) is given, the conflicting lock is retried when
+        the resources are released(See notify.py) or the holders expire.
+        """
+        deadline = time.time() + (wait or 0)
+        while True:
+            # Taken before the attempt, not to miss the release during it.
+            generation = notify.generation()
+            try:
+                return cls._acquire(resource_ids, ttl)
+            except LockConflictError as e:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    raise
+                if e.retry_at:
+                    timeout = min(timeout, max(
+                        (e.retry_at - datetime.utcnow()).total_seconds(), 0.01))
+                logger.debug('Wait: {0} seconds for {1}'.format(timeout, e))
+                notify.wait(generation, timeout)
+
+    @classmethod
+    def _acquire(cls, resource_ids, ttl=None):
+        with transaction() as s:
+            try:
+                return cls.acquire_in(s, resource_ids, ttl)
+            except (ResourceNotFoundError, LockConflictError):
+                # Rolled back before waiting, not to hold the transaction.
+                rollback(s)
+                raise
+            except IntegrityError as e:
+                logger.error('Rollback: {0}. Error details: {1}'.format(cls.__name__, e))
+                rollback(s)
+                raise LockConflictError('Resources are already locked.')
+
+    @classmethod
+    def acquire_in(cls, s, resource_ids, ttl=None):
+        """Lock all resources in the transaction of session ``s``. It's not committed.
+
+        Existence and current holders of the resources are checked in one query,
+        and the association rows are inserted in one statement.
+        Unique index on resource_id rejects the lock if another lock acquires
+        the same resource concurrently(IntegrityError).
+        """
+        ids = set(resource_ids)
+        # Expired locks release the requested resources here, before sweep() deletes them.
+        s.execute(resource_lock_association.delete().where(
+            resource_lock_association.c.resource_id.in_(ids)).where(
+            resource_lock_association.c.lock_id.in_(
+                select(cls.id).where(cls.expires_at <= datetime.utcnow()))))
+        rows = s.query(Resource.id, resource_lock_association.c.lock_id, cls.expires_at).outerjoin(
+            resource_lock_association,
+            resource_lock_association.c.resource_id==Resource.id).outerjoin(
+            cls, cls.id==resource_lock_association.c.lock_id).filter(
+            Resource.id.in_(ids)).all()
+        found = set(r_id for r_id, _, _ in rows)
+        for r_id in resource_ids:
+            if r_id not in found:
+                raise ResourceNotFoundError("Resource {0} isn't found.".format(r_id))
+        held = sorted((r_id, expires_at) for r_id, lock_id, expires_at in rows
+                      if lock_id is not None)
+        if held:
+            expiries = [expires_at for _, expires_at in held]
+            raise LockConflictError(
+                'Resource {0} is already locked.'.format(held[0][0]),
+                None if None in expiries else min(expiries))
+
+        lock = cls(ttl=ttl)
+        s.add(lock)
+        s.flush()
+        s.execute(resource_lock_association.insert(),
+                  [{'resource_id': r_id, 'lock_id': lock.id} for r_id in ids])
+        logger.debug('Acquire: {0}'.format(lock))
+        return lock
+
+    @classmethod
+    def renew(cls, _id, ttl):
+        """Extend the lease of the live lock. Returns the new expiry."""
+        with transaction() as s:
+            now = datetime.utcnow()
+            expires_at = now + timedelta(seconds=ttl) if ttl else None
+            try:
+                count = s.query(cls).filter(cls.id==_id, cls._live(now)).update(
+                    {cls.expires_at: expires_at}, synchronize_session=False)
+            except Exception as e:
+                logger.error('Rollback: renew {0}. Error details: {1}'.format(_id, e))
+                rollback(s)
+                raise ValueError('Renewing lock is failed.')
+            if not count:
+                raise LockNotFoundError("Lock isn't found.")
+            logger.debug('Renew: {0}'.format(_id))
+        return expires_at
+
+    @classmethod
+    def release(cls, _id):
+        with transaction() as s:
+            try:
+                s.execute(resource_lock_association.delete().where(
+                    resource_lock_association.c.lock_id==_id))
+                count = s.query(cls).filter(cls.id==_id).delete(synchronize_session=False)
+            except Exception as e:
+                logger.error('Rollback: release {0}. Error details: {1}'.format(_id, e))
+                rollback(s)
+                raise ValueError('Deleting lock is failed.')
+            if not count:
+                raise LockNotFoundError("Lock isn't found.")
+            logger.debug('Release: {0}'.format(_id))
+            notify.publish(s)
+            after_commit(s, notify.notify)
+
+    @classmethod
+    def sweep(cls, batch_size=1000):
+        """Delete expired locks in batches. Returns the number of deleted locks.
+
+        Each batch is one transaction, so a large backlog doesn't hold long locks on the table.
+        """
+        deleted = 0
+        while True:
+            with transaction() as s:
+                ids = [_id for _id, in s.query(cls.id).filter(
+                    cls.expires_at <= datetime.utcnow()).order_by(cls.expires_at).limit(batch_size)]
+                if ids:
+                    s.execute(resource_lock_association.delete().where(
+                        resource_lock_association.c.lock_id.in_(ids)))
+                    s.query(cls).filter(cls.id.in_(ids)).delete(synchronize_session=False)
+            deleted += len(ids)
+            if len(ids) < batch_size:
+                break
+        if deleted:
+            logger.debug('Sweep: {0} expired locks'.format(deleted))
+        return deleted
 
-    # TODO: Use contextmanager. Ref. http://docs.sqlalchemy.org/en/rel_1_0/orm/session_basics.html
-    # TODO DRY
     def save(self):
-        s = Session()
-        s.add(self)
-        try:
-            logger.debug('Commit: {0}'.format(self))
-            s.commit()
-            # TODO: Adapt refresh for other schemas
-            s.refresh(self)
-        except Exception as e:
-            logger.error('Rollback: {0}. Error details: {1}'.format(self, e))
-            s.rollback()
-            # TODO: Sophisticated error handling
+        with transaction() as s:
+            s.add(self)
             # TODO: Handle other reasons
-            raise ValueError('This lock ID is already used.')
-        finally:
-            logger.debug('Close: {0}'.format(self.__class__.__name__))
-            s.close()
+            _flush(s, self, 'This lock ID is already used.')
 
 resource_lock_association = Table('resource_lock_association', Base.metadata,
     Column('resource_id', String, ForeignKey('resources.id')),
-    Column('lock_id', Integer, ForeignKey('locks.id'))
+    Column('lock_id', Integer, ForeignKey('locks.id')),
+    # Declared as unique index(not constraint), so that migrate can add it to existing table.
+    # A resource can't be held by multiple locks. It also serves lookups by resource_id.
+    Index('ux_resource_lock_association_resource_id', 'resource_id', unique=True),
+    Index('ix_resource_lock_association_lock_id', 'lock_id')
+)
+
+class ValidationJob(Base):
+    """Revalidation of all resources of a schema, run in background(See jobs.py).
+
+    The job validates against the schema body at the time it's created, or a
+    candidate body which isn't saved yet. Runners claim pending jobs(or running
+    jobs whose lease is expired) with a conditional update, and record the
+    progress and the invalid resources chunk by chunk in one transaction each.
+    ``last_id`` is the cursor, so a reclaimed job resumes after the last chunk.
+    """
+
+    __tablename__ = 'validation_jobs'
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    id = Column(Integer, Sequence('validation_job_id_seq'), primary_key=True)
+    # Not a foreign key. Jobs of a deleted schema are left as history.
+    schema_id = Column(String, index=True)
+    # JSON of the schema to validate against.
+    schema_body = Column(String)
+    status = Column(String(16), index=True)
+    # Runner holding the job, and its lease(UTC).
+    token = Column(String(36))
+    locked_until = Column(DateTime)
+    # Resources of the schema when the job is started.
+    total = Column(Integer)
+    processed = Column(Integer)
+    invalid_count = Column(Integer)
+    # ID of the last validated resource
+    last_id = Column(String)
+    error = Column(String)
+    created_at = Column(DateTime)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+
+    def __init__(self, schema, candidate=None):
+        if candidate is not None:
+            try:
+                Draft4Validator.check_schema(candidate)
+            except (SchemaError, ValidationError):
+                raise ValueError('Schema is invalid.')
+        self.schema_id = schema.id
+        self.schema_body = schema.raw_json if candidate is None else codec.dump_body(candidate)
+        self.status = self.PENDING
+        self.processed = 0
+        self.invalid_count = 0
+        self.created_at = datetime.utcnow()
+
+    def __repr__(self):
+        return "<{0}: {1}>".format(self.__class__.__name__, self.id)
+
+    def save(self):
+        with transaction() as s:
+            s.add(self)
+            _flush(s, self, 'Creating validation job is failed.')
+
+    @classmethod
+    def get(cls, schema_id, _id):
+        return cls.query.filter(cls.id==_id, cls.schema_id==schema_id).first()
+
+    @classmethod
+    def claim(cls, lease):
+        """Take the oldest job to run, or None. The job is held for ``lease`` seconds."""
+        now = datetime.utcnow()
+        claimable = or_(
+            cls.status==cls.PENDING,
+            and_(cls.status==cls.RUNNING, cls.locked_until <= now))
+        token = str(uuid.uuid4())
+        with transaction() as s:
+            _id = s.query(cls.id).filter(claimable).order_by(cls.id).limit(1).scalar()
+            if _id is None:
+                return None
+            count = s.query(cls).filter(cls.id==_id, claimable).update({
+                cls.status: cls.RUNNING,
+                cls.token: token,
+                cls.locked_until: now + timedelta(seconds=lease),
+                cls.started_at: func.coalesce(cls.started_at, now)}, synchronize_session=False)
+            if not count:
+                # Claimed by another runner
+                return None
+            job = s.get(cls, _id)
+            # Kept out of the session, not to reload the row after every commit.
+            job._claimed = (_id, token)
+            if job.total is None:
+                job.total = s.query(func.count(Resource.id)).filter(
+                    Resource.schema_id==job.schema_id).scalar()
+            logger.debug('Claim: {0}'.format(job))
+        return job
+
+    @staticmethod
+    def next_chunk(schema_id, after, size):
+        """(id, body, body_z) of the resources of the schema after ``after``, in ID order."""
+        table = Resource.__table__
+        with transaction() as s:
+            query = select(table.c.id, table.c.body, table.c.body_z).where(
+                table.c.schema_id==schema_id).order_by(table.c.id).limit(size)
+            if after is not None:
+                query = query.where(table.c.id > after)
+            return [(row.id, row.body, row.body_z) for row in s.execute(query)]
+
+    def _update(self, s, values):
+        _id, token = self._claimed
+        count = s.query(ValidationJob).filter(
+            ValidationJob.id==_id, ValidationJob.token==token).update(
+            values, synchronize_session=False)
+        if not count:
+            raise JobLeaseLostError('Validation job is taken by another runner.')
+
+    def record(self, last_id, processed, invalid_ids, lease):
+        """Save the result of a chunk, and extend the lease."""
+        cls = ValidationJob
+        with transaction() as s:
+            self._update(s, {
+                cls.last_id: last_id,
+                cls.processed: cls.processed + processed,
+                cls.invalid_count: cls.invalid_count + len(invalid_ids),
+                cls.locked_until: datetime.utcnow() + timedelta(seconds=lease)})
+            if invalid_ids:
+                s.execute(validation_job_invalid_resources.insert(),
+                          [{'job_id': self._claimed[0], 'resource_id': r_id} for r_id in invalid_ids])
+
+    def finish(self, status, error=None):
+        cls = ValidationJob
+        with transaction() as s:
+            self._update(s, {
+                cls.status: status,
+                cls.error: error,
+                cls.locked_until: None,
+                cls.finished_at: datetime.utcnow()})
+            logger.debug('Finish: {0} {1}'.format(self._claimed[0], status))
+
+    @classmethod
+    def invalid_resources(cls, _id):
+        """Query of IDs of the invalid resources found by the job."""
+        return Session.query(validation_job_invalid_resources.c.resource_id).filter(
+            validation_job_invalid_resources.c.job_id==_id)
+
+validation_job_invalid_resources = Table('validation_job_invalid_resources', Base.metadata,
+    Column('job_id', Integer, ForeignKey('validation_jobs.id')),
+    # Not a foreign key. Resources may be deleted after the job.
+    Column('resource_id', String),
+    # Serves keyset pagination of the IDs by job.
+    Index('ux_validation_job_invalid_resources_job_id', 'job_id', 'resource_id', unique=True)
 )
+
+class Change(Base):
+    """Log of the writes of schemas and resources(deletes included), for the change feed.
+
+    ``seq`` increases in commit order, so a consumer reads the changes after
+    the last ``seq`` it has seen, and never misses one committed later with
+    a smaller ``seq``:
+
+    - PostgreSQL: writers append to the log when they commit, under a
+      transaction-level advisory lock. The lock is held only while committing,
+      so the rest of the writes run concurrently.
+    - SQLite: writers are serialized by the database lock.
+
+    The log has IDs and hashes only. Bodies are read from the resources.
+    """
+
+    __tablename__ = 'changes'
+
+    CREATE = 'create'
+    UPDATE = 'update'
+    DELETE = 'delete'
+
+    # Key of the advisory lock of appenders(PostgreSQL)
+    LOCK_KEY = 0x63686e67
+    # Key of Session.info. Changes appended at commit.
+    PENDING = 'caprice.changes'
+
+    seq = Column(Integer, Sequence('change_seq'), primary_key=True)
+    # schema or resource
+    type = Column(String(16))
+    object_id = Column(String)
+    schema_id = Column(String)
+    op = Column(String(8))
+    # body_hash(ETag) after the change. NULL for deletes.
+    body_hash = Column(String(40))
+    created_at = Column(DateTime)
+
+    __table_args__ = (
+        # Changes of a schema(and its resources)
+        Index('ix_changes_schema_id_seq', 'schema_id', 'seq'),
+        # SQLite reuses the largest rowid without AUTOINCREMENT.
+        {'sqlite_autoincrement': True},
+    )
+
+    @classmethod
+    def record(cls, s, op, type, rows):
+        """Append ``op`` of ``rows``((object ID, schema ID, body hash)) when the transaction
+        of ``s`` is committed. They are discarded by rollback.
+        """
+        # Begin the transaction(if not yet), whose rollback discards them.
+        s.connection()
+        now = datetime.utcnow()
+        s.info.setdefault(cls.PENDING, []).extend(
+            {'type': type, 'object_id': object_id, 'schema_id': schema_id, 'op': op,
+             'body_hash': body_hash, 'created_at': now}
+            for object_id, schema_id, body_hash in rows)
+
+    @classmethod
+    def _append(cls, s, changes):
+        if s.get_bind().dialect.name == 'postgresql':
+            s.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': cls.LOCK_KEY})
+        s.execute(cls.__table__.insert(), changes)
+
+    @classmethod
+    def since(cls, seq, schema_id=None):
+        """Query of the changes after ``seq``, in order."""
+        query = cls.query.filter(cls.seq > seq)
+        if schema_id is not None:
+            query = query.filter(cls.schema_id==schema_id)
+        return query.order_by(cls.seq)
+
+@event.listens_for(Session, 'before_commit')
+def _append_changes(s):
+    changes = s.info.pop(Change.PENDING, None)
+    if changes:
+        Change._append(s, changes)
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_changes(s, previous_transaction):
+    s.info.pop(Change.PENDING, None)
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Notification of released locks, for the waiters of blocking acquire.
+
+Waiters in a process wait on a condition variable. Releases wake them:
+
+- PostgreSQL: release sends NOTIFY in its transaction, and a listener
+  thread in each process wakes the local waiters. So releases in other
+  processes wake them too.
+- Others(SQLite): release wakes the waiters in the same process only.
+
+Waiters should limit the timeout, because expiry of locks isn't notified.
+"""
+
+import os
+import select
+import threading
+import time
+from logging import getLogger
+
+from sqlalchemy import text
+
+# Handlers of this logger depends on Flask application
+logger = getLogger(__name__)
+
+__all__ = ['init', 'generation', 'wait', 'publish', 'notify', 'subscribe', 'unsubscribe', 'listen']
+
+CHANNEL = 'caprice_lock_released'
+
+class Notifier(object):
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self.generation = 0
+
+    def notify(self):
+        with self._cond:
+            self.generation += 1
+            self._cond.notify_all()
+        for callback in _subscribers:
+            callback()
+
+    def wait(self, generation, timeout):
+        """Wait until notified after ``generation``. Returns whether it's notified."""
+        with self._cond:
+            if self.generation == generation:
+                self._cond.wait(timeout)
+            return self.generation != generation
+
+    def publish(self, session):
+        # Nothing to send to other processes.
+        pass
+
+    def listen(self):
+        # Nothing to receive from other processes.
+        pass
+
+class PostgresNotifier(Notifier):
+
+    def __init__(self, engine):
+        super(PostgresNotifier, self).__init__()
+        self.engine = engine
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def wait(self, generation, timeout):
+        self.listen()
+        return super(PostgresNotifier, self).wait(generation, timeout)
+
+    def publish(self, session):
+        # Delivered when the transaction is committed.
+        session.execute(text('SELECT pg_notify(:channel, \'\')'), {'channel': CHANNEL})
+
+    def listen(self):
+        # Started lazily, because threads don't survive fork of workers.
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        listener = threading.Thread(target=self._listen, name='caprice-lock-listener')
+        listener.daemon = True
+        listener.start()
+
+    def _listen(self):
+        while True:
+            conn = None
+            try:
+                # This connection is dedicated to LISTEN, and never returned to the pool.
+                conn = self.engine.raw_connection()
+                dbapi_conn = conn.driver_connection
+                dbapi_conn.autocommit = True
+                dbapi_conn.cursor().execute('LISTEN {0}'.format(CHANNEL))
+                logger.debug('Listen: {0}'.format(CHANNEL))
+                while True:
+                    if select.select([dbapi_conn], [], [], 5) == ([], [], []):
+                        continue
+                    dbapi_conn.poll()
+                    if dbapi_conn.notifies:
+                        del dbapi_conn.notifies[:]
+                        self.notify()
+            except Exception as e:
+                logger.error('Listening {0} is failed. Error details: {1}'.format(CHANNEL, e))
+                if conn is not None:
+                    conn.invalidate()
+                # Waiters may miss releases until reconnected. Their timeout covers it.
+                self.notify()
+                time.sleep(1)
+
+_notifier = Notifier()
+# Called on notification, e.g. to wake the waiters of asyncio(See asgi.py).
+_subscribers = []
+
+def init(engine):
+    global _notifier
+    if engine.dialect.name == 'postgresql':
+        _notifier = PostgresNotifier(engine)
+    else:
+        _notifier = Notifier()
+
+def generation():
+    return _notifier.generation
+
+def wait(generation, timeout):
+    return _notifier.wait(generation, timeout)
+
+def publish(session):
+    """Send the notification in the transaction of release(before commit)."""
+    _notifier.publish(session)
+
+def notify():
+    """Wake the waiters in this process(after commit of release)."""
+    _notifier.notify()
+
+def subscribe(callback):
+    """Call ``callback`` on every notification in this process. It's called from any thread."""
+    _subscribers.append(callback)
+
+def unsubscribe(callback):
+    _subscribers.remove(callback)
+
+def listen():
+    """Start receiving the notifications from other processes, if the backend supports it."""
+    _notifier.listen()
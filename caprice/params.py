@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Parameters of lock requests, shared by the Flask(views.py) and ASGI(asgi.py) applications.
+
+Invalid values raise ValueError('Request is invalid.').
+"""
+
+import math
+
+__all__ = ['lock_resources', 'lock_ttl', 'lock_wait']
+
+def lock_resources(body):
+    """IDs of the resources to lock in ``body``(JSON of the request)."""
+    resources = body.get('resources') if isinstance(body, dict) else None
+    # IDs are used as set members and bound to SQL. Objects/arrays aren't IDs.
+    if not (isinstance(resources, list) and resources
+            and all(isinstance(r, str) for r in resources)):
+        raise ValueError('Request is invalid.')
+    return resources
+
+def lock_ttl(body, config):
+    """Lease(seconds) of ``body``(JSON object of the request), or None if the lock never expires.
+
+    Locks never expire only if LOCK_TTL is None. Clients can't ask for it.
+    """
+    if not isinstance(body, dict) or ('ttl' in body and body['ttl'] is None):
+        raise ValueError('Request is invalid.')
+    ttl = body.get('ttl', config.get('LOCK_TTL'))
+    if ttl is None:
+        return None
+    if (isinstance(ttl, bool) or not isinstance(ttl, (int, float))
+            or not math.isfinite(ttl) or ttl <= 0):
+        raise ValueError('Request is invalid.')
+    return min(ttl, config.get('LOCK_MAX_TTL', 3600))
+
+def lock_wait(value, config):
+    """Max wait(seconds) of ``wait`` query parameter."""
+    try:
+        wait = float(value if value is not None else 0)
+    except ValueError:
+        raise ValueError('Request is invalid.')
+    # NaN passes the comparisons below, and it would wait forever.
+    if not math.isfinite(wait) or wait < 0:
+        raise ValueError('Request is invalid.')
+    # Must be shorter than harakiri of uWSGI. On ASGI, clients and proxies have their timeouts too.
+    return min(wait, config.get('LOCK_MAX_WAIT', 15))
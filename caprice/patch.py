@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""JSON Patch(RFC 6902) and JSON Merge Patch(RFC 7396).
+
+Patches don't modify the given document. Only the containers on the changed
+paths are copied, and the rest is shared with the original, so the cost
+depends on the size of the change rather than the size of the document.
+
+Both return (patched document, changed top-level keys). The keys are None if
+the whole document is replaced. See validators.is_valid_change.
+"""
+
+__all__ = ['PatchError', 'PatchConflictError', 'json_patch', 'merge_patch']
+
+class PatchError(ValueError):
+    """The patch can't be applied to the document."""
+    pass
+
+class PatchConflictError(PatchError):
+    """``test`` operation of the patch is failed."""
+    pass
+
+def _parse_pointer(pointer):
+    if not isinstance(pointer, str) or (pointer and not pointer.startswith('/')):
+        raise ValueError('Request is invalid.')
+    return [t.replace('~1', '/').replace('~0', '~') for t in pointer.split('/')[1:]]
+
+def _index(token, size, append=False):
+    if append and token == '-':
+        return size
+    if not token.isdigit() or (len(token) > 1 and token[0] == '0'):
+        raise PatchError("Patch can't be applied.")
+    i = int(token)
+    if i > size or (i == size and not append):
+        raise PatchError("Patch can't be applied.")
+    return i
+
+def _child(container, token):
+    if isinstance(container, dict):
+        if token in container:
+            return container[token]
+    elif isinstance(container, list):
+        return container[_index(token, len(container))]
+    raise PatchError("Patch can't be applied.")
+
+def _get(doc, tokens):
+    for token in tokens:
+        doc = _child(doc, token)
+    return doc
+
+def _copy(container):
+    if isinstance(container, dict):
+        return dict(container)
+    if isinstance(container, list):
+        return list(container)
+    raise PatchError("Patch can't be applied.")
+
+def _update(doc, tokens, change):
+    """Copy of ``doc`` where ``change(parent, last token)`` is applied to a copy of the parent."""
+    parent = _copy(doc)
+    if len(tokens) == 1:
+        change(parent, tokens[0])
+        return parent
+    key = tokens[0] if isinstance(parent, dict) else _index(tokens[0], len(parent))
+    parent[key] = _update(_child(doc, tokens[0]), tokens[1:], change)
+    return parent
+
+def _add(doc, tokens, value):
+    if not tokens:
+        return value
+    def change(parent, token):
+        if isinstance(parent, dict):
+            parent[token] = value
+        else:
+            parent.insert(_index(token, len(parent), append=True), value)
+    return _update(doc, tokens, change)
+
+def _remove(doc, tokens):
+    if not tokens:
+        raise PatchError("Patch can't be applied.")
+    def change(parent, token):
+        if isinstance(parent, dict):
+            if token not in parent:
+                raise PatchError("Patch can't be applied.")
+            del parent[token]
+        else:
+            del parent[_index(token, len(parent))]
+    return _update(doc, tokens, change)
+
+def _replace(doc, tokens, value):
+    if not tokens:
+        return value
+    def change(parent, token):
+        if isinstance(parent, dict):
+            if token not in parent:
+                raise PatchError("Patch can't be applied.")
+            parent[token] = value
+        else:
+            parent[_index(token, len(parent))] = value
+    return _update(doc, tokens, change)
+
+def _equal(a, b):
+    # 1 == 1.0 in JSON, but true != 1.
+    if isinstance(a, bool) or isinstance(b, bool):
+        return isinstance(a, bool) and isinstance(b, bool) and a == b
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(_equal(a[k], b[k]) for k in a)
+    if isinstance(a, list) and isinstance(b, list):
+        return len(a) == len(b) and all(_equal(x, y) for x, y in zip(a, b))
+    if isinstance(a, (int, float)) and isinstance(b, (int, float)):
+        return a == b
+    return type(a) == type(b) and a == b
+
+def json_patch(doc, operations):
+    """Apply JSON Patch ``operations``. All of them are applied, or ``PatchError`` is raised."""
+    if not isinstance(operations, list):
+        raise ValueError('Request is invalid.')
+    keys = set()
+    for op in operations:
+        if not isinstance(op, dict) or 'path' not in op:
+            raise ValueError('Request is invalid.')
+        name = op.get('op')
+        path = _parse_pointer(op['path'])
+        if name in ('add', 'replace', 'test') and 'value' not in op:
+            raise ValueError('Request is invalid.')
+        if name in ('move', 'copy'):
+            if 'from' not in op:
+                raise ValueError('Request is invalid.')
+            from_ = _parse_pointer(op['from'])
+
+        if name == 'add':
+            doc = _add(doc, path, op['value'])
+        elif name == 'remove':
+            doc = _remove(doc, path)
+        elif name == 'replace':
+            doc = _replace(doc, path, op['value'])
+        elif name == 'move':
+            # A location can't be moved into its children.
+            if path[:len(from_)] == from_ and path != from_:
+                raise PatchError("Patch can't be applied.")
+            value = _get(doc, from_)
+            doc = _add(_remove(doc, from_), path, value)
+            keys.add(from_[0] if from_ else None)
+        elif name == 'copy':
+            doc = _add(doc, path, _get(doc, from_))
+        elif name == 'test':
+            if not _equal(_get(doc, path), op['value']):
+                raise PatchConflictError('Patch test is failed.')
+            continue
+        else:
+            raise ValueError('Request is invalid.')
+        keys.add(path[0] if path else None)
+    return doc, (None if None in keys else keys)
+
+def _merge(target, patch):
+    if not isinstance(patch, dict):
+        return patch
+    result = dict(target) if isinstance(target, dict) else {}
+    for key, value in patch.items():
+        if value is None:
+            result.pop(key, None)
+        else:
+            result[key] = _merge(result.get(key), value)
+    return result
+
+def merge_patch(doc, patch):
+    """Apply JSON Merge Patch ``patch``."""
+    if not (isinstance(patch, dict) and isinstance(doc, dict)):
+        return _merge(doc, patch), None
+    return _merge(doc, patch), set(patch)
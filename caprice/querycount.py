@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Budgets of SQL statements per view, to catch N+1 queries in tests.
+
+Views declare the max number of statements of a request:
+
+    @api.route('/schemas', methods=['GET', 'POST'])
+    @query_budget({'GET': 1, 'POST': 1})
+    def schemas():
+        ...
+
+QueryBudgetChecker counts statements of each request(``before_cursor_execute``)
+and records a violation when the request exceeds the budget of its view, or
+when the same statement is repeated, which is a typical sign of lazy loading
+in a loop. tests/conftest.py enables it for all tests.
+
+QueryCounter counts statements of any block:
+
+    with QueryCounter() as counter:
+        Lock.get(1).resources
+    assert counter.count == 2
+"""
+
+import threading
+from collections import Counter
+
+from flask import request, request_finished, request_started
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+__all__ = ['QueryCounter', 'QueryBudgetError', 'QueryBudgetChecker', 'query_budget']
+
+class QueryBudgetError(AssertionError):
+    pass
+
+def query_budget(max_queries, max_repeats=1):
+    """Declare the max number of statements of the view, and of the same statement.
+
+    ``max_queries`` is a number, or a dict of HTTP method to number.
+    """
+    def decorator(view):
+        view.query_budget = (max_queries, max_repeats)
+        return view
+    return decorator
+
+class QueryCounter(object):
+    """Statements executed in the block in this thread. Without ``engine``, all engines."""
+
+    def __init__(self, engine=None):
+        self.target = engine or Engine
+        self.statements = []
+        self._thread = None
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def repeated(self, max_repeats=1):
+        """Statements executed more than ``max_repeats`` times, with the number of times."""
+        return dict(
+            (statement, n) for statement, n in Counter(self.statements).items() if n > max_repeats)
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        if threading.current_thread() is self._thread:
+            self.statements.append(statement)
+
+    def __enter__(self):
+        self._thread = threading.current_thread()
+        event.listen(self.target, 'before_cursor_execute', self._record)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        event.remove(self.target, 'before_cursor_execute', self._record)
+
+class QueryBudgetChecker(object):
+    """Check budgets of views declared by ``query_budget``, while it's entered."""
+
+    def __init__(self):
+        self.violations = []
+        self._local = threading.local()
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        statements = getattr(self._local, 'statements', None)
+        if statements is not None:
+            statements.append(statement)
+
+    def _started(self, sender, **extra):
+        self._local.statements = []
+
+    def _finished(self, sender, response, **extra):
+        statements = self._local.statements
+        self._local.statements = None
+        view = sender.view_functions.get(request.endpoint)
+        budget = getattr(view, 'query_budget', None)
+        if budget is None:
+            return
+        max_queries, max_repeats = budget
+        if isinstance(max_queries, dict):
+            max_queries = max_queries.get(request.method)
+        where = '{0} {1}({2})'.format(request.method, request.path, request.endpoint)
+        if max_queries is not None and len(statements) > max_queries:
+            self.violations.append('{0}: {1} statements exceed the budget {2}:\n  {3}'.format(
+                where, len(statements), max_queries, '\n  '.join(statements)))
+        for statement, n in Counter(statements).items():
+            if n > max_repeats:
+                self.violations.append('{0}: repeated {1} times:\n  {2}'.format(where, n, statement))
+
+    def check(self):
+        if self.violations:
+            raise QueryBudgetError('\n'.join(self.violations))
+
+    def __enter__(self):
+        event.listen(Engine, 'before_cursor_execute', self._record)
+        request_started.connect(self._started)
+        request_finished.connect(self._finished)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        request_finished.disconnect(self._finished)
+        request_started.disconnect(self._started)
+        event.remove(Engine, 'before_cursor_execute', self._record)
@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Re-encode stored bodies with the current compression settings
+(BODY_COMPRESSION, BODY_COMPRESSION_THRESHOLD). See compression.py.
+
+Rows are updated in batches, one transaction per batch, so it can run
+while the application is serving:
+
+    $ python -m caprice.reencode [config.ini] [develop|production] [batch size]
+"""
+
+import os
+import sys
+from logging import getLogger, basicConfig, INFO
+
+from .models import Schema, Resource
+
+logger = getLogger(__name__)
+
+__all__ = ['reencode', 'main']
+
+def reencode(batch_size=1000):
+    """Returns the number of changed rows of each model."""
+    result = {}
+    for model in (Schema, Resource):
+        result[model.__name__] = model.reencode(batch_size)
+        logger.info('Reencoded {0}: {1} rows'.format(model.__name__, result[model.__name__]))
+    return result
+
+def main(argv=None):
+    from paste.deploy import loadapp
+
+    argv = sys.argv[1:] if argv is None else argv
+    config = argv[0] if len(argv) > 0 else 'config.ini'
+    name = argv[1] if len(argv) > 1 else os.environ.get('ENVIRONMENT_TYPE', 'develop')
+    batch_size = int(argv[2]) if len(argv) > 2 else 1000
+    basicConfig(level=INFO)
+    # Settings of compression are applied by the application. Its threads aren't needed.
+    loadapp('config:{0}'.format(config), name=name, relative_to='.',
+            global_conf={'background_threads': 'false'})
+    reencode(batch_size)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
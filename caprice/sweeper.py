@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Periodic deletion of expired locks.
+
+The sweeper runs as a daemon thread in the application process(see
+LOCK_SWEEP_INTERVAL), or as a standalone process:
+
+    $ python -m caprice.sweeper [config.ini] [develop|production]
+"""
+
+import os
+import sys
+import threading
+from logging import getLogger, basicConfig, INFO
+
+from .db import Session
+from .models import Lock
+
+# Handlers of this logger depends on Flask application
+logger = getLogger(__name__)
+
+__all__ = ['Sweeper', 'start', 'main']
+
+class Sweeper(threading.Thread):
+
+    def __init__(self, interval, batch_size=1000):
+        super(Sweeper, self).__init__(name='caprice-lock-sweeper')
+        self.daemon = True
+        self.interval = interval
+        self.batch_size = batch_size
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            self.sweep()
+
+    def sweep(self):
+        try:
+            return Lock.sweep(self.batch_size)
+        except Exception as e:
+            # Next round retries.
+            logger.error('Sweeping locks is failed. Error details: {0}'.format(e))
+            return 0
+        finally:
+            Session.remove()
+
+    def stop(self):
+        self._stopped.set()
+
+def start(app):
+    sweeper = Sweeper(
+        app.config['LOCK_SWEEP_INTERVAL'],
+        app.config.get('LOCK_SWEEP_BATCH_SIZE', 1000))
+    sweeper.start()
+    logger.debug('Start lock sweeper: every {0} seconds'.format(sweeper.interval))
+    return sweeper
+
+def main(argv=None):
+    from paste.deploy import loadapp
+
+    argv = sys.argv[1:] if argv is None else argv
+    config = argv[0] if len(argv) > 0 else 'config.ini'
+    name = argv[1] if len(argv) > 1 else os.environ.get('ENVIRONMENT_TYPE', 'develop')
+    basicConfig(level=INFO)
+    # Only the sweeper below runs in this process.
+    app = loadapp('config:{0}'.format(config), name=name, relative_to='.',
+                  global_conf={'background_threads': 'false'})
+    sweeper = Sweeper(
+        app.config.get('LOCK_SWEEP_INTERVAL') or 30,
+        app.config.get('LOCK_SWEEP_BATCH_SIZE', 1000))
+    sweeper.run()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
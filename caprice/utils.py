@@ -0,0 +1,15 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+
+__all__ = ['digest', 'canonical_digest']
+
+def digest(text):
+    """Content hash of the string. It's used as ETag and cache key."""
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+def canonical_digest(value):
+    """Content hash of JSON value, regardless of key order and whitespace."""
+    return digest(json.dumps(value, sort_keys=True, separators=(',', ':'), ensure_ascii=False))
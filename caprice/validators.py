@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import threading
+from collections import OrderedDict
+from logging import getLogger
+
+from jsonschema import Draft4Validator
+
+# Handlers of this logger depends on Flask application
+logger = getLogger(__name__)
+
+__all__ = ['ValidatorCache', 'validator_cache', 'is_valid_change']
+
+class ValidatorCache(object):
+    """Per-process LRU cache of compiled validators.
+
+    Validators are keyed by schema ID and the content hash of the schema body,
+    so a replaced schema never hits a stale validator.
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._validators = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._validators)
+
+    def get(self, schema):
+        key = (schema.id, schema.etag)
+        with self._lock:
+            validator = self._validators.pop(key, None)
+            if validator is not None:
+                # Re-insert to mark as most recently used.
+                self._validators[key] = validator
+                return validator
+        logger.debug('Compile validator: {0}'.format(schema.id))
+        validator = Draft4Validator(schema.json)
+        with self._lock:
+            self._validators[key] = validator
+            while len(self._validators) > self.maxsize:
+                self._validators.popitem(last=False)
+        return validator
+
+    def invalidate(self, schema_id):
+        with self._lock:
+            for key in [k for k in self._validators if k[0] == schema_id]:
+                del self._validators[key]
+
+    def clear(self):
+        with self._lock:
+            self._validators.clear()
+
+validator_cache = ValidatorCache()
+
+# Keywords of the root schema which don't relate top-level properties each other.
+# With others(e.g. dependencies, allOf), the whole document is validated.
+_INDEPENDENT_KEYWORDS = frozenset([
+    '$schema', 'id', 'title', 'description', 'definitions',
+    'type', 'properties', 'required', 'additionalProperties'])
+
+def is_valid_change(schema, value, keys):
+    """Whether ``value`` is valid, which was valid before top-level ``keys`` were changed.
+
+    Only the changed properties are validated when the schema allows it.
+    If ``keys`` is None, the whole document is validated.
+    """
+    validator = validator_cache.get(schema)
+    root = schema.json
+    properties = root.get('properties')
+    if (keys is None or not isinstance(value, dict) or not isinstance(properties, dict)
+            or not _INDEPENDENT_KEYWORDS.issuperset(root)
+            or root.get('type', 'object') != 'object'
+            or not all(k in properties for k in keys)
+            # Removed keys may be required.
+            or not all(k in value for k in keys if k in root.get('required', []))):
+        return validator.is_valid(value)
+    return all(
+        validator.evolve(schema=properties[k]).is_valid(value[k]) for k in keys if k in value)
@@ -1,29 +1,140 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import json
 import uuid
 from logging import getLogger
 
 from flask import Blueprint, Response
-from flask import jsonify, render_template, redirect, url_for, request
+from flask import current_app, jsonify, render_template, redirect, url_for, request
+from flask import abort, stream_with_context
 from jsonschema import Draft4Validator, SchemaError
 
+from . import codec
+from .db import Session, pool_stats
+from .fields import parse_fields, Projection
+from .metrics import collect, render
+from .filters import parse_where, Filter
+from .listing import page_limit, key_value, page, dump_item, dump_list
 from .models import *
+from .models import validation_job_invalid_resources
+from .params import lock_resources, lock_ttl, lock_wait
+from .patch import json_patch, merge_patch, PatchError, PatchConflictError
+from .querycount import query_budget
+from .validators import validator_cache
 
 # Handlers of this logger depends on Flask application
 logger = getLogger(__name__)
 
 api = Blueprint('api', __name__)
 
+def _limit():
+    return page_limit(request.args.get('limit'), current_app.config)
+
+def _after(key):
+    """``after`` cursor in the type of ``key``, or None."""
+    after = request.args.get('after')
+    return key_value(after, key) if after is not None else None
+
+def _paginate(query, key, where=None):
+    """Keyset pagination over ``key``.
+
+    Rows after the ``after`` cursor are fetched in ``key`` order, so the
+    page cost doesn't depend on how deep the page is.
+    Returns the rows of the page and the cursor of the next page(or None).
+    Rows dropped by ``where``(Filter) leave the page short.
+    """
+    limit = _limit()
+    after = _after(key)
+    if after is not None:
+        query = query.filter(key > after)
+    # One extra row tells whether the next page exists.
+    return page(query.order_by(key).limit(limit + 1).all(), limit, key, where)
+
+def _schema_or_404(schema_id):
+    """Schema of ``schema_id``. The request is aborted with 404 if it isn't found."""
+    schema = Schema.query.filter(Schema.id==schema_id).first()
+    if not schema:
+        res = jsonify({'error': {'message': "Schema isn't found."}})
+        res.status_code = 404
+        abort(res)
+    return schema
+
+def _list_response(name, rows, _next, projection=None):
+    return Response(dump_list(name, rows, _next, projection), mimetype='application/json')
+
+def _projection(model):
+    """Projection of ``fields`` parameters, or None if they aren't given."""
+    if 'fields' not in request.args:
+        return None
+    return Projection(
+        model, Session().get_bind().dialect.name, parse_fields(request.args.getlist('fields')))
+
+def _not_modified(query, projection=None):
+    """Response of conditional GET if the client has the current body, otherwise None.
+
+    Only the hash column is read, so the body isn't loaded.
+    """
+    if not request.if_none_match:
+        return None
+    body_hash = query.scalar()
+    if body_hash and projection is not None:
+        body_hash = projection.etag(body_hash)
+    if not (body_hash and body_hash in request.if_none_match):
+        return None
+    res = Response('')
+    res.status_code = 304
+    res.set_etag(body_hash)
+    return res
+
+def _wants_stream():
+    return (request.args.get('stream') in ('1', 'true')
+            or request.accept_mimetypes.best == 'application/x-ndjson')
+
+def _stream(query, key, name, projection=None, where=None):
+    """Stream all rows after the ``after`` cursor without building the list.
+
+    Rows are read from a server-side cursor in chunks of STREAM_CHUNK_SIZE.
+    The body is a JSON object same as the paginated response(without ``next``),
+    or one JSON object per line if the client accepts application/x-ndjson.
+    """
+    after = _after(key)
+    if after is not None:
+        query = query.filter(key > after)
+    rows = query.order_by(key).yield_per(
+            current_app.config.get('STREAM_CHUNK_SIZE', 500))
+    if where is not None:
+        rows = (row for row in rows if where.match(row))
+
+    if request.accept_mimetypes.best == 'application/x-ndjson':
+        def generate():
+            for row in rows:
+                yield dump_item(row, projection) + '\n'
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+    def generate():
+        yield '{{"{0}": ['.format(name)
+        sep = ''
+        for row in rows:
+            yield sep + dump_item(row, projection)
+            sep = ', '
+        yield ']}'
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
 @api.route('/schemas', methods=['GET', 'POST'])
+@query_budget({'GET': 1, 'POST': 3})
 def schema():
     # TODO: controller is needed?
     if request.method == 'GET':
         # TODO: JSON-Model mapping
-        # TODO: Pagination
-        res = jsonify({'schemas': [{'id': s.id, 'body': s.json} for s in Schema.query.all()]})
-        return res
+        if _wants_stream():
+            return _stream(Schema.query, Schema.id, 'schemas')
+        try:
+            schemas, _next = _paginate(Schema.query, Schema.id)
+        except ValueError as e:
+            res = jsonify({'error': {'message': str(e)}})
+            res.status_code = 400
+            return res
+        return _list_response('schemas', schemas, _next)
     if request.method == 'POST':
         body = request.get_json(silent=True)
         # TODO: Sophisticated error handling
@@ -32,18 +143,18 @@ def schema():
             res.status_code = 400
             return res
         try:
-            _id = str(uuid.uuid4())
-            schema = Schema(id=_id, json=body)
-            schema.save()
+            # Same schema is registered once.
+            _id, created = Schema.register(body)
             # TODO: JSON-Model mapping
             res = jsonify({'id': _id})
-            res.status_code = 201
+            res.status_code = 201 if created else 200
         except ValueError as e:
             res = jsonify({'error': {'message': str(e)}})
             res.status_code = 400
         return res
 
 @api.route('/schemas/<string:_id>', methods=['GET', 'PUT', 'DELETE'])
+@query_budget({'GET': 2, 'PUT': 3, 'DELETE': 5})
 def schema_id(_id):
     # TODO: DRY. controller is needed?
     if request.method == 'PUT':
@@ -52,9 +163,15 @@ def schema_id(_id):
             res = jsonify({'error': {'message': 'Request is invalid.'}})
             res.status_code = 400
             return res
+        same_id = Schema.find_same(body)
+        if same_id and same_id != _id:
+            res = jsonify({'error': {'message': 'Same schema is already registered.'}, 'id': same_id})
+            res.status_code = 409
+            return res
         try:
             schema = Schema(id=_id, json=body)
             schema.save()
+            validator_cache.invalidate(_id)
             res = jsonify({'id': _id})
             res.status_code = 201
             return res
@@ -63,6 +180,10 @@ def schema_id(_id):
             res.status_code = 400
             return res
 
+    if request.method == 'GET':
+        res = _not_modified(Schema.query.with_entities(Schema.body_hash).filter(Schema.id==_id))
+        if res:
+            return res
     schema = Schema.query.filter(Schema.id==_id).first()
     if not schema:
         res = jsonify({'error': {'message': "Schema isn't found."}})
@@ -70,16 +191,20 @@ def schema_id(_id):
         return res
     # TODO: Error handling
     if request.method == 'GET':
-        res = jsonify(schema.json)
+        # Stored JSON is sent as is. It's already serialized.
+        res = Response(schema.raw_json, mimetype='application/json')
         res.status_code = 200
+        res.set_etag(schema.etag)
         return res
     if request.method == 'DELETE':
         schema.delete()
+        validator_cache.invalidate(_id)
         res = Response('')
         res.status_code = 204
         return res
 
 @api.route('/schemas/<string:schema_id>/resources', methods=['GET', 'POST'])
+@query_budget({'GET': 2, 'POST': 3})
 def resource(schema_id):
     # TODO: DRY. Same process exists in schema API
     schema = Schema.query.filter(Schema.id==schema_id).first()
@@ -90,10 +215,31 @@ def resource(schema_id):
     # TODO: controller is needed?
     if request.method == 'GET':
         # TODO: JSON-Model mapping
-        # TODO: Pagination
-        resources = Resource.query.filter(Resource.schema_id==schema_id).all()
-        res = jsonify({'resources': [{'id': r.id, 'body': r.json} for r in resources]})
-        return res
+        query = Resource.query.filter(Resource.schema_id==schema_id)
+        where = None
+        try:
+            exprs = request.args.getlist('where')
+            if exprs:
+                where = Filter(Resource, query.session.get_bind().dialect.name,
+                               [parse_where(expr) for expr in exprs])
+                query = query.filter(where.clause)
+            projection = _projection(Resource)
+        except ValueError as e:
+            res = jsonify({'error': {'message': str(e)}})
+            res.status_code = 400
+            return res
+        if projection is not None:
+            # Only the requested fields are read.
+            query = query.with_entities(*projection.columns)
+        if _wants_stream():
+            return _stream(query, Resource.id, 'resources', projection, where)
+        try:
+            resources, _next = _paginate(query, Resource.id, where)
+        except ValueError as e:
+            res = jsonify({'error': {'message': str(e)}})
+            res.status_code = 400
+            return res
+        return _list_response('resources', resources, _next, projection)
     if request.method == 'POST':
         # TODO: DRY. Same process exists in schema API
         body = request.get_json(silent=True)
@@ -114,8 +260,46 @@ def resource(schema_id):
             res.status_code = 400
             return res
 
+@api.route('/schemas/<string:schema_id>/resources/batch', methods=['POST'])
+@query_budget({'POST': 3})
+def resource_batch(schema_id):
+    schema = _schema_or_404(schema_id)
+    if request.mimetype == 'application/x-ndjson':
+        values = []
+        for line in request.get_data(as_text=True).splitlines():
+            if not line.strip():
+                continue
+            try:
+                values.append(codec.loads(line))
+            except ValueError:
+                # Reported as an invalid item
+                values.append(None)
+    else:
+        values = request.get_json(silent=True)
+    if not values or not isinstance(values, list):
+        res = jsonify({'error': {'message': 'Request is invalid.'}})
+        res.status_code = 400
+        return res
+    if len(values) > current_app.config.get('BATCH_MAX_ITEMS', 10000):
+        res = jsonify({'error': {'message': 'Too many items.'}})
+        res.status_code = 413
+        return res
+    try:
+        results = Resource.bulk_save(schema, values)
+    except ValueError as e:
+        res = jsonify({'error': {'message': str(e)}})
+        res.status_code = 400
+        return res
+    # TODO: JSON-Model mapping
+    res = jsonify({'resources': [
+        {'error': {'message': str(r)}} if isinstance(r, ValueError) else {'id': r}
+        for r in results]})
+    res.status_code = 200
+    return res
+
 # TODO: How to present parent relations of REST resources?
-@api.route('/schemas/<string:schema_id>/resources/<string:resource_id>', methods=['GET', 'PUT', 'DELETE'])
+@api.route('/schemas/<string:schema_id>/resources/<string:resource_id>', methods=['GET', 'PUT', 'PATCH', 'DELETE'])
+@query_budget({'GET': 3, 'PUT': 3, 'PATCH': 4, 'DELETE': 5})
 def resource_id(schema_id, resource_id):
     # TODO: DRY. Same process exists in schema API
     schema = Schema.query.filter(Schema.id==schema_id).first()
@@ -143,6 +327,23 @@ def resource_id(schema_id, resource_id):
             res.status_code = 400
             return res
 
+    if request.method == 'PATCH':
+        return _patch_resource(schema, resource_id)
+
+    if request.method == 'GET':
+        try:
+            projection = _projection(Resource)
+        except ValueError as e:
+            res = jsonify({'error': {'message': str(e)}})
+            res.status_code = 400
+            return res
+        res = _not_modified(
+            Resource.query.with_entities(Resource.body_hash).filter(Resource.id==resource_id),
+            projection)
+        if res:
+            return res
+        if projection is not None:
+            return _projected_resource(resource_id, projection)
     resource = Resource.query.filter(Resource.id==resource_id).first()
     if not resource:
         res = jsonify({'error': {'message': "Resource isn't found."}})
@@ -150,8 +351,10 @@ def resource_id(schema_id, resource_id):
         return res
     # TODO: Error handling
     if request.method == 'GET':
-        res = jsonify(resource.json)
+        # Stored JSON is sent as is. It's already serialized.
+        res = Response(resource.raw_json, mimetype='application/json')
         res.status_code = 200
+        res.set_etag(resource.etag)
         return res
     if request.method == 'DELETE':
         resource.delete()
@@ -159,36 +362,251 @@ def resource_id(schema_id, resource_id):
         res.status_code = 204
         return res
 
-@api.route('/locks', methods=['GET', 'POST'])
-def lock():
+def _projected_resource(resource_id, projection):
+    row = Resource.query.with_entities(Resource.body_hash, *projection.columns).filter(
+        Resource.id==resource_id).first()
+    if not row:
+        res = jsonify({'error': {'message': "Resource isn't found."}})
+        res.status_code = 404
+        return res
+    res = Response(projection.dump(row), mimetype='application/json')
+    res.status_code = 200
+    # Rows stored before body_hash column was added don't have the ETag.
+    if row.body_hash:
+        res.set_etag(projection.etag(row.body_hash))
+    return res
+
+# Content-Type -> function of patch.py
+PATCH_TYPES = {
+    'application/json-patch+json': json_patch,
+    'application/merge-patch+json': merge_patch,
+}
+
+def _patch_resource(schema, resource_id):
+    apply = PATCH_TYPES.get(request.mimetype)
+    if apply is None:
+        res = jsonify({'error': {'message': 'Content-Type is unsupported.'}})
+        res.status_code = 415
+        res.headers['Accept-Patch'] = ', '.join(sorted(PATCH_TYPES))
+        return res
+    try:
+        patch = codec.loads(request.get_data())
+    except ValueError:
+        res = jsonify({'error': {'message': 'Request is invalid.'}})
+        res.status_code = 400
+        return res
+    try:
+        resource = Resource.patch(schema, resource_id, lambda doc: apply(doc, patch))
+        res = jsonify({'id': resource_id})
+        res.status_code = 200
+        res.set_etag(resource.etag)
+        return res
+    except ResourceNotFoundError as e:
+        res = jsonify({'error': {'message': str(e)}})
+        res.status_code = 404
+        return res
+    except PatchConflictError as e:
+        res = jsonify({'error': {'message': str(e)}})
+        res.status_code = 409
+        return res
+    except PatchError as e:
+        res = jsonify({'error': {'message': str(e)}})
+        res.status_code = 422
+        return res
+    except ValueError as e:
+        res = jsonify({'error': {'message': str(e)}})
+        res.status_code = 400
+        return res
+
+def _dump_job(job):
+    return {
+        'id': job.id,
+        'schema_id': job.schema_id,
+        'status': job.status,
+        'total': job.total,
+        'processed': job.processed,
+        'invalid_count': job.invalid_count,
+        'error': job.error,
+        'created_at': _isoformat(job.created_at),
+        'started_at': _isoformat(job.started_at),
+        'finished_at': _isoformat(job.finished_at)}
+
+@api.route('/schemas/<string:schema_id>/validation-jobs', methods=['GET', 'POST'])
+@query_budget({'GET': 2, 'POST': 2})
+def validation_job(schema_id):
+    schema = _schema_or_404(schema_id)
+    if request.method == 'GET':
+        try:
+            jobs, _next = _paginate(
+                ValidationJob.query.filter(ValidationJob.schema_id==schema_id), ValidationJob.id)
+        except ValueError as e:
+            res = jsonify({'error': {'message': str(e)}})
+            res.status_code = 400
+            return res
+        return jsonify({'jobs': [_dump_job(job) for job in jobs], 'next': _next})
     if request.method == 'POST':
-        body = request.get_json(silent=True)
-        if not body and body['resources']:
+        # A candidate schema can be checked before it replaces the current one.
+        body = request.get_json(silent=True) if request.get_data() else {}
+        if not isinstance(body, dict) or ('schema' in body and not body['schema']):
             res = jsonify({'error': {'message': 'Request is invalid.'}})
             res.status_code = 400
             return res
-        resources = Resource.query.filter(Resource.id.in_(body['resources'])).all()
-        for r_id in body['resources']:
-            if not (r_id in [resource.id for resource in resources]):
-                res = jsonify({'error': {'message': "Resource {0} isn't found.".format(r_id)}})
-                res.status_code = 404
-                return res
         try:
-            lock = Lock(resources)
-            lock.save()
+            job = ValidationJob(schema, body.get('schema'))
+            job.save()
+        except ValueError as e:
+            res = jsonify({'error': {'message': str(e)}})
+            res.status_code = 400
+            return res
+        # Run by the job runner(See jobs.py)
+        res = jsonify({'id': job.id})
+        res.status_code = 202
+        res.headers['Location'] = url_for(
+            'api.validation_job_id', schema_id=schema_id, job_id=job.id)
+        return res
+
+@api.route('/schemas/<string:schema_id>/validation-jobs/<int(max=2147483647):job_id>', methods=['GET'])
+@query_budget(1)
+def validation_job_id(schema_id, job_id):
+    job = ValidationJob.get(schema_id, job_id)
+    if not job:
+        res = jsonify({'error': {'message': "Validation job isn't found."}})
+        res.status_code = 404
+        return res
+    return jsonify(_dump_job(job))
+
+@api.route('/schemas/<string:schema_id>/validation-jobs/<int(max=2147483647):job_id>/invalid-resources', methods=['GET'])
+@query_budget(2)
+def validation_job_invalid(schema_id, job_id):
+    job = ValidationJob.get(schema_id, job_id)
+    if not job:
+        res = jsonify({'error': {'message': "Validation job isn't found."}})
+        res.status_code = 404
+        return res
+    # Found so far, if the job is running.
+    try:
+        rows, _next = _paginate(
+            ValidationJob.invalid_resources(job_id), validation_job_invalid_resources.c.resource_id)
+    except ValueError as e:
+        res = jsonify({'error': {'message': str(e)}})
+        res.status_code = 400
+        return res
+    return jsonify({'resources': [r.resource_id for r in rows], 'next': _next})
+
+def _lock_ttl(body):
+    return lock_ttl(body, current_app.config)
+
+def _lock_wait():
+    return lock_wait(request.args.get('wait'), current_app.config)
+
+def _isoformat(dt):
+    # Datetimes are stored as naive UTC.
+    return dt.isoformat() + 'Z' if dt else None
+
+def _dump_lock(lock):
+    return {
+        'id': lock.id,
+        'resources': [r.id for r in lock.resources],
+        'expires_at': _isoformat(lock.expires_at)}
+
+@api.route('/locks', methods=['GET', 'POST'])
+@query_budget({'POST': 4})
+def lock():
+    if request.method == 'POST':
+        body = request.get_json(silent=True)
+        try:
+            lock = Lock.acquire(lock_resources(body), _lock_ttl(body), _lock_wait())
             # TODO: JSON-Model mapping
             res = jsonify({'id': lock.id})
             res.status_code = 201
             return res
+        except ResourceNotFoundError as e:
+            res = jsonify({'error': {'message': str(e)}})
+            res.status_code = 404
+            return res
+        except LockConflictError as e:
+            res = jsonify({'error': {'message': str(e)}})
+            res.status_code = 409
+            return res
         except ValueError as e:
             res = jsonify({'error': {'message': str(e)}})
             res.status_code = 400
             return res
 
-@api.route('/locks/<int:_id>', methods=['GET', 'DELETE'])
+# IDs out of INTEGER(PostgreSQL) aren't bound to SQL, and they aren't found.
+@api.route('/locks/<int(max=2147483647):_id>', methods=['GET', 'PUT', 'DELETE'])
+@query_budget({'GET': 2, 'PUT': 1, 'DELETE': 2})
 def lock_id(_id):
-    res = Response('')
-    res.data = str(_id)
-    if request.method == 'DELETE':
-        res.status_code = 204
+    try:
+        if request.method == 'PUT':
+            # Heartbeat. Lease is extended from now.
+            # Without body, the lease is LOCK_TTL.
+            body = request.get_json(silent=True) if request.get_data() else {}
+            expires_at = Lock.renew(_id, _lock_ttl(body))
+            res = jsonify({'id': _id, 'expires_at': _isoformat(expires_at)})
+            res.status_code = 200
+            return res
+        if request.method == 'DELETE':
+            Lock.release(_id)
+            res = Response('')
+            res.status_code = 204
+            return res
+    except LockNotFoundError as e:
+        res = jsonify({'error': {'message': str(e)}})
+        res.status_code = 404
+        return res
+    except ValueError as e:
+        res = jsonify({'error': {'message': str(e)}})
+        res.status_code = 400
+        return res
+
+    lock = Lock.get(_id)
+    if not lock:
+        res = jsonify({'error': {'message': "Lock isn't found."}})
+        res.status_code = 404
+        return res
+    res = jsonify(_dump_lock(lock))
+    res.status_code = 200
     return res
+
+def _dump_change(change):
+    return {
+        'seq': change.seq,
+        'type': change.type,
+        'id': change.object_id,
+        'schema_id': change.schema_id,
+        'op': change.op,
+        'etag': change.body_hash,
+        'created_at': _isoformat(change.created_at)}
+
+@api.route('/changes', methods=['GET'])
+@query_budget(1)
+def changes():
+    # Consumers pass ``next`` of the last response as ``since``.
+    try:
+        since = key_value(request.args.get('since', '0'), Change.seq)
+        if since < 0:
+            raise ValueError('Request is invalid.')
+        limit = _limit()
+    except ValueError:
+        res = jsonify({'error': {'message': 'Request is invalid.'}})
+        res.status_code = 400
+        return res
+    rows = Change.since(since, request.args.get('schema_id')).limit(limit).all()
+    return jsonify({
+        'changes': [_dump_change(change) for change in rows],
+        'next': rows[-1].seq if rows else since})
+
+@api.route('/pool', methods=['GET'])
+@query_budget(0)
+def pool():
+    # Stats of this worker process only.
+    return jsonify(pool_stats.as_dict())
+
+@api.route('/metrics', methods=['GET'])
+@query_budget(0)
+def metrics():
+    # All workers, if METRICS_DIR is set.
+    return Response(
+        render(collect(current_app.extensions['caprice.metrics_dir'])),
+        content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -45,6 +45,24 @@ setup(name='Caprice',
           'SQLAlchemy',
           'psycopg2',
       ],
+      extras_require={
+          # Faster JSON codec(See caprice/codec.py)
+          'orjson': [
+              'orjson',
+          ],
+          # BODY_COMPRESSION = 'zstd'
+          'zstd': [
+              'zstandard',
+          ],
+          # ASGI application(caprice/asgi.py)
+          'asgi': [
+              'starlette',
+              'a2wsgi',
+              'uvicorn',
+              'aiosqlite',
+              'asyncpg',
+          ],
+      },
       # 'setup.py test' needs that virtualenv is installed in project.
       tests_require=[
           'tox'
@@ -55,5 +73,7 @@ setup(name='Caprice',
       cmdclass={'test': Tox},
       entry_points="""
       # -*- Entry points: -*-
+      [console_scripts]
+      caprice-migrate = caprice.migrate:main
       """,
       )
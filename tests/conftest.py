@@ -0,0 +1,18 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from caprice.querycount import QueryBudgetChecker
+
+def pytest_configure(config):
+    config.addinivalue_line(
+        'markers', 'no_query_budget: the test repeats statements by design(e.g. retries of blocking lock)')
+
+@pytest.fixture(autouse=True)
+def query_budget_checker(request):
+    """Fail the test when a request exceeds the query budget of its view(See caprice/querycount.py)."""
+    with QueryBudgetChecker() as checker:
+        yield checker
+    if request.node.get_closest_marker('no_query_budget') is None:
+        checker.check()
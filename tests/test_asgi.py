@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import threading
+import time
+
+import pytest
+
+pytest.importorskip('starlette')
+pytest.importorskip('a2wsgi')
+pytest.importorskip('aiosqlite')
+pytest.importorskip('httpx')
+
+from starlette.testclient import TestClient
+
+from caprice import _create_app
+from caprice.asgi import create_asgi_app
+from caprice.models import Schema, Resource, Lock, resource_lock_association
+from caprice.db import Session
+
+@pytest.fixture
+def client(request):
+    class TestConfig(object):
+        TESTING = True
+        DATABASE_URL = 'sqlite:///caprice_test.db'
+        PAGINATION_LIMIT = 2
+    app = _create_app(TestConfig)
+
+    # CleanUp
+    s = Session()
+    s.execute(resource_lock_association.delete())
+    s.query(Schema).delete()
+    s.query(Resource).delete()
+    s.query(Lock).delete()
+    s.commit()
+    Session.remove()
+
+    with TestClient(create_asgi_app(app)) as client:
+        yield client
+
+def _create_resources(client, n):
+    res = client.post('/api/schemas', json={'type': 'object'})
+    schema_id = res.json()['id']
+    ids = [client.post(
+        '/api/schemas/{0}/resources'.format(schema_id), json={'n': i}).json()['id']
+        for i in range(n)]
+    return schema_id, ids
+
+def test_asgi_list(client):
+    schema_id, ids = _create_resources(client, 3)
+
+    res = client.get('/api/schemas/{0}/resources'.format(schema_id))
+    assert res.status_code == 200
+    data = res.json()
+    assert [r['id'] for r in data['resources']] == sorted(ids)[:2]
+    res = client.get('/api/schemas/{0}/resources'.format(schema_id), params={'after': data['next']})
+    assert [r['id'] for r in res.json()['resources']] == sorted(ids)[2:]
+    assert res.json()['next'] is None
+
+    res = client.get('/api/schemas/{0}/resources'.format(schema_id), params={'where': 'n>=1'})
+    assert sorted(r['body']['n'] for r in res.json()['resources']) == [1, 2]
+    res = client.get('/api/schemas/{0}/resources'.format(schema_id), params={'where': 'n'})
+    assert res.status_code == 400
+
+    res = client.get('/api/schemas/unknown/resources')
+    assert res.status_code == 404
+
+def test_asgi_stream(client):
+    schema_id, ids = _create_resources(client, 3)
+
+    res = client.get(
+        '/api/schemas/{0}/resources'.format(schema_id),
+        headers={'accept': 'application/x-ndjson'})
+    assert res.headers['content-type'].startswith('application/x-ndjson')
+    lines = res.text.splitlines()
+    assert sorted(json.loads(l)['id'] for l in lines) == sorted(ids)
+
+    res = client.get('/api/schemas/{0}/resources'.format(schema_id), params={'stream': 'true'})
+    assert len(res.json()['resources']) == 3
+
+def test_asgi_get(client):
+    schema_id, ids = _create_resources(client, 1)
+
+    res = client.get('/api/schemas/{0}/resources/{1}'.format(schema_id, ids[0]))
+    assert res.status_code == 200
+    assert res.json() == {'n': 0}
+    etag = res.headers['etag']
+    res = client.get(
+        '/api/schemas/{0}/resources/{1}'.format(schema_id, ids[0]),
+        headers={'if-none-match': etag})
+    assert res.status_code == 304
+
+    res = client.get('/api/schemas/{0}'.format(schema_id))
+    assert res.json() == {'type': 'object'}
+    res = client.get('/api/schemas/{0}/resources/unknown'.format(schema_id))
+    assert res.status_code == 404
+
+def test_asgi_fields(client):
+    schema_id, ids = _create_resources(client, 3)
+    url = '/api/schemas/{0}/resources'.format(schema_id)
+
+    res = client.get(url, params={'fields': '/n,/missing'})
+    bodies = [r['body'] for r in res.json()['resources']]
+    # PAGINATION_LIMIT is 2.
+    assert len(bodies) == 2
+    assert all(list(body) == ['n'] for body in bodies)
+    res = client.get(url, params={'fields': '/n', 'stream': 'true'})
+    assert sorted(r['body']['n'] for r in res.json()['resources']) == [0, 1, 2]
+
+    res = client.get('{0}/{1}'.format(url, ids[0]), params={'fields': '/missing'})
+    assert res.status_code == 200
+    assert res.json() == {}
+    etag = res.headers['etag']
+    res = client.get(
+        '{0}/{1}'.format(url, ids[0]), params={'fields': '/missing'}, headers={'if-none-match': etag})
+    assert res.status_code == 304
+    res = client.get('{0}/{1}'.format(url, ids[0]), params={'fields': 'n'})
+    assert res.status_code == 400
+
+def test_asgi_lock(client):
+    schema_id, ids = _create_resources(client, 2)
+
+    res = client.post('/api/locks', json={'resources': ids})
+    assert res.status_code == 201
+    lock_id = res.json()['id']
+    # Served by Flask application
+    res = client.get('/api/locks/{0}'.format(lock_id))
+    assert res.status_code == 200
+
+    res = client.post('/api/locks', json={'resources': ids[:1]})
+    assert res.status_code == 409
+    res = client.post('/api/locks', json={'resources': ['unknown']})
+    assert res.status_code == 404
+    for body in ({}, {'resources': [{}]}, {'resources': [['a']]}, [1],
+                 {'resources': ids[:1], 'ttl': None}):
+        res = client.post('/api/locks', json=body)
+        assert res.status_code == 400
+    # Non-finite waits would retry forever on the event loop.
+    for wait in ('nan', 'inf', '-1', 'abc'):
+        start = time.time()
+        res = client.post('/api/locks', params={'wait': wait}, json={'resources': ids[:1]})
+        assert res.status_code == 400
+        assert time.time() - start < 1
+    res = client.post(
+        '/api/locks', content='{{"resources": {0}, "ttl": NaN}}'.format(json.dumps(ids[:1])),
+        headers={'content-type': 'application/json'})
+    assert res.status_code == 400
+
+    def release():
+        time.sleep(0.3)
+        client.delete('/api/locks/{0}'.format(lock_id))
+    releaser = threading.Thread(target=release)
+    releaser.start()
+    start = time.time()
+    res = client.post('/api/locks', params={'wait': 5}, json={'resources': ids[:1]})
+    releaser.join()
+    assert res.status_code == 201
+    assert time.time() - start < 3
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+
+from caprice import _create_app, benchmark
+from caprice.db import Session
+from caprice.models import Schema, ValidationJob, Change, validation_job_invalid_resources
+
+def test_parse_size():
+    assert benchmark.parse_size('1K') == 1000
+    assert benchmark.parse_size('100k') == 100000
+    assert benchmark.parse_size('1M') == 1000000
+    assert benchmark.parse_size('1.5K') == 1500
+    assert benchmark.parse_size('20') == 20
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert benchmark.percentile(values, 50) == 50
+    assert benchmark.percentile(values, 99) == 99
+    assert benchmark.percentile([3], 99) == 3
+    assert benchmark.percentile([], 50) is None
+
+def test_benchmark_main(tmpdir):
+    output = str(tmpdir.join('report.json'))
+    assert benchmark.main([
+        '--database-url', 'sqlite:///caprice_test.db',
+        '--size', '10', '--size', '30',
+        '--requests', '5', '--warmup', '1',
+        '--output', output]) == 0
+
+    with open(output) as f:
+        report = json.load(f)
+    assert report['meta']['dialect'] == 'sqlite'
+    assert [run['size'] for run in report['runs']] == [10, 30]
+    assert report['runs'][1]['resources'] == 30
+    for run in report['runs']:
+        assert sorted(run['operations']) == sorted(benchmark.OPERATIONS)
+        for stats in run['operations'].values():
+            assert stats['requests'] == 5
+            assert stats['errors'] == 0
+            assert stats['p50_ms'] <= stats['p99_ms']
+
+def test_benchmark_clear():
+    class TestConfig(object):
+        TESTING = True
+        DATABASE_URL = 'sqlite:///caprice_test.db'
+    bench = benchmark.Benchmark(_create_app(TestConfig))
+    schema = Schema('bench', {'type': 'object'})
+    schema.save()
+    job = ValidationJob(schema, None)
+    job.save()
+    s = Session()
+    s.execute(validation_job_invalid_resources.insert().values(job_id=job.id, resource_id='r1'))
+    s.commit()
+
+    bench.clear()
+    s = Session()
+    assert s.query(Change).count() == 0
+    assert s.query(ValidationJob).count() == 0
+    assert s.execute(validation_job_invalid_resources.select()).fetchall() == []
+    Session.remove()
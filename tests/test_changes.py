@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+
+import pytest
+
+from caprice import _create_app
+from caprice.models import Schema, Resource, Change
+from caprice.db import Session, transaction
+
+@pytest.fixture
+def client(request):
+    class TestConfig(object):
+        TESTING = True
+        DATABASE_URL = 'sqlite:///caprice_test.db'
+    app = _create_app(TestConfig)
+    client = app.test_client()
+
+    # CleanUp
+    s = Session()
+    s.query(Change).delete()
+    s.query(Schema).delete()
+    s.query(Resource).delete()
+    s.commit()
+    yield client
+    Session.remove()
+
+def _send(client, method, url, value, content_type='application/json'):
+    res = client.open(url, method=method, data=json.dumps(value), headers={'content-type': content_type})
+    return res.status_code, json.loads(res.data.decode('utf-8')) if res.data else None
+
+def _changes(client, query=''):
+    res = client.get('/api/changes' + query)
+    assert res.status_code == 200
+    return json.loads(res.data.decode('utf-8'))
+
+def test_changes(client):
+    # Cursor before this test
+    since = _changes(client)['next']
+
+    status, data = _send(client, 'POST', '/api/schemas', {'type': 'object'})
+    schema_id = data['id']
+    url = '/api/schemas/{0}/resources'.format(schema_id)
+    status, data = _send(client, 'POST', url, {'a': 1})
+    r1 = data['id']
+    status, data = _send(client, 'POST', url + '/batch', [{'a': 2}, {}, {'a': 3}])
+    r2, r3 = data['resources'][0]['id'], data['resources'][2]['id']
+    status, data = _send(
+        client, 'PATCH', '{0}/{1}'.format(url, r1), {'b': 1}, 'application/merge-patch+json')
+    assert status == 200
+    res = client.delete('{0}/{1}'.format(url, r2))
+    assert res.status_code == 204
+    # Failed writes aren't logged.
+    status, data = _send(client, 'POST', url, {})
+    assert status == 400
+    status, data = _send(client, 'PUT', '{0}/{1}'.format(url, r1), {'a': 1})
+    assert status == 400
+
+    data = _changes(client, '?since={0}'.format(since))
+    changes = data['changes']
+    assert [(c['type'], c['id'], c['op']) for c in changes] == [
+        ('schema', schema_id, 'create'),
+        ('resource', r1, 'create'),
+        ('resource', r2, 'create'),
+        ('resource', r3, 'create'),
+        ('resource', r1, 'update'),
+        ('resource', r2, 'delete'),
+    ]
+    seqs = [c['seq'] for c in changes]
+    assert seqs == sorted(seqs) and seqs[0] > since
+    assert data['next'] == seqs[-1]
+    assert all(c['schema_id'] == schema_id for c in changes)
+    res = client.get('{0}/{1}'.format(url, r1))
+    assert changes[4]['etag'] == res.headers['ETag'].strip('"')
+    assert changes[5]['etag'] is None
+
+    # Nothing after the last one
+    assert _changes(client, '?since={0}'.format(data['next'])) == {'changes': [], 'next': data['next']}
+
+    # Pages
+    data = _changes(client, '?since={0}&limit=4'.format(since))
+    assert [c['seq'] for c in data['changes']] == seqs[:4]
+    data = _changes(client, '?since={0}&limit=4'.format(data['next']))
+    assert [c['seq'] for c in data['changes']] == seqs[4:]
+
+    # Changes of a schema
+    status, data = _send(client, 'POST', '/api/schemas', {'type': 'array'})
+    other_id = data['id']
+    status, data = _send(client, 'POST', '/api/schemas/{0}/resources'.format(other_id), [1])
+    orphan_id = data['id']
+    res = client.delete('/api/schemas/{0}'.format(other_id))
+    assert res.status_code == 204
+    data = _changes(client, '?since={0}&schema_id={1}'.format(since, other_id))
+    # Resources of the deleted schema are tombstoned too.
+    assert [(c['type'], c['id'], c['op']) for c in data['changes']] == [
+        ('schema', other_id, 'create'), ('resource', orphan_id, 'create'),
+        ('resource', orphan_id, 'delete'), ('schema', other_id, 'delete')]
+    data = _changes(client, '?since={0}&schema_id={1}'.format(since, schema_id))
+    assert [c['seq'] for c in data['changes']] == seqs
+
+def test_changes_invalid(client):
+    for query in ('?since=a', '?since=-1', '?limit=0', '?since=99999999999999999999',
+                  '?since={0}'.format(2 ** 31)):
+        res = client.get('/api/changes' + query)
+        assert res.status_code == 400
+        assert (json.loads(res.data.decode('utf-8'))
+                == {'error': {'message': 'Request is invalid.'}})
+
+def test_changes_rollback(client):
+    since = _changes(client)['next']
+    with pytest.raises(ValueError):
+        with transaction() as s:
+            Change.record(s, Change.CREATE, 'schema', [('s1', 's1', None)])
+            raise ValueError
+    # Not appended by the next commit
+    with transaction() as s:
+        pass
+    assert _changes(client, '?since={0}'.format(since))['changes'] == []
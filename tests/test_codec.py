@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import math
+
+import pytest
+
+from caprice import _create_app, codec
+from caprice.models import Schema, Resource
+from caprice.db import Session
+from caprice.utils import digest
+
+VALUE = {'name': u'あ', 'n': [1, 2.5, None, True], 'nested': {'b': 1, 'a': 'x'}}
+
+CODECS = ['stdlib']
+try:
+    import orjson
+    CODECS.append('orjson')
+except ImportError:
+    pass
+
+@pytest.fixture(params=CODECS)
+def client(request):
+    class TestConfig(object):
+        TESTING = True
+        DATABASE_URL = 'sqlite:///caprice_test.db'
+        JSON_CODEC = request.param
+    app = _create_app(TestConfig)
+    client = app.test_client()
+
+    # CleanUp
+    s = Session()
+    s.query(Schema).delete()
+    s.query(Resource).delete()
+    s.commit()
+    yield client
+    codec.use('auto')
+
+@pytest.mark.parametrize('name', CODECS)
+def test_codec_body(name):
+    c = codec.use(name)
+    try:
+        assert c.name == name
+        # Stored bodies and their hashes don't depend on the backend.
+        assert c.dump_body(VALUE) == json.dumps(VALUE)
+        assert c.loads(json.dumps(VALUE)) == VALUE
+        assert c.loads(json.dumps(VALUE).encode('utf-8')) == VALUE
+        assert json.loads(c.dumps(VALUE)) == VALUE
+        # Accepted by stdlib
+        assert c.loads('{"big": 123456789012345678901234567890}') == {'big': 123456789012345678901234567890}
+        assert c.loads('{"a": -9999999999999999999}') == {'a': -9999999999999999999}
+        assert c.loads('[18446744073709551615, -9223372036854775809]') == [
+            18446744073709551615, -9223372036854775809]
+        assert c.loads('[9223372036854775807, -9223372036854775808]') == [
+            9223372036854775807, -9223372036854775808]
+        assert math.isnan(c.loads('[NaN]')[0])
+        assert json.loads(c.dumps({'big': 1 << 70})) == {'big': 1 << 70}
+        with pytest.raises(ValueError):
+            c.loads('{"a": ')
+    finally:
+        codec.use('auto')
+
+def test_codec_unknown():
+    with pytest.raises(ValueError):
+        codec.use('unknown')
+
+def test_codec_api(client):
+    res = client.post(
+            '/api/schemas',
+            data=json.dumps({'type': 'object'}),
+            headers={'content-type': 'application/json'})
+    assert res.status_code == 201
+    schema_id = json.loads(res.data.decode('utf-8'))['id']
+
+    res = client.post(
+            '/api/schemas/{0}/resources'.format(schema_id),
+            data=json.dumps(VALUE),
+            headers={'content-type': 'application/json'})
+    assert res.status_code == 201
+    resource_id = json.loads(res.data.decode('utf-8'))['id']
+
+    res = client.get('/api/schemas/{0}/resources/{1}'.format(schema_id, resource_id))
+    assert json.loads(res.data.decode('utf-8')) == VALUE
+    assert res.headers['ETag'] == '"{0}"'.format(digest(json.dumps(VALUE)))
+
+    # Integers out of 64 bits aren't rounded to float.
+    res = client.post(
+            '/api/schemas/{0}/resources'.format(schema_id),
+            data='{"a": -9999999999999999999}',
+            headers={'content-type': 'application/json'})
+    assert res.status_code == 201
+    res = client.get('/api/schemas/{0}/resources/{1}'.format(
+        schema_id, json.loads(res.data.decode('utf-8'))['id']))
+    assert res.data.decode('utf-8') == '{"a": -9999999999999999999}'
+
+    res = client.post(
+            '/api/schemas',
+            data='{"type": ',
+            headers={'content-type': 'application/json'})
+    assert res.status_code == 400
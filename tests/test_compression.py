@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+
+import pytest
+
+from caprice import _create_app, compression
+from caprice.models import Schema, Resource
+from caprice.db import Session
+from caprice.reencode import reencode
+from caprice.utils import digest
+
+LARGE = {'items': [{'name': 'item', 'tags': ['a', 'b', 'c']}] * 100}
+SMALL = {'name': 'small'}
+
+@pytest.fixture
+def client(request):
+    class TestConfig(object):
+        TESTING = True
+        DATABASE_URL = 'sqlite:///caprice_test.db'
+        BODY_COMPRESSION = 'zlib'
+        BODY_COMPRESSION_THRESHOLD = 1024
+    app = _create_app(TestConfig)
+    client = app.test_client()
+
+    # CleanUp
+    s = Session()
+    s.query(Schema).delete()
+    s.query(Resource).delete()
+    s.commit()
+    yield client
+    Session.remove()
+    compression.configure(None)
+
+def _post(client, url, value):
+    res = client.post(url, data=json.dumps(value), headers={'content-type': 'application/json'})
+    return res.status_code, json.loads(res.data.decode('utf-8'))
+
+def test_compression_encode():
+    compression.configure('zlib', threshold=10)
+    try:
+        text = json.dumps(LARGE)
+        body, body_z = compression.encode(text)
+        assert body is None
+        assert body_z[:1] == b'z'
+        assert len(body_z) < len(text)
+        assert compression.decode(body_z) == text
+        assert compression.encode('{"a": 1}') == ('{"a": 1}', None)
+        with pytest.raises(ValueError):
+            compression.decode(b'?abc')
+        with pytest.raises(ValueError):
+            compression.configure('unknown')
+    finally:
+        compression.configure(None)
+
+def test_compression_resource(client):
+    status, data = _post(client, '/api/schemas', {'type': 'object'})
+    schema_id = data['id']
+    status, data = _post(client, '/api/schemas/{0}/resources'.format(schema_id), LARGE)
+    assert status == 201
+    large_id = data['id']
+    status, data = _post(client, '/api/schemas/{0}/resources'.format(schema_id), SMALL)
+    small_id = data['id']
+
+    large = Session.get(Resource, large_id)
+    assert large.body is None
+    assert large.body_z is not None
+    assert large.body_hash == digest(json.dumps(LARGE))
+    small = Session.get(Resource, small_id)
+    assert small.body == json.dumps(SMALL)
+    assert small.body_z is None
+    Session.remove()
+
+    res = client.get('/api/schemas/{0}/resources/{1}'.format(schema_id, large_id))
+    assert json.loads(res.data.decode('utf-8')) == LARGE
+    assert res.headers['ETag'] == '"{0}"'.format(digest(json.dumps(LARGE)))
+    res = client.get('/api/schemas/{0}/resources'.format(schema_id))
+    bodies = [r['body'] for r in json.loads(res.data.decode('utf-8'))['resources']]
+    assert sorted(bodies, key=lambda b: len(json.dumps(b))) == [SMALL, LARGE]
+    # Compressed bodies are projected in Python.
+    res = client.get('/api/schemas/{0}/resources?fields=/name,/items'.format(schema_id))
+    bodies = [r['body'] for r in json.loads(res.data.decode('utf-8'))['resources']]
+    assert sorted(bodies, key=lambda b: len(json.dumps(b))) == [SMALL, LARGE]
+
+    res = client.post(
+            '/api/schemas/{0}/resources/batch'.format(schema_id),
+            data=json.dumps([LARGE]),
+            headers={'content-type': 'application/json'})
+    batch_id = json.loads(res.data.decode('utf-8'))['resources'][0]['id']
+    batch = Session.get(Resource, batch_id)
+    assert batch.body is None
+    assert batch.json == LARGE
+
+def test_compression_where(client):
+    status, data = _post(client, '/api/schemas', {'type': 'object'})
+    url = '/api/schemas/{0}/resources'.format(data['id'])
+    values = [dict(LARGE, n=0), dict(SMALL, n=1), dict(LARGE, n=2), dict(LARGE, n='2'), dict(SMALL, n=3)]
+    ids = [_post(client, url, v)[1]['id'] for v in values]
+    assert Session.get(Resource, ids[2]).body is None
+    Session.remove()
+    expected = sorted(_id for _id, v in zip(ids, values) if v['n'] in (1, 2, 3))
+
+    res = client.get(url + '?where=n>=1')
+    assert sorted(r['id'] for r in json.loads(res.data.decode('utf-8'))['resources']) == expected
+    res = client.get(url + '?where=n>=1&stream=1')
+    assert sorted(r['id'] for r in json.loads(res.data.decode('utf-8'))['resources']) == expected
+    res = client.get(url + '?where=n=2&where=items.0.name=item&fields=/n')
+    data = json.loads(res.data.decode('utf-8'))
+    assert data['resources'] == [{'id': ids[2], 'body': {'n': 2}}]
+    res = client.get(url + '?where=n="2"')
+    assert [r['id'] for r in json.loads(res.data.decode('utf-8'))['resources']] == [ids[3]]
+
+    # Pages may be short, but no rows are skipped.
+    found, after = [], ''
+    while after is not None:
+        res = client.get(url + '?where=n>=1&limit=2' + ('&after=' + after if after else ''))
+        data = json.loads(res.data.decode('utf-8'))
+        assert len(data['resources']) <= 2
+        found.extend(r['id'] for r in data['resources'])
+        after = data['next']
+    assert sorted(found) == expected
+
+def test_compression_reencode(client):
+    compression.configure(None)
+    status, data = _post(client, '/api/schemas', {'type': 'object'})
+    schema_id = data['id']
+    ids = [_post(client, '/api/schemas/{0}/resources'.format(schema_id), v)[1]['id']
+           for v in (LARGE, LARGE, SMALL)]
+    assert all(r.body_z is None for r in Resource.query)
+    Session.remove()
+
+    compression.configure('zlib', threshold=1024)
+    assert reencode(batch_size=2) == {'Schema': 0, 'Resource': 2}
+    assert reencode(batch_size=2) == {'Schema': 0, 'Resource': 0}
+    resources = dict((r.id, r) for r in Resource.query)
+    assert resources[ids[0]].body is None
+    assert resources[ids[0]].json == LARGE
+    assert resources[ids[2]].body == json.dumps(SMALL)
+    Session.remove()
+
+    compression.configure(None)
+    assert reencode() == {'Schema': 0, 'Resource': 2}
+    assert all(r.body_z is None and r.body is not None for r in Resource.query)
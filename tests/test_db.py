@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import gc
+import json
+import os
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from caprice import _create_app, create_app
+from caprice import db
+from caprice.config import settings
+from caprice.models import Schema, Resource
+
+@pytest.fixture
+def client(request):
+    class TestConfig(object):
+        TESTING = True
+        DATABASE_URL = 'sqlite:///caprice_test.db'
+        DATABASE_POOL_SIZE = 2
+        DATABASE_MAX_OVERFLOW = 1
+        DATABASE_POOL_PRE_PING = True
+    app = _create_app(TestConfig)
+    return app.test_client()
+
+def test_engine_options(client):
+    assert db.engine.pool.size() == 2
+    assert db.engine.pool._max_overflow == 1
+    assert db.engine.pool._pre_ping
+    assert isinstance(db.engine.pool, db.InstrumentedQueuePool)
+
+def test_engine_options_memory():
+    options = db._engine_options({'DATABASE_URL': 'sqlite://'})
+    assert 'poolclass' not in options
+
+def test_create_app_pool_conf(monkeypatch):
+    conf = type('Conf', (settings['develop'],), {})
+    monkeypatch.setitem(settings, 'develop', conf)
+    create_app({}, config_key='develop', database_url='sqlite:///caprice_test.db',
+               pool_size='3', pool_pre_ping='false')
+    assert conf.DATABASE_POOL_SIZE == 3
+    assert conf.DATABASE_POOL_PRE_PING is False
+
+def test_pool_stats(client):
+    db.pool_stats.reset()
+    client.get('/api/schemas')
+    res = client.get('/api/pool')
+    assert res.status_code == 200
+    stats = json.loads(res.data.decode('utf-8'))
+    assert stats['checkouts'] >= 1
+    assert stats['size'] == 2
+    assert stats['timeouts'] == 0
+
+def test_after_fork(client):
+    pool = db.engine.pool
+    client.get('/api/schemas')
+    db._after_fork()
+    assert db.engine.pool is not pool
+    assert db.pool_stats.checkouts == 0
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='fork is not available.')
+def test_after_fork_keeps_parent_connection(client):
+    # Connection of the parent is checked out by the session while forking.
+    db.Session().query(Schema).first()
+    r, w = os.pipe()
+
+    def record(*args):
+        if os.getpid() != parent:
+            os.write(w, b'x')
+    parent = os.getpid()
+    events = [(db.engine, 'rollback'), (db.engine.pool, 'reset'), (db.engine.pool, 'checkin')]
+    for target, name in events:
+        event.listen(target, name, record)
+    try:
+        pid = os.fork()
+        if pid == 0:
+            # _after_fork is called by the fork hook.
+            try:
+                db.Session.remove()
+                gc.collect()
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        os.close(w)
+        assert os.read(r, 100) == b''
+    finally:
+        os.close(r)
+        for target, name in events:
+            event.remove(target, name, record)
+        db.Session.remove()
+
+def _clean():
+    s = db.Session()
+    s.query(Resource).delete()
+    s.query(Schema).delete()
+    s.commit()
+
+def test_transaction(client):
+    _clean()
+    commits = []
+    event.listen(db.Session(), 'after_commit', lambda s: commits.append(s))
+
+    with db.transaction() as s:
+        schema = Schema('uow', {'aaa': 1})
+        schema.save()
+        Resource('uow1', {'aaa': 1}, schema).save()
+        Resource('uow2', {'aaa': 2}, schema).save()
+        db.after_commit(s, lambda: commits.append('callback'))
+        assert commits == []
+    assert len(commits) == 2
+    assert commits[1] == 'callback'
+    assert Resource.query.count() == 2
+    db.Session.remove()
+
+def test_transaction_rollback(client):
+    _clean()
+    with pytest.raises(ValueError):
+        with db.transaction() as s:
+            schema = Schema('uow', {'aaa': 1})
+            schema.save()
+            db.after_commit(s, lambda: pytest.fail('Not committed'))
+            Schema('uow', {'aaa': 2}).save()
+    db.Session.remove()
+    assert Schema.query.count() == 0
+
+def test_transaction_per_request(client):
+    _clean()
+    commits = []
+    @event.listens_for(Session, 'after_commit')
+    def count(s):
+        commits.append(s)
+    try:
+        res = client.put(
+                '/api/schemas/uow', 
+                data=json.dumps({'aaa':1}), 
+                headers={'content-type':'application/json'})
+        assert res.status_code == 201
+        assert len(commits) == 1
+        res = client.put(
+                '/api/schemas/uow', 
+                data=json.dumps({'aaa':1}), 
+                headers={'content-type':'application/json'})
+        assert res.status_code == 400
+        assert (json.loads(res.data.decode('utf-8')) 
+                == {'error': {'message': 'This schema ID is already used.'}})
+        assert len(commits) == 1
+    finally:
+        event.remove(Session, 'after_commit', count)
@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+from collections import namedtuple
+
+import pytest
+
+from caprice.fields import parse_fields, Projection
+from caprice.models import Resource
+
+DOC = {'name': 'a', 'user': {'email': 'a@example.com', 'age': 20, 'active': True},
+       'tags': ['x'], 'a/b': None}
+
+def test_parse_fields():
+    assert parse_fields(['/name,/user/email']) == [['name'], ['user', 'email']]
+    assert parse_fields(['/name', '/a~1b', '/~0']) == [['name'], ['a/b'], ['~']]
+    # Duplicated paths and paths under the others
+    assert parse_fields(['/user/email,/user,/name,/name']) == [['user'], ['name']]
+    for value in ('', 'name', '/', '/user/', '/"a"'):
+        with pytest.raises(ValueError):
+            parse_fields([value])
+
+def test_projection_python():
+    # Projected in Python on databases without JSON operators
+    Row = namedtuple('Row', ['id', 'body', 'body_z'])
+    row = Row('r1', json.dumps(DOC), None)
+    projection = Projection(Resource, 'unknown', parse_fields(['/name,/user/age,/user/active,/tags']))
+    assert not projection.in_database
+    assert json.loads(projection.dump(row)) == {
+        'name': 'a', 'user': {'age': 20, 'active': True}, 'tags': ['x']}
+    # Missing paths are omitted. Paths don't pick array elements.
+    projection = Projection(Resource, 'unknown', parse_fields(['/a~1b,/user/x,/tags/0,/name/x']))
+    assert json.loads(projection.dump(row)) == {'a/b': None}
+    projection = Projection(Resource, 'unknown', parse_fields(['/zzz']))
+    assert projection.dump(row) == '{}'
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import os
+
+import pytest
+from sqlalchemy import Column, Integer, MetaData, String, Table, create_engine, select
+from sqlalchemy.dialects import postgresql
+
+from caprice.filters import parse_where, compile_where, _match
+
+BODIES = [
+    {'a': 1}, {'a': 1.0}, {'a': 2}, {'a': '1'}, {'a': 'b'}, {'a': 'B'}, {'a': '\u00e9'},
+    {'a': True}, {'a': False}, {'a': None}, {}, {'a': [1]}, {'a': {'b': 1}}, [1],
+]
+
+# Filter -> indexes of the matched bodies
+SEMANTICS = {
+    'a=1': [0, 1],
+    'a!=1': [2, 3, 4, 5, 6, 7, 8, 11, 12],
+    'a>=1': [0, 1, 2],
+    'a<2': [0, 1],
+    'a="1"': [3],
+    'a>a': [4, 6],
+    'a<b': [3, 5],
+    'a=true': [7],
+    'a!=true': [0, 1, 2, 3, 4, 5, 6, 8, 11, 12],
+    'a<true': [8],
+    'a=null': [9, 10, 13],
+    'a!=null': [0, 1, 2, 3, 4, 5, 6, 7, 8, 11, 12],
+    'a.0=1': [11],
+    'a.b>0': [12],
+}
+
+def _matched(engine):
+    table = Table('filter_bodies', MetaData(), Column('id', Integer, primary_key=True),
+                  Column('body', String))
+    table.create(bind=engine)
+    try:
+        with engine.begin() as conn:
+            conn.execute(table.insert(), [{'id': i, 'body': json.dumps(b)} for i, b in enumerate(BODIES)])
+            return dict((expr, [r for (r,) in conn.execute(
+                select(table.c.id).where(compile_where(
+                    table.c.body, engine.dialect.name, *parse_where(expr))).order_by(table.c.id))])
+                for expr in SEMANTICS)
+    finally:
+        table.drop(bind=engine)
+
+def test_parse_where():
+    assert parse_where('aaa=1') == (['aaa'], '=', 1)
+    assert parse_where('aaa.bbb>=1.5') == (['aaa', 'bbb'], '>=', 1.5)
+    assert parse_where('aaa!=foo') == (['aaa'], '!=', 'foo')
+    assert parse_where('aaa="1"') == (['aaa'], '=', '1')
+    assert parse_where('aaa=true') == (['aaa'], '=', True)
+    assert parse_where('aaa.0<x=y') == (['aaa', '0'], '<', 'x=y')
+    assert parse_where('aaa=null') == (['aaa'], '=', None)
+    for expr in ['aaa', '=1', 'aaa..bbb=1', 'aaa={"b": 1}', 'aaa<null', 'a"a=1']:
+        with pytest.raises(ValueError):
+            parse_where(expr)
+
+def test_compile_where_postgresql():
+    body = Table('t', MetaData(), Column('body', String)).c.body
+    sql = str(compile_where(body, 'postgresql', ['aaa', 'bbb'], '=', 1).compile(
+        dialect=postgresql.dialect()))
+    assert sql.startswith('CAST(t.body AS JSONB) @> ')
+    sql = str(compile_where(body, 'postgresql', ['aaa', 'bbb'], '>', 1).compile(
+        dialect=postgresql.dialect()))
+    assert 'CAST(t.body AS JSONB) #> ' in sql
+    assert ' > CAST(' in sql
+
+def test_compile_where_unsupported():
+    body = Table('t', MetaData(), Column('body', String)).c.body
+    with pytest.raises(ValueError):
+        compile_where(body, 'mysql', ['aaa'], '=', 1)
+
+def test_where_semantics_python():
+    for expr, expected in SEMANTICS.items():
+        assert [i for i, b in enumerate(BODIES) if _match(b, *parse_where(expr))] == expected, expr
+
+def test_where_semantics_sqlite():
+    assert _matched(create_engine('sqlite://')) == SEMANTICS
+
+@pytest.mark.skipif(not os.environ.get('CAPRICE_TEST_POSTGRESQL_URL'),
+                    reason='CAPRICE_TEST_POSTGRESQL_URL is not set.')
+def test_where_semantics_postgresql():
+    assert _matched(create_engine(os.environ['CAPRICE_TEST_POSTGRESQL_URL'])) == SEMANTICS
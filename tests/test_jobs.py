@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+from caprice import _create_app
+from caprice.models import Schema, Resource, ValidationJob, JobLeaseLostError
+from caprice.models import validation_job_invalid_resources
+from caprice.db import Session
+from caprice.jobs import JobRunner, validate_chunk, _mp_context
+
+SCHEMA = {'type': 'object', 'properties': {'a': {'type': 'integer'}}}
+# Stricter schema: only even numbers are valid.
+CANDIDATE = {'type': 'object', 'properties': {'a': {'type': 'integer', 'multipleOf': 2}}}
+
+@pytest.fixture
+def client(request):
+    class TestConfig(object):
+        TESTING = True
+        DATABASE_URL = 'sqlite:///caprice_test.db'
+    app = _create_app(TestConfig)
+    client = app.test_client()
+
+    # CleanUp
+    s = Session()
+    s.execute(validation_job_invalid_resources.delete())
+    s.query(ValidationJob).delete()
+    s.query(Schema).delete()
+    s.query(Resource).delete()
+    s.commit()
+    yield client
+    Session.remove()
+
+def _setup(client, size):
+    res = client.post(
+            '/api/schemas',
+            data=json.dumps(SCHEMA),
+            headers={'content-type': 'application/json'})
+    schema_id = json.loads(res.data.decode('utf-8'))['id']
+    res = client.post(
+            '/api/schemas/{0}/resources/batch'.format(schema_id),
+            data=json.dumps([{'a': i} for i in range(size)]),
+            headers={'content-type': 'application/json'})
+    ids = [r['id'] for r in json.loads(res.data.decode('utf-8'))['resources']]
+    # ID of the resources with odd numbers
+    return schema_id, sorted(_id for i, _id in enumerate(ids) if i % 2)
+
+def _create_job(client, schema_id, body):
+    res = client.post(
+            '/api/schemas/{0}/validation-jobs'.format(schema_id),
+            data=json.dumps(body),
+            headers={'content-type': 'application/json'})
+    assert res.status_code == 202
+    return json.loads(res.data.decode('utf-8'))['id'], res.headers['Location']
+
+def test_validate_chunk():
+    schema = json.dumps(CANDIDATE)
+    rows = [('r1', '{"a": 2}', None), ('r2', '{"a": 1}', None), ('r3', '{}', None)]
+    assert validate_chunk(schema, rows) == ['r2', 'r3']
+
+def test_validation_job(client):
+    schema_id, odd_ids = _setup(client, 7)
+    job_id, location = _create_job(client, schema_id, {'schema': CANDIDATE})
+    res = client.get(location)
+    assert res.status_code == 200
+    data = json.loads(res.data.decode('utf-8'))
+    assert data['status'] == 'pending'
+    assert data['processed'] == 0
+
+    assert JobRunner(1, processes=0, chunk_size=2).run_once()
+    assert not JobRunner(1, processes=0, chunk_size=2).run_once()
+
+    res = client.get(location)
+    data = json.loads(res.data.decode('utf-8'))
+    assert data['status'] == 'done'
+    assert (data['total'], data['processed'], data['invalid_count']) == (7, 7, 3)
+    assert data['finished_at']
+
+    res = client.get(location + '/invalid-resources?limit=2')
+    data = json.loads(res.data.decode('utf-8'))
+    assert data['resources'] == odd_ids[:2]
+    res = client.get(location + '/invalid-resources?limit=2&after={0}'.format(data['next']))
+    data = json.loads(res.data.decode('utf-8'))
+    assert data['resources'] == odd_ids[2:]
+    assert data['next'] is None
+
+    # The current schema. All resources are valid.
+    job_id, location = _create_job(client, schema_id, {})
+    assert JobRunner(1, processes=0).run_once()
+    data = json.loads(client.get(location).data.decode('utf-8'))
+    assert (data['status'], data['invalid_count']) == ('done', 0)
+
+    res = client.get('/api/schemas/{0}/validation-jobs'.format(schema_id))
+    jobs = json.loads(res.data.decode('utf-8'))['jobs']
+    assert [job['id'] for job in jobs] == sorted(job['id'] for job in jobs)
+    assert len(jobs) == 2
+    res = client.get('/api/schemas/{0}/validation-jobs?limit=1&after={1}'.format(
+        schema_id, jobs[0]['id']))
+    assert [job['id'] for job in json.loads(res.data.decode('utf-8'))['jobs']] == [jobs[1]['id']]
+    for after in ('abc', '1.5', str(2 ** 31)):
+        res = client.get('/api/schemas/{0}/validation-jobs?after={1}'.format(schema_id, after))
+        assert res.status_code == 400
+
+def test_validation_job_process_pool(client):
+    schema_id, odd_ids = _setup(client, 20)
+    job_id, location = _create_job(client, schema_id, {'schema': CANDIDATE})
+    assert JobRunner(1, processes=2, chunk_size=3).run_once()
+    data = json.loads(client.get(location).data.decode('utf-8'))
+    assert (data['status'], data['processed'], data['invalid_count']) == ('done', 20, 10)
+    res = client.get(location + '/invalid-resources')
+    assert json.loads(res.data.decode('utf-8'))['resources'] == odd_ids
+
+def test_process_pool_start_method():
+    assert _mp_context().get_start_method() in ('forkserver', 'spawn')
+
+def test_validation_job_lease(client):
+    schema_id, odd_ids = _setup(client, 4)
+    job_id, location = _create_job(client, schema_id, {'schema': CANDIDATE})
+
+    job = ValidationJob.claim(lease=60)
+    assert job.id == job_id
+    # Held by the runner
+    assert ValidationJob.claim(lease=60) is None
+    rows = job.next_chunk(schema_id, None, 2)
+    job.record(rows[-1][0], 2, validate_chunk(job.schema_body, rows), lease=60)
+    Session.remove()
+
+    # The runner stopped. Another runner takes over after the lease.
+    s = Session()
+    s.query(ValidationJob).update({ValidationJob.locked_until: datetime.utcnow() - timedelta(seconds=1)})
+    s.commit()
+    assert JobRunner(1, processes=0).run_once()
+    with pytest.raises(JobLeaseLostError):
+        job.finish(ValidationJob.DONE)
+
+    data = json.loads(client.get(location).data.decode('utf-8'))
+    # Resumed after the recorded chunk.
+    assert (data['status'], data['processed'], data['invalid_count']) == ('done', 4, 2)
+    res = client.get(location + '/invalid-resources')
+    assert json.loads(res.data.decode('utf-8'))['resources'] == odd_ids
+
+def test_validation_job_invalid(client):
+    schema_id, odd_ids = _setup(client, 1)
+    res = client.post(
+            '/api/schemas/{0}/validation-jobs'.format(schema_id),
+            data=json.dumps({'schema': {'type': 'obj'}}),
+            headers={'content-type': 'application/json'})
+    assert res.status_code == 400
+    assert (json.loads(res.data.decode('utf-8'))
+            == {'error': {'message': 'Schema is invalid.'}})
+    res = client.post(
+            '/api/schemas/{0}/validation-jobs'.format(schema_id),
+            data=json.dumps([1]),
+            headers={'content-type': 'application/json'})
+    assert res.status_code == 400
+    res = client.post(
+            '/api/schemas/unknown/validation-jobs',
+            headers={'content-type': 'application/json'})
+    assert res.status_code == 404
+    res = client.get('/api/schemas/{0}/validation-jobs/1'.format(schema_id))
+    assert res.status_code == 404
+    res = client.get('/api/schemas/{0}/validation-jobs/1/invalid-resources'.format(schema_id))
+    assert res.status_code == 404
+    for job_id in (2 ** 31, 99999999999999999999):
+        res = client.get('/api/schemas/{0}/validation-jobs/{1}'.format(schema_id, job_id))
+        assert res.status_code == 404
+        res = client.get('/api/schemas/{0}/validation-jobs/{1}/invalid-resources'.format(
+            schema_id, job_id))
+        assert res.status_code == 404
+    res = client.get('/api/schemas/unknown/validation-jobs')
+    assert res.status_code == 404
+    assert (json.loads(res.data.decode('utf-8'))
+            == {'error': {'message': "Schema isn't found."}})
@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from collections import namedtuple
+
+import pytest
+from sqlalchemy import BigInteger, Column, Integer, MetaData, String, Table
+
+from caprice.listing import page_limit, key_value, page, dump_list
+
+table = Table('t', MetaData(), Column('id', Integer), Column('big', BigInteger), Column('name', String))
+Row = namedtuple('Row', ['id', 'raw_json'])
+
+def test_page_limit():
+    config = {'PAGINATION_LIMIT': 10, 'PAGINATION_MAX_LIMIT': 100}
+    assert page_limit(None, config) == 10
+    assert page_limit('5', config) == 5
+    assert page_limit('1000', config) == 100
+    for value in ('0', '-1', 'a', '1.5'):
+        with pytest.raises(ValueError):
+            page_limit(value, config)
+
+def test_key_value():
+    assert key_value('abc', table.c.name) == 'abc'
+    assert key_value('12', table.c.id) == 12
+    assert key_value(str(2 ** 31), table.c.big) == 2 ** 31
+    for value, key in (('a', table.c.id), (str(2 ** 31), table.c.id), (str(2 ** 63), table.c.big)):
+        with pytest.raises(ValueError):
+            key_value(value, key)
+
+def test_page():
+    rows = [Row('a', '{}'), Row('b', '[1]'), Row('c', '{}')]
+    assert page(rows, 2, table.c.id) == (rows[:2], 'b')
+    assert page(rows, 3, table.c.id) == (rows, None)
+    assert dump_list('items', rows[:2], 'b') == (
+        '{"items": [{"id": "a", "body": {}}, {"id": "b", "body": [1]}], "next": "b"}')
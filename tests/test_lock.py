@@ -3,13 +3,21 @@
 
 import uuid
 import json
+import sys
+import threading
+import types
+import time
+from datetime import datetime, timedelta
 
 import pytest
 from sqlalchemy.orm import joinedload
 
 from caprice import _create_app
-from caprice.models import Schema, Resource, Lock
+from caprice.models import Schema, Resource, Lock, resource_lock_association
 from caprice.db import Session
+from caprice.params import lock_ttl
+from caprice import sweeper
+from caprice.sweeper import Sweeper
 
 @pytest.fixture
 def client(request):
@@ -22,6 +30,7 @@ def client(request):
     # CleanUp
     # TODO: should use mock for DB?
     s = Session()
+    s.execute(resource_lock_association.delete())
     s.query(Schema).delete()
     s.query(Resource).delete()
     s.query(Lock).delete()
@@ -62,3 +71,281 @@ def test_lock_registration(client):
     assert len(lock.resources) == 2
     assert lock.resources[0].json in [r.json for r in schema_resources]
     assert lock.resources[1].json in [r.json for r in schema_resources]
+
+def _create_resources(client, count):
+    res = client.post(
+            '/api/schemas', 
+            data=json.dumps({'aaa':1}), 
+            headers={'content-type':'application/json'})
+    schema_id = json.loads(res.data.decode('utf-8'))['id']
+    res = client.post(
+            '/api/schemas/{0}/resources/batch'.format(schema_id), 
+            data=json.dumps([{'aaa': i} for i in range(count)]), 
+            headers={'content-type':'application/json'})
+    return [r['id'] for r in json.loads(res.data.decode('utf-8'))['resources']]
+
+def test_lock_registration_conflict(client):
+    resource_ids = _create_resources(client, 3)
+    res = client.post(
+            '/api/locks',
+            data=json.dumps({'resources': resource_ids[:2]}), 
+            headers={'content-type':'application/json'})
+    assert res.status_code == 201
+
+    res = client.post(
+            '/api/locks',
+            data=json.dumps({'resources': resource_ids[1:]}), 
+            headers={'content-type':'application/json'})
+    assert res.status_code == 409
+    assert (json.loads(res.data.decode('utf-8')) 
+            == {'error': {'message': 'Resource {0} is already locked.'.format(resource_ids[1])}})
+    # Nothing is locked by the rejected request.
+    res = client.post(
+            '/api/locks',
+            data=json.dumps({'resources': resource_ids[2:]}), 
+            headers={'content-type':'application/json'})
+    assert res.status_code == 201
+
+def test_lock_registration_notfound_resource(client):
+    resource_ids = _create_resources(client, 1)
+    res = client.post(
+            '/api/locks',
+            data=json.dumps({'resources': resource_ids + ['notfound']}), 
+            headers={'content-type':'application/json'})
+    assert res.status_code == 404
+    assert (json.loads(res.data.decode('utf-8')) 
+            == {'error': {'message': "Resource notfound isn't found."}})
+
+def test_lock_registration_invalid_data(client):
+    for data in [json.dumps({}), json.dumps({'resources': []}), json.dumps({'resources': 'a'}), '',
+                 json.dumps({'resources': [{}]}), json.dumps({'resources': [['a']]}),
+                 json.dumps({'resources': [1]}), json.dumps({'resources': [None]}), json.dumps([1])]:
+        res = client.post(
+                '/api/locks',
+                data=data, 
+                headers={'content-type':'application/json'})
+        assert res.status_code == 400
+        assert (json.loads(res.data.decode('utf-8')) 
+                == {'error': {'message': 'Request is invalid.'}})
+
+def test_lock_registration_many_resources(client):
+    resource_ids = _create_resources(client, 2000)
+    res = client.post(
+            '/api/locks',
+            data=json.dumps({'resources': resource_ids}), 
+            headers={'content-type':'application/json'})
+    assert res.status_code == 201
+    lock_id = json.loads(res.data.decode('utf-8'))['id']
+    assert len(Lock.query.filter(Lock.id==lock_id).first().resources) == 2000
+
+def _expire(lock_id):
+    s = Session()
+    s.query(Lock).filter(Lock.id==lock_id).update(
+        {Lock.expires_at: datetime.utcnow() - timedelta(seconds=1)})
+    s.commit()
+
+def test_lock_lease(client):
+    resource_ids = _create_resources(client, 2)
+    res = client.post(
+            '/api/locks',
+            data=json.dumps({'resources': resource_ids, 'ttl': 60}), 
+            headers={'content-type':'application/json'})
+    assert res.status_code == 201
+    lock_id = json.loads(res.data.decode('utf-8'))['id']
+
+    res = client.get('/api/locks/{0}'.format(lock_id))
+    assert res.status_code == 200
+    lock = json.loads(res.data.decode('utf-8'))
+    assert lock['id'] == lock_id
+    assert sorted(lock['resources']) == sorted(resource_ids)
+    assert lock['expires_at']
+
+    res = client.put(
+            '/api/locks/{0}'.format(lock_id),
+            data=json.dumps({'ttl': 120}), 
+            headers={'content-type':'application/json'})
+    assert res.status_code == 200
+    assert json.loads(res.data.decode('utf-8'))['expires_at'] > lock['expires_at']
+
+    res = client.put(
+            '/api/locks/{0}'.format(lock_id),
+            data=json.dumps({'ttl': -1}), 
+            headers={'content-type':'application/json'})
+    assert res.status_code == 400
+    # Clients can't make the lock permanent.
+    for data in (json.dumps([1]), json.dumps({'ttl': None}), json.dumps(None), '[]', 'abc'):
+        res = client.put(
+                '/api/locks/{0}'.format(lock_id),
+                data=data,
+                headers={'content-type':'application/json'})
+        assert res.status_code == 400
+    res = client.post(
+            '/api/locks',
+            data=json.dumps({'resources': resource_ids, 'ttl': None}),
+            headers={'content-type':'application/json'})
+    assert res.status_code == 400
+    # Heartbeat without body
+    res = client.put('/api/locks/{0}'.format(lock_id))
+    assert res.status_code == 200
+
+    # Expired lock doesn't hold resources, and can't be renewed.
+    _expire(lock_id)
+    res = client.get('/api/locks/{0}'.format(lock_id))
+    assert res.status_code == 404
+    res = client.put(
+            '/api/locks/{0}'.format(lock_id),
+            data=json.dumps({'ttl': 60}), 
+            headers={'content-type':'application/json'})
+    assert res.status_code == 404
+    res = client.post(
+            '/api/locks',
+            data=json.dumps({'resources': resource_ids}), 
+            headers={'content-type':'application/json'})
+    assert res.status_code == 201
+
+def test_lock_ttl_param():
+    config = {'LOCK_TTL': 60, 'LOCK_MAX_TTL': 3600}
+    assert lock_ttl({}, config) == 60
+    assert lock_ttl({'ttl': 7200}, config) == 3600
+    # Permanent locks only by config
+    assert lock_ttl({}, {'LOCK_TTL': None}) is None
+    for body in ({'ttl': None}, [1], None):
+        with pytest.raises(ValueError):
+            lock_ttl(body, config)
+        with pytest.raises(ValueError):
+            lock_ttl(body, {'LOCK_TTL': None})
+
+def test_lock_delete(client):
+    resource_ids = _create_resources(client, 1)
+    res = client.post(
+            '/api/locks',
+            data=json.dumps({'resources': resource_ids}), 
+            headers={'content-type':'application/json'})
+    lock_id = json.loads(res.data.decode('utf-8'))['id']
+
+    res = client.delete('/api/locks/{0}'.format(lock_id))
+    assert res.status_code == 204
+    assert not Lock.query.filter(Lock.id==lock_id).first()
+    res = client.delete('/api/locks/{0}'.format(lock_id))
+    assert res.status_code == 404
+    assert (json.loads(res.data.decode('utf-8')) 
+            == {'error': {'message': "Lock isn't found."}})
+    for method in ('GET', 'PUT', 'DELETE'):
+        res = client.open('/api/locks/{0}'.format(2 ** 31), method=method)
+        assert res.status_code == 404
+        res = client.open('/api/locks/99999999999999999999', method=method)
+        assert res.status_code == 404
+
+    # Released resources can be locked again.
+    res = client.post(
+            '/api/locks',
+            data=json.dumps({'resources': resource_ids}), 
+            headers={'content-type':'application/json'})
+    assert res.status_code == 201
+
+def test_lock_sweep(client):
+    resource_ids = _create_resources(client, 5)
+    lock_ids = []
+    for r_id in resource_ids:
+        res = client.post(
+                '/api/locks',
+                data=json.dumps({'resources': [r_id], 'ttl': 60}), 
+                headers={'content-type':'application/json'})
+        lock_ids.append(json.loads(res.data.decode('utf-8'))['id'])
+    for lock_id in lock_ids[:3]:
+        _expire(lock_id)
+
+    assert Sweeper(interval=1, batch_size=2).sweep() == 3
+    assert sorted(l.id for l in Lock.query.all()) == sorted(lock_ids[3:])
+    s = Session()
+    assert (sorted(r_id for r_id, _ in s.execute(resource_lock_association.select()))
+            == sorted(resource_ids[3:]))
+    assert Lock.sweep() == 0
+
+def test_lock_sweeper_start(monkeypatch):
+    class TestConfig(object):
+        TESTING = True
+        DATABASE_URL = 'sqlite:///caprice_test.db'
+        LOCK_SWEEP_INTERVAL = 60
+    started, hooks = [], []
+    monkeypatch.setattr(sweeper, 'start', started.append)
+    # uWSGI master before fork
+    monkeypatch.setitem(sys.modules, 'uwsgi', types.SimpleNamespace(worker_id=lambda: 0))
+    monkeypatch.setitem(sys.modules, 'uwsgidecorators', types.SimpleNamespace(postfork=hooks.append))
+    app = _create_app(TestConfig)
+    assert started == []
+    # In the workers
+    for hook in hooks:
+        hook()
+    assert started == [app]
+
+    # Standalone runners
+    hooks[:] = []
+    _create_app(TestConfig, background_threads=False)
+    assert hooks == []
+    Session.remove()
+
+@pytest.mark.no_query_budget
+def test_lock_wait(client):
+    resource_ids = _create_resources(client, 1)
+    res = client.post(
+            '/api/locks',
+            data=json.dumps({'resources': resource_ids}), 
+            headers={'content-type':'application/json'})
+    lock_id = json.loads(res.data.decode('utf-8'))['id']
+
+    # Timeout
+    start = time.time()
+    res = client.post(
+            '/api/locks?wait=0.3',
+            data=json.dumps({'resources': resource_ids}), 
+            headers={'content-type':'application/json'})
+    assert res.status_code == 409
+    assert time.time() - start >= 0.3
+
+    # Woken up by release
+    def release():
+        Lock.release(lock_id)
+        Session.remove()
+    threading.Timer(0.3, release).start()
+    start = time.time()
+    res = client.post(
+            '/api/locks?wait=10',
+            data=json.dumps({'resources': resource_ids}), 
+            headers={'content-type':'application/json'})
+    assert res.status_code == 201
+    assert time.time() - start < 5
+
+    # The resource is held. Invalid waits are rejected without waiting.
+    for wait in ('abc', 'nan', 'inf', '-inf', '-1'):
+        start = time.time()
+        res = client.post(
+                '/api/locks?wait={0}'.format(wait),
+                data=json.dumps({'resources': resource_ids}), 
+                headers={'content-type':'application/json'})
+        assert res.status_code == 400
+        assert time.time() - start < 1
+    for ttl in ('NaN', 'Infinity'):
+        res = client.post(
+                '/api/locks',
+                data='{{"resources": {0}, "ttl": {1}}}'.format(json.dumps(resource_ids), ttl), 
+                headers={'content-type':'application/json'})
+        assert res.status_code == 400
+
+@pytest.mark.no_query_budget
+def test_lock_wait_expiry(client):
+    resource_ids = _create_resources(client, 1)
+    res = client.post(
+            '/api/locks',
+            data=json.dumps({'resources': resource_ids, 'ttl': 0.5}), 
+            headers={'content-type':'application/json'})
+    assert res.status_code == 201
+
+    # Expiry isn't notified, but the waiter retries at the expiry.
+    start = time.time()
+    res = client.post(
+            '/api/locks?wait=10',
+            data=json.dumps({'resources': resource_ids}), 
+            headers={'content-type':'application/json'})
+    assert res.status_code == 201
+    assert time.time() - start < 5
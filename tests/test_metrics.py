@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import subprocess
+import sys
+import types
+
+import pytest
+
+from caprice import _create_app
+from caprice.metrics import Metrics, metrics, collect, render
+from caprice.models import Schema, Resource
+from caprice.db import Session
+
+@pytest.fixture
+def client(request):
+    class TestConfig(object):
+        TESTING = True
+        DATABASE_URL = 'sqlite:///caprice_test.db'
+    app = _create_app(TestConfig)
+    client = app.test_client()
+
+    # CleanUp
+    s = Session()
+    s.query(Schema).delete()
+    s.query(Resource).delete()
+    s.commit()
+    metrics.reset()
+    return client
+
+def test_render():
+    m = Metrics()
+    m.inc('caprice_http_requests_total', (('route', '/api/schemas'), ('method', 'GET'), ('status', '200')))
+    m.observe('caprice_http_request_duration_seconds', (('route', '/api/schemas'), ('method', 'GET')), 0.003)
+    m.observe('caprice_http_request_duration_seconds', (('route', '/api/schemas'), ('method', 'GET')), 20)
+    text = render({
+        'counters': dict(m.counters), 'gauges': dict(m.gauges), 'histograms': dict(m.histograms)})
+
+    assert '# TYPE caprice_http_requests_total counter' in text
+    assert 'caprice_http_requests_total{route="/api/schemas",method="GET",status="200"} 1' in text
+    labels = 'route="/api/schemas",method="GET"'
+    assert 'caprice_http_request_duration_seconds_bucket{%s,le="0.001"} 0' % labels in text
+    assert 'caprice_http_request_duration_seconds_bucket{%s,le="0.005"} 1' % labels in text
+    assert 'caprice_http_request_duration_seconds_bucket{%s,le="10.0"} 1' % labels in text
+    assert 'caprice_http_request_duration_seconds_bucket{%s,le="+Inf"} 2' % labels in text
+    assert 'caprice_http_request_duration_seconds_count{%s} 2' % labels in text
+
+def test_metrics_endpoint(client):
+    client.post(
+        '/api/schemas',
+        data=json.dumps({'aaa': 1}),
+        headers={'content-type': 'application/json'})
+    client.get('/api/schemas/unknown')
+    client.get('/api/unknown')
+
+    res = client.get('/api/metrics')
+    assert res.status_code == 200
+    assert res.headers['content-type'].startswith('text/plain; version=0.0.4')
+    text = res.data.decode('utf-8')
+    assert 'caprice_http_requests_total{route="/api/schemas",method="POST",status="201"} 1' in text
+    assert 'caprice_http_requests_total{route="/api/schemas/<string:_id>",method="GET",status="404"} 1' in text
+    assert 'caprice_http_requests_total{route="unmatched",method="GET",status="404"} 1' in text
+    # The request for metrics is in flight.
+    assert 'caprice_http_requests_in_flight 1' in text
+    assert any(l.startswith('caprice_db_statements_total ') for l in text.splitlines())
+
+def test_collect_directory(tmpdir):
+    m = Metrics()
+    m.inc('caprice_db_statements_total', (), 3)
+    m.add('caprice_http_requests_in_flight', (), 2)
+    snapshot = m.snapshot()
+    # Exited worker
+    proc = subprocess.Popen([sys.executable, '-c', 'pass'])
+    proc.wait()
+    snapshot['pid'] = proc.pid
+    with open(str(tmpdir.join('metrics_{0}.json'.format(proc.pid))), 'w') as f:
+        json.dump(snapshot, f)
+
+    metrics.reset()
+    metrics.inc('caprice_db_statements_total', (), 4)
+    metrics.add('caprice_http_requests_in_flight', (), 1)
+    collected = collect(str(tmpdir))
+    assert os.path.exists(str(tmpdir.join('metrics_{0}.json'.format(os.getpid()))))
+    assert collected['counters'][('caprice_db_statements_total', ())] == 7
+    # Gauges of exited workers are dropped.
+    assert collected['gauges'][('caprice_http_requests_in_flight', ())] == 1
+
+def test_clear_directory(tmpdir, monkeypatch):
+    class TestConfig(object):
+        TESTING = True
+        DATABASE_URL = 'sqlite:///caprice_test.db'
+        METRICS_DIR = str(tmpdir)
+    tmpdir.join('metrics_1.json').write('{}')
+    # Standalone runners and lazy-apps workers keep them.
+    _create_app(TestConfig)
+    assert tmpdir.join('metrics_1.json').exists()
+    monkeypatch.setitem(sys.modules, 'uwsgi', types.SimpleNamespace(worker_id=lambda: 1))
+    _create_app(TestConfig)
+    assert tmpdir.join('metrics_1.json').exists()
+    # uWSGI master
+    monkeypatch.setitem(sys.modules, 'uwsgi', types.SimpleNamespace(worker_id=lambda: 0))
+    _create_app(TestConfig)
+    assert tmpdir.listdir() == []
+    Session.remove()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import logging
+
+import pytest
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.exc import IntegrityError
+
+from caprice.migrate import upgrade
+
+@pytest.fixture
+def engine(tmpdir):
+    engine = create_engine('sqlite:///{0}'.format(tmpdir.join('caprice_migrate.db')))
+    # Tables before indexes/hash columns are added.
+    with engine.begin() as conn:
+        conn.execute(text('CREATE TABLE schemas (id VARCHAR PRIMARY KEY, body VARCHAR)'))
+        conn.execute(text(
+            'CREATE TABLE resources (id VARCHAR PRIMARY KEY, body VARCHAR, '
+            'schema_id VARCHAR REFERENCES schemas(id))'))
+        conn.execute(text('CREATE TABLE locks (id INTEGER PRIMARY KEY)'))
+        conn.execute(text(
+            'CREATE TABLE resource_lock_association ('
+            'resource_id VARCHAR REFERENCES resources(id), lock_id INTEGER REFERENCES locks(id))'))
+        conn.execute(text("INSERT INTO schemas VALUES ('s1', '{\"aaa\": 1}')"))
+    return engine
+
+def test_upgrade(engine, caplog):
+    caplog.set_level(logging.INFO, logger='caprice.migrate')
+    upgrade(engine)
+    # Indexes of PostgreSQL aren't created(nor logged) on SQLite.
+    assert 'Create index: ix_resources_schema_id' in caplog.messages
+    assert 'Create index: ix_resources_body_jsonb' not in caplog.messages
+    inspector = inspect(engine)
+    assert 'body_hash' in [c['name'] for c in inspector.get_columns('schemas')]
+    assert 'body_hash' in [c['name'] for c in inspector.get_columns('resources')]
+    indexes = dict((i['name'], i) for i in inspector.get_indexes('resources'))
+    assert indexes['ix_resources_schema_id']['column_names'] == ['schema_id']
+    indexes = dict((i['name'], i) for i in inspector.get_indexes('resource_lock_association'))
+    assert indexes['ux_resource_lock_association_resource_id']['unique']
+    assert 'ix_resource_lock_association_lock_id' in indexes
+
+    # Existing rows are kept.
+    with engine.connect() as conn:
+        assert conn.execute(text('SELECT id FROM schemas')).scalar() == 's1'
+
+    # Upgrade is idempotent.
+    upgrade(engine)
+
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO resource_lock_association VALUES ('r1', 1)"))
+    with pytest.raises(IntegrityError):
+        with engine.begin() as conn:
+            conn.execute(text("INSERT INTO resource_lock_association VALUES ('r1', 2)"))
+
+def test_upgrade_lock_association(engine):
+    # Duplicated rows of old databases, and the superseded index.
+    with engine.begin() as conn:
+        conn.execute(text(
+            'CREATE INDEX ux_resource_lock_association_resource_id_lock_id '
+            'ON resource_lock_association (resource_id, lock_id)'))
+        conn.execute(text('INSERT INTO locks VALUES (1), (2), (3)'))
+        conn.execute(text(
+            "INSERT INTO resource_lock_association VALUES "
+            "('r1', 1), ('r1', 3), ('r1', 3), ('r1', 2), ('r2', 1), ('r3', 2)"))
+    upgrade(engine)
+    indexes = dict((i['name'], i) for i in inspect(engine).get_indexes('resource_lock_association'))
+    assert 'ux_resource_lock_association_resource_id_lock_id' not in indexes
+    assert indexes['ux_resource_lock_association_resource_id']['unique']
+    # The newest lock holds the resource.
+    with engine.connect() as conn:
+        rows = conn.execute(text(
+            'SELECT resource_id, lock_id FROM resource_lock_association ORDER BY resource_id')).fetchall()
+    assert [tuple(r) for r in rows] == [('r1', 3), ('r2', 1), ('r3', 2)]
+
+def test_upgrade_canonical_hash(engine):
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO schemas VALUES ('s2', '{ \"aaa\": 1 }')"))
+        conn.execute(text("INSERT INTO schemas VALUES ('s3', '{\"bbb\": 1}')"))
+    upgrade(engine)
+    with engine.connect() as conn:
+        hashes = dict(conn.execute(text('SELECT id, canonical_hash FROM schemas')).fetchall())
+    assert hashes['s1'] is not None
+    assert hashes['s2'] is None
+    assert hashes['s3'] not in (None, hashes['s1'])
+    indexes = dict((i['name'], i) for i in inspect(engine).get_indexes('schemas'))
+    assert indexes['ux_schemas_canonical_hash']['unique']
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import copy
+
+import pytest
+
+from caprice.patch import json_patch, merge_patch, PatchError, PatchConflictError
+from caprice.validators import is_valid_change, validator_cache
+
+def test_json_patch():
+    doc = {'foo': 'bar', 'baz': [1, 2], 'nested': {'a': {'b': 1}}}
+    original = copy.deepcopy(doc)
+
+    value, keys = json_patch(doc, [
+        {'op': 'add', 'path': '/baz/1', 'value': 'x'},
+        {'op': 'remove', 'path': '/foo'},
+        {'op': 'replace', 'path': '/nested/a/b', 'value': 2},
+        {'op': 'copy', 'from': '/nested/a', 'path': '/copied'},
+        {'op': 'move', 'from': '/copied/b', 'path': '/moved'},
+        {'op': 'test', 'path': '/baz', 'value': [1, 'x', 2.0]},
+        {'op': 'add', 'path': '/a~1b', 'value': None},
+    ])
+    assert value == {
+        'baz': [1, 'x', 2], 'nested': {'a': {'b': 2}}, 'copied': {}, 'moved': 2, 'a/b': None}
+    assert keys == set(['baz', 'foo', 'nested', 'copied', 'moved', 'a/b'])
+    # The original isn't modified.
+    assert doc == original
+
+    assert json_patch(doc, [{'op': 'replace', 'path': '', 'value': [1]}]) == ([1], None)
+
+def test_json_patch_error():
+    doc = {'foo': [1], 'bar': True}
+    with pytest.raises(PatchConflictError):
+        json_patch(doc, [{'op': 'test', 'path': '/bar', 'value': 1}])
+    for op in [
+            {'op': 'remove', 'path': '/baz'},
+            {'op': 'replace', 'path': '/foo/1', 'value': 1},
+            {'op': 'add', 'path': '/foo/01', 'value': 1},
+            {'op': 'add', 'path': '/baz/a', 'value': 1},
+            {'op': 'move', 'from': '/foo', 'path': '/foo/0'},
+            ]:
+        with pytest.raises(PatchError):
+            json_patch(doc, [op])
+    for op in [
+            {'op': 'add', 'path': 'foo', 'value': 1},
+            {'op': 'add', 'path': '/foo'},
+            {'op': 'copy', 'path': '/foo'},
+            {'op': 'unknown', 'path': '/foo'},
+            ]:
+        with pytest.raises(ValueError) as e:
+            json_patch(doc, [op])
+        assert not isinstance(e.value, PatchError)
+
+def test_merge_patch():
+    # Examples of RFC 7396
+    doc = {'title': 'Goodbye!', 'author': {'givenName': 'John', 'familyName': 'Doe'},
+           'tags': ['example', 'sample'], 'content': 'This will be unchanged'}
+    value, keys = merge_patch(doc, {
+        'title': 'Hello!', 'phoneNumber': '+01-123-456-7890',
+        'author': {'familyName': None}, 'tags': ['example']})
+    assert value == {'title': 'Hello!', 'author': {'givenName': 'John'}, 'tags': ['example'],
+                     'content': 'This will be unchanged', 'phoneNumber': '+01-123-456-7890'}
+    assert keys == set(['title', 'phoneNumber', 'author', 'tags'])
+    assert doc['author'] == {'givenName': 'John', 'familyName': 'Doe'}
+
+    assert merge_patch({'a': 'b'}, ['c']) == (['c'], None)
+    assert merge_patch({'a': [{'b': 'c'}]}, {'a': [1]})[0] == {'a': [1]}
+    assert merge_patch({'e': None}, {'a': 1})[0] == {'e': None, 'a': 1}
+
+class _Schema(object):
+
+    def __init__(self, id, json):
+        self.id = id
+        self.json = json
+        self.etag = id
+
+def test_is_valid_change():
+    schema = _Schema('patch-test', {
+        'type': 'object',
+        'properties': {'a': {'type': 'integer'}, 'b': {'type': 'string'}},
+        'required': ['a'],
+        'additionalProperties': False})
+    validator = validator_cache.get(schema)
+    calls = []
+    validator_cache._validators[(schema.id, schema.etag)] = type(
+        'Spy', (object,), {
+            'is_valid': lambda self, value: calls.append(value) or validator.is_valid(value),
+            'evolve': lambda self, **kw: validator.evolve(**kw)})()
+    try:
+        # Only the changed property is validated.
+        assert is_valid_change(schema, {'a': 1, 'b': 'x'}, set(['b']))
+        assert not is_valid_change(schema, {'a': 1, 'b': 2}, set(['b']))
+        assert calls == []
+        # Removed required property, unknown property and replaced document are fully validated.
+        assert not is_valid_change(schema, {'b': 'x'}, set(['a']))
+        assert not is_valid_change(schema, {'a': 1, 'c': 1}, set(['c']))
+        assert is_valid_change(schema, {'a': 1}, None)
+        assert len(calls) == 3
+    finally:
+        validator_cache.invalidate(schema.id)
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import uuid
+
+import pytest
+from flask import Blueprint
+
+from caprice import _create_app
+from caprice.models import Schema, Resource
+from caprice.db import Session
+from caprice.querycount import QueryCounter, QueryBudgetChecker, QueryBudgetError, query_budget
+
+@pytest.fixture
+def app(request):
+    class TestConfig(object):
+        TESTING = True
+        DATABASE_URL = 'sqlite:///caprice_test.db'
+    app = _create_app(TestConfig)
+
+    # N+1 on purpose
+    bp = Blueprint('querycount_test', __name__)
+    @bp.route('/schemas')
+    @query_budget({'GET': 2})
+    def schemas():
+        return json.dumps([[r.id for r in schema.resources] for schema in Schema.query.all()])
+    app.register_blueprint(bp, url_prefix='/test')
+
+    # CleanUp
+    s = Session()
+    s.query(Schema).delete()
+    s.query(Resource).delete()
+    s.commit()
+    return app
+
+def _create_schemas(client, n):
+    for i in range(n):
+        res = client.post(
+                '/api/schemas',
+                data=json.dumps({'type': 'object', 'title': str(uuid.uuid4())}),
+                headers={'content-type': 'application/json'})
+        schema_id = json.loads(res.data.decode('utf-8'))['id']
+        client.post(
+                '/api/schemas/{0}/resources'.format(schema_id),
+                data=json.dumps({'aaa': i}),
+                headers={'content-type': 'application/json'})
+
+def test_query_counter(app):
+    client = app.test_client()
+    _create_schemas(client, 3)
+    Session.remove()
+
+    with QueryCounter() as counter:
+        for schema in Schema.query.all():
+            schema.resources
+    assert counter.count == 4
+    assert list(counter.repeated().values()) == [3]
+
+@pytest.mark.no_query_budget
+def test_query_budget(app):
+    client = app.test_client()
+    _create_schemas(client, 1)
+    with QueryBudgetChecker() as checker:
+        client.get('/test/schemas')
+    checker.check()
+
+    _create_schemas(client, 2)
+    with QueryBudgetChecker() as checker:
+        client.get('/test/schemas')
+        # Budgets of the API are kept.
+        client.get('/api/schemas')
+    assert len(checker.violations) == 2
+    assert 'GET /test/schemas(querycount_test.schemas): 4 statements exceed the budget 2' in checker.violations[0]
+    assert 'repeated 3 times' in checker.violations[1]
+    with pytest.raises(QueryBudgetError):
+        checker.check()
@@ -308,3 +308,363 @@ def test_resource_delete(client):
     assert res.status_code == 404
     assert (json.loads(res.data.decode('utf-8')) 
             == {'error': {'message': "Resource isn't found."}})
+
+def test_resource_list_pagination(client):
+    res = client.post(
+            '/api/schemas', 
+            data=json.dumps({'schema':1}), 
+            headers={'content-type':'application/json'})
+    schema_id = json.loads(res.data.decode('utf-8'))['id']
+    ids = ['resource{0}'.format(i) for i in range(3)]
+    for resource_id in ids:
+        client.put(
+                '/api/schemas/{0}/resources/{1}'.format(schema_id, resource_id),
+                data=json.dumps({'aaa':1}), 
+                headers={'content-type':'application/caprise+json'})
+
+    res = client.get('/api/schemas/{0}/resources?limit=2'.format(schema_id))
+    assert res.status_code == 200
+    page = json.loads(res.data.decode('utf-8'))
+    assert [r['id'] for r in page['resources']] == ids[:2]
+    assert page['next'] == ids[1]
+
+    res = client.get('/api/schemas/{0}/resources?limit=2&after={1}'.format(schema_id, page['next']))
+    page = json.loads(res.data.decode('utf-8'))
+    assert [r['id'] for r in page['resources']] == ids[2:]
+    assert page['next'] is None
+
+def test_resource_list_stream(client):
+    res = client.post(
+            '/api/schemas', 
+            data=json.dumps({'schema':1}), 
+            headers={'content-type':'application/json'})
+    schema_id = json.loads(res.data.decode('utf-8'))['id']
+
+    res = client.get('/api/schemas/{0}/resources?stream=true'.format(schema_id))
+    assert res.status_code == 200
+    assert json.loads(res.data.decode('utf-8')) == {'resources': []}
+
+    ids = ['resource{0}'.format(i) for i in range(3)]
+    for i, resource_id in enumerate(ids):
+        client.put(
+                '/api/schemas/{0}/resources/{1}'.format(schema_id, resource_id),
+                data=json.dumps({'aaa':i}), 
+                headers={'content-type':'application/caprise+json'})
+
+    res = client.get('/api/schemas/{0}/resources?stream=true'.format(schema_id))
+    assert res.status_code == 200
+    assert res.mimetype == 'application/json'
+    resources = json.loads(res.data.decode('utf-8'))['resources']
+    assert [r['id'] for r in resources] == ids
+    assert [r['body'] for r in resources] == [{'aaa': i} for i in range(3)]
+
+    res = client.get(
+            '/api/schemas/{0}/resources?after={1}'.format(schema_id, ids[0]),
+            headers={'accept': 'application/x-ndjson'})
+    assert res.status_code == 200
+    assert res.mimetype == 'application/x-ndjson'
+    lines = res.data.decode('utf-8').splitlines()
+    assert [json.loads(l)['id'] for l in lines] == ids[1:]
+
+def test_resource_batch(client):
+    schema = {
+        '$schema': 'http://json-schema.org/draft-04/schema#',
+        'type': 'object',
+        'required': ['field1']
+    }
+    res = client.post(
+            '/api/schemas', 
+            data=json.dumps(schema), 
+            headers={'content-type':'application/json'})
+    schema_id = json.loads(res.data.decode('utf-8'))['id']
+
+    # JSON array
+    res = client.post(
+            '/api/schemas/{0}/resources/batch'.format(schema_id), 
+            data=json.dumps([{'field1': 1}, {'bbb': 1}, {}, {'field1': 2}]), 
+            headers={'content-type':'application/json'})
+    assert res.status_code == 200
+    results = json.loads(res.data.decode('utf-8'))['resources']
+    assert len(results) == 4
+    assert results[1] == {'error': {'message': 'Resource is invalid.'}}
+    assert results[2] == {'error': {'message': 'Resource is invalid.'}}
+    resource = Resource.query.filter(Resource.id==results[0]['id']).first()
+    assert resource.json == {'field1': 1}
+    assert resource.schema_id == schema_id
+    resource = Resource.query.filter(Resource.id==results[3]['id']).first()
+    assert resource.json == {'field1': 2}
+
+    # NDJSON
+    res = client.post(
+            '/api/schemas/{0}/resources/batch'.format(schema_id), 
+            data='{"field1": 3}\n\nnotjson\n{"field1": 4}\n',
+            headers={'content-type':'application/x-ndjson'})
+    assert res.status_code == 200
+    results = json.loads(res.data.decode('utf-8'))['resources']
+    assert len(results) == 3
+    assert 'id' in results[0]
+    assert results[1] == {'error': {'message': 'Resource is invalid.'}}
+    assert 'id' in results[2]
+
+    res = client.get('/api/schemas/{0}/resources'.format(schema_id))
+    assert len(json.loads(res.data.decode('utf-8'))['resources']) == 4
+
+def test_resource_batch_invalid(client):
+    res = client.post(
+            '/api/schemas/notfoundschema/resources/batch', 
+            data=json.dumps([{'aaa':1}]), 
+            headers={'content-type':'application/json'})
+    assert res.status_code == 404
+    assert (json.loads(res.data.decode('utf-8'))
+            == {'error': {'message': "Schema isn't found."}})
+
+    res = client.post(
+            '/api/schemas', 
+            data=json.dumps({'schema':1}), 
+            headers={'content-type':'application/json'})
+    schema_id = json.loads(res.data.decode('utf-8'))['id']
+    for data in [json.dumps({'aaa': 1}), json.dumps([]), '']:
+        res = client.post(
+                '/api/schemas/{0}/resources/batch'.format(schema_id), 
+                data=data, 
+                headers={'content-type':'application/json'})
+        assert res.status_code == 400
+        assert (json.loads(res.data.decode('utf-8')) 
+                == {'error': {'message': 'Request is invalid.'}})
+
+def test_resource_get_raw(client):
+    res = client.post(
+            '/api/schemas', 
+            data=json.dumps({'schema':1}), 
+            headers={'content-type':'application/json'})
+    schema_id = json.loads(res.data.decode('utf-8'))['id']
+
+    resource_id = 'testraw'
+    res = client.put(
+            '/api/schemas/{0}/resources/{1}'.format(schema_id, resource_id),
+            data=json.dumps({'aaa': [1, 2], 'bbb': 'ccc'}), 
+            headers={'content-type':'application/caprise+json'})
+    res = client.get('/api/schemas/{0}/resources/{1}'.format(schema_id, resource_id))
+    assert res.status_code == 200
+    assert res.mimetype == 'application/json'
+    resource = Resource.query.filter(Resource.id==resource_id).first()
+    assert res.data.decode('utf-8') == resource.body
+
+def test_resource_get_etag(client):
+    res = client.post(
+            '/api/schemas', 
+            data=json.dumps({'schema':1}), 
+            headers={'content-type':'application/json'})
+    schema_id = json.loads(res.data.decode('utf-8'))['id']
+
+    resource_id = 'testetag'
+    res = client.put(
+            '/api/schemas/{0}/resources/{1}'.format(schema_id, resource_id),
+            data=json.dumps({'aaa': 1}), 
+            headers={'content-type':'application/caprise+json'})
+    res = client.get('/api/schemas/{0}/resources/{1}'.format(schema_id, resource_id))
+    assert res.status_code == 200
+    etag = res.headers['ETag']
+    resource = Resource.query.filter(Resource.id==resource_id).first()
+    assert etag == '"{0}"'.format(resource.body_hash)
+
+    res = client.get(
+            '/api/schemas/{0}/resources/{1}'.format(schema_id, resource_id),
+            headers={'if-none-match': etag})
+    assert res.status_code == 304
+    assert res.headers['ETag'] == etag
+    assert res.data == b''
+
+    res = client.get(
+            '/api/schemas/{0}/resources/{1}'.format(schema_id, resource_id),
+            headers={'if-none-match': '"stale"'})
+    assert res.status_code == 200
+    assert json.loads(res.data.decode('utf-8')) == {'aaa': 1}
+
+    res = client.get(
+            '/api/schemas/{0}/resources/notfound'.format(schema_id),
+            headers={'if-none-match': etag})
+    assert res.status_code == 404
+
+def test_resource_list_where(client):
+    res = client.post(
+            '/api/schemas', 
+            data=json.dumps({'schema':1}), 
+            headers={'content-type':'application/json'})
+    schema_id = json.loads(res.data.decode('utf-8'))['id']
+    resources = [
+        {'name': 'foo', 'age': 10, 'tags': ['a'], 'user': {'active': True}},
+        {'name': 'bar', 'age': 20, 'tags': ['b'], 'user': {'active': False}},
+        {'name': 'baz', 'age': 30, 'tags': ['a'], 'user': {'active': True}},
+    ]
+    for i, resource in enumerate(resources):
+        client.put(
+                '/api/schemas/{0}/resources/r{1}'.format(schema_id, i),
+                data=json.dumps(resource), 
+                headers={'content-type':'application/caprise+json'})
+
+    def ids(query):
+        res = client.get('/api/schemas/{0}/resources?{1}'.format(schema_id, query))
+        assert res.status_code == 200
+        return [r['id'] for r in json.loads(res.data.decode('utf-8'))['resources']]
+
+    assert ids('where=name=foo') == ['r0']
+    assert ids('where=name!=foo') == ['r1', 'r2']
+    assert ids('where=age>=20') == ['r1', 'r2']
+    assert ids('where=age>10&where=age<30') == ['r1']
+    assert ids('where=user.active=true') == ['r0', 'r2']
+    assert ids('where=tags.0=a') == ['r0', 'r2']
+    assert ids('where=missing=1') == []
+    assert ids('where=age>=20&stream=true') == ['r1', 'r2']
+
+    res = client.get('/api/schemas/{0}/resources?where=age'.format(schema_id))
+    assert res.status_code == 400
+    assert (json.loads(res.data.decode('utf-8')) 
+            == {'error': {'message': 'Filter is invalid.'}})
+
+def test_resource_patch(client):
+    res = client.post(
+            '/api/schemas', 
+            data=json.dumps({
+                'type': 'object',
+                'properties': {
+                    'name': {'type': 'string'},
+                    'tags': {'type': 'array', 'items': {'type': 'string'}}},
+                'required': ['name']}), 
+            headers={'content-type':'application/json'})
+    schema_id = json.loads(res.data.decode('utf-8'))['id']
+    res = client.post(
+            '/api/schemas/{0}/resources'.format(schema_id), 
+            data=json.dumps({'name': 'a', 'tags': ['x']}), 
+            headers={'content-type':'application/json'})
+    resource_id = json.loads(res.data.decode('utf-8'))['id']
+    url = '/api/schemas/{0}/resources/{1}'.format(schema_id, resource_id)
+
+    # JSON Patch
+    res = client.patch(
+            url,
+            data=json.dumps([
+                {'op': 'test', 'path': '/name', 'value': 'a'},
+                {'op': 'add', 'path': '/tags/-', 'value': 'y'},
+                {'op': 'replace', 'path': '/name', 'value': 'b'}]),
+            headers={'content-type':'application/json-patch+json'})
+    assert res.status_code == 200
+    etag = res.headers['ETag']
+    res = client.get(url)
+    assert json.loads(res.data.decode('utf-8')) == {'name': 'b', 'tags': ['x', 'y']}
+    assert res.headers['ETag'] == etag
+
+    # Merge Patch
+    res = client.patch(
+            url,
+            data=json.dumps({'tags': None, 'note': 'n'}),
+            headers={'content-type':'application/merge-patch+json'})
+    assert res.status_code == 200
+    res = client.get(url)
+    assert json.loads(res.data.decode('utf-8')) == {'name': 'b', 'note': 'n'}
+
+    # Failed test operation
+    res = client.patch(
+            url,
+            data=json.dumps([
+                {'op': 'replace', 'path': '/name', 'value': 'c'},
+                {'op': 'test', 'path': '/name', 'value': 'b'}]),
+            headers={'content-type':'application/json-patch+json'})
+    assert res.status_code == 409
+    # Path doesn't exist
+    res = client.patch(
+            url,
+            data=json.dumps([{'op': 'remove', 'path': '/tags/0'}]),
+            headers={'content-type':'application/json-patch+json'})
+    assert res.status_code == 422
+    # Invalid by schema
+    res = client.patch(
+            url,
+            data=json.dumps([{'op': 'add', 'path': '/tags', 'value': [1]}]),
+            headers={'content-type':'application/json-patch+json'})
+    assert res.status_code == 400
+    assert (json.loads(res.data.decode('utf-8')) 
+            == {'error': {'message': 'Resource is invalid.'}})
+    res = client.patch(
+            url,
+            data=json.dumps({'name': None}),
+            headers={'content-type':'application/merge-patch+json'})
+    assert res.status_code == 400
+    # Malformed patch
+    res = client.patch(
+            url,
+            data=json.dumps([{'op': 'unknown', 'path': '/name'}]),
+            headers={'content-type':'application/json-patch+json'})
+    assert res.status_code == 400
+    res = client.patch(
+            url,
+            data=json.dumps({'name': 'c'}),
+            headers={'content-type':'application/json'})
+    assert res.status_code == 415
+    assert 'application/merge-patch+json' in res.headers['Accept-Patch']
+    res = client.patch(
+            '/api/schemas/{0}/resources/unknown'.format(schema_id),
+            data=json.dumps({'name': 'c'}),
+            headers={'content-type':'application/merge-patch+json'})
+    assert res.status_code == 404
+
+    # Nothing is changed by failed patches.
+    res = client.get(url)
+    assert json.loads(res.data.decode('utf-8')) == {'name': 'b', 'note': 'n'}
+
+def test_resource_fields(client):
+    res = client.post(
+            '/api/schemas',
+            data=json.dumps({'type': 'object'}),
+            headers={'content-type':'application/json'})
+    schema_id = json.loads(res.data.decode('utf-8'))['id']
+    docs = [
+        {'name': 'a', 'user': {'email': 'a@example.com', 'age': 20, 'admin': True}, 'tags': ['x']},
+        {'name': 'b', 'user': 'unknown', 'note': u'あ'},
+    ]
+    ids = [json.loads(client.post(
+            '/api/schemas/{0}/resources'.format(schema_id),
+            data=json.dumps(doc),
+            headers={'content-type':'application/json'}).data.decode('utf-8'))['id']
+           for doc in docs]
+    url = '/api/schemas/{0}/resources'.format(schema_id)
+    expected = {
+        ids[0]: {'name': 'a', 'user': {'age': 20, 'admin': True}, 'tags': ['x']},
+        ids[1]: {'name': 'b'},
+    }
+
+    res = client.get(url + '?fields=/name,/user/age,/user/admin&fields=/tags,/missing')
+    assert res.status_code == 200
+    items = json.loads(res.data.decode('utf-8'))['resources']
+    assert dict((item['id'], item['body']) for item in items) == expected
+
+    res = client.get(url + '?fields=/name,/user/age,/user/admin,/tags&limit=1')
+    data = json.loads(res.data.decode('utf-8'))
+    assert [item['id'] for item in data['resources']] == sorted(ids)[:1]
+    assert data['next'] == sorted(ids)[0]
+
+    res = client.get(
+            url + '?fields=/name,/user/age,/user/admin,/tags',
+            headers={'accept': 'application/x-ndjson'})
+    items = [json.loads(line) for line in res.data.decode('utf-8').splitlines()]
+    assert dict((item['id'], item['body']) for item in items) == expected
+
+    res = client.get('{0}/{1}?fields=/note,/user'.format(url, ids[1]))
+    assert res.status_code == 200
+    assert json.loads(res.data.decode('utf-8')) == {'note': u'あ', 'user': 'unknown'}
+    etag = res.headers['ETag']
+    assert etag != client.get('{0}/{1}'.format(url, ids[1])).headers['ETag']
+    res = client.get('{0}/{1}?fields=/note,/user'.format(url, ids[1]), headers={'If-None-Match': etag})
+    assert res.status_code == 304
+    res = client.get('{0}/{1}?fields=/note'.format(url, ids[1]), headers={'If-None-Match': etag})
+    assert res.status_code == 200
+
+    res = client.get('{0}/{1}?fields=/name'.format(url, 'unknown'))
+    assert res.status_code == 404
+    for query in ('?fields=name', '?fields=/a//b', '?fields='):
+        res = client.get(url + query)
+        assert res.status_code == 400
+        assert (json.loads(res.data.decode('utf-8'))
+                == {'error': {'message': 'Fields are invalid.'}})
+        res = client.get('{0}/{1}{2}'.format(url, ids[0], query))
+        assert res.status_code == 400
@@ -9,6 +9,7 @@ import pytest
 from caprice import _create_app
 from caprice.models import Schema
 from caprice.db import Session
+from caprice.utils import digest
 
 @pytest.fixture
 def client(request):
@@ -37,11 +38,41 @@ def test_schema_registration(client):
     # 'application/xxxx+json'
     res = client.post(
             '/api/schemas', 
-            data=json.dumps({'aaa':1}), 
+            data=json.dumps({'aaa':2}), 
             headers={'content-type':'application/caprise+json'})
     assert res.status_code == 201
     assert uuid.UUID(json.loads(res.data.decode('utf-8'))['id'])    
 
+def test_schema_registration_same(client):
+    res = client.post(
+            '/api/schemas', 
+            data=json.dumps({'aaa':1, 'bbb':[1, 2]}), 
+            headers={'content-type':'application/json'})
+    assert res.status_code == 201
+    _id = json.loads(res.data.decode('utf-8'))['id']
+
+    # Key order and whitespace don't matter.
+    res = client.post(
+            '/api/schemas', 
+            data='{"bbb": [1,2], "aaa": 1}', 
+            headers={'content-type':'application/json'})
+    assert res.status_code == 200
+    assert json.loads(res.data.decode('utf-8'))['id'] == _id
+    assert Schema.query.count() == 1
+
+    res = client.post(
+            '/api/schemas', 
+            data=json.dumps({'aaa':1, 'bbb':[2, 1]}), 
+            headers={'content-type':'application/json'})
+    assert res.status_code == 201
+
+    res = client.put(
+            '/api/schemas/testid', 
+            data=json.dumps({'aaa':1, 'bbb':[1, 2]}), 
+            headers={'content-type':'application/json'})
+    assert res.status_code == 409
+    assert json.loads(res.data.decode('utf-8'))['id'] == _id
+
 def test_schema_registration_with_id(client):
     _id = 'testid'
     res = client.put(
@@ -225,3 +256,58 @@ def test_schema_delete(client):
     assert res.status_code == 404
     assert (json.loads(res.data.decode('utf-8')) 
             == {'error': {'message': "Schema isn't found."}})
+
+def test_schema_list_pagination(client):
+    ids = ['schema{0}'.format(i) for i in range(5)]
+    for i, _id in enumerate(ids):
+        client.put(
+                '/api/schemas/{0}'.format(_id), 
+                data=json.dumps({'aaa':i}), 
+                headers={'content-type':'application/caprise+json'})
+
+    res = client.get('/api/schemas?limit=2')
+    assert res.status_code == 200
+    page = json.loads(res.data.decode('utf-8'))
+    assert [s['id'] for s in page['schemas']] == ids[:2]
+    assert page['next'] == ids[1]
+
+    res = client.get('/api/schemas?limit=2&after={0}'.format(page['next']))
+    page = json.loads(res.data.decode('utf-8'))
+    assert [s['id'] for s in page['schemas']] == ids[2:4]
+
+    res = client.get('/api/schemas?limit=2&after={0}'.format(page['next']))
+    page = json.loads(res.data.decode('utf-8'))
+    assert [s['id'] for s in page['schemas']] == ids[4:]
+    assert page['next'] is None
+
+    res = client.get('/api/schemas?limit=0')
+    assert res.status_code == 400
+    assert (json.loads(res.data.decode('utf-8')) 
+            == {'error': {'message': 'Request is invalid.'}})
+    res = client.get('/api/schemas?limit=abc')
+    assert res.status_code == 400
+
+def test_schema_json_cache():
+    schema = Schema('cached', {'aaa': 1})
+    value = schema.json
+    assert schema.json is value
+    assert schema.raw_json == json.dumps({'aaa': 1})
+
+    schema.json = {'aaa': 2}
+    assert schema.json == {'aaa': 2}
+    schema.body = json.dumps({'aaa': 3})
+    assert schema.json == {'aaa': 3}
+    assert schema.raw_json == schema.body
+    assert schema.etag == digest(schema.body)
+
+def test_schema_get_etag(client):
+    _id = 'testetag'
+    client.put(
+            '/api/schemas/{0}'.format(_id), 
+            data=json.dumps({'aaa':1}), 
+            headers={'content-type':'application/caprise+json'})
+    res = client.get('/api/schemas/{0}'.format(_id))
+    assert res.status_code == 200
+    etag = res.headers['ETag']
+    res = client.get('/api/schemas/{0}'.format(_id), headers={'if-none-match': etag})
+    assert res.status_code == 304
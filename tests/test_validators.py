@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pytest
+from jsonschema import ValidationError
+
+from caprice.models import Schema
+from caprice.validators import ValidatorCache
+
+def test_validator_cache_hit():
+    cache = ValidatorCache()
+    schema = Schema('schema1', {'type': 'object', 'required': ['aaa']})
+    validator = cache.get(schema)
+    assert cache.get(schema) is validator
+    assert len(cache) == 1
+    validator.validate({'aaa': 1})
+    with pytest.raises(ValidationError):
+        validator.validate({'bbb': 1})
+
+def test_validator_cache_replaced_schema():
+    cache = ValidatorCache()
+    schema = Schema('schema1', {'type': 'object'})
+    validator = cache.get(schema)
+    schema.json = {'type': 'array'}
+    assert cache.get(schema) is not validator
+
+def test_validator_cache_eviction():
+    cache = ValidatorCache(maxsize=2)
+    schemas = [Schema('schema{0}'.format(i), {'type': 'object'}) for i in range(3)]
+    validator = cache.get(schemas[0])
+    cache.get(schemas[1])
+    # Touch schema0, so schema1 is the least recently used.
+    cache.get(schemas[0])
+    cache.get(schemas[2])
+    assert len(cache) == 2
+    assert cache.get(schemas[0]) is validator
+
+def test_validator_cache_invalidate():
+    cache = ValidatorCache()
+    schema = Schema('schema1', {'type': 'object'})
+    validator = cache.get(schema)
+    cache.invalidate('schema1')
+    assert len(cache) == 0
+    assert cache.get(schema) is not validator